@@ -0,0 +1,77 @@
+"""
+Token-mode chunking: chunk budget check and throughput.
+
+Chunks synthetic pages with TokenSpanChunker over a small in-memory WordPiece
+tokenizer whose vocabulary splits most words into several subword pieces, then
+tokenizes every emitted chunk again and checks that
+
+- no chunk exceeds --max-tokens (so the embedding model never truncates one), and
+- spans.token_counts matches the re-tokenized length of each chunk,
+
+reporting chunk count, token-count percentiles and pages per second. Exits
+non-zero when a check fails.
+
+Usage:
+    python -m benchmarks.bench_chunker [--pages 200] [--max-tokens 50] [--overlap 8]
+"""
+import argparse
+import random
+import string
+import sys
+import time
+
+from src.backend.services.chunker import TokenSpanChunker
+from benchmarks.fixtures import WORDS, random_text
+
+
+def toy_wordpiece():
+    """A fast WordPiece tokenizer that knows only a few whole words, plus single characters."""
+    from tokenizers import Tokenizer, models, normalizers, pre_tokenizers
+    from transformers import PreTrainedTokenizerFast
+
+    vocab = ["[UNK]", "[CLS]", "[SEP]", "[PAD]"]
+    vocab += list(string.ascii_lowercase + string.digits + string.punctuation)
+    vocab += ["##" + c for c in string.ascii_lowercase + string.digits]
+    vocab += WORDS[::3] + ["##" + w[2:] for w in WORDS[1::3]]
+    backend = Tokenizer(models.WordPiece({tok: i for i, tok in enumerate(vocab)}, unk_token="[UNK]"))
+    backend.normalizer = normalizers.BertNormalizer(lowercase=True)
+    backend.pre_tokenizer = pre_tokenizers.BertPreTokenizer()
+    return PreTrainedTokenizerFast(
+        tokenizer_object=backend, unk_token="[UNK]", cls_token="[CLS]", sep_token="[SEP]", pad_token="[PAD]"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--words-per-page", type=int, default=300)
+    parser.add_argument("--max-tokens", type=int, default=50)
+    parser.add_argument("--overlap", type=int, default=8)
+    args = parser.parse_args()
+
+    tokenizer = toy_wordpiece()
+    rng = random.Random(0)
+    pages = [(p, random_text(rng, args.words_per_page) + ".") for p in range(1, args.pages + 1)]
+
+    chunker = TokenSpanChunker(tokenizer, max_tokens=args.max_tokens, overlap_tokens=args.overlap)
+    t0 = time.perf_counter()
+    chunks = []
+    for page in pages:
+        chunks.extend(chunker.feed_pages([page]))
+    chunks.extend(chunker.finish())
+    elapsed = time.perf_counter() - t0
+
+    lengths = [len(ids) for ids in tokenizer(chunks, add_special_tokens=False)["input_ids"]]
+    over = sum(length > args.max_tokens for length in lengths)
+    mismatched = sum(a != b for a, b in zip(lengths, chunker.spans.token_counts))
+    ordered = sorted(lengths)
+    print(f"pages: {args.pages}  chunks: {len(chunks)}  {args.pages / elapsed:,.0f} pages/s")
+    print(f"tokens per chunk: min {ordered[0]}  p50 {ordered[len(ordered) // 2]}  max {ordered[-1]}"
+          f"  (budget {args.max_tokens})")
+    print(f"over budget: {over}  token_counts mismatches: {mismatched}")
+    if over or mismatched or len(lengths) != len(chunker.spans.token_counts):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Compare embedding backends: PyTorch SentenceTransformer vs ONNX Runtime (float and int8).
+
+Reports texts/second for each backend and the cosine agreement of the ONNX
+vectors with the PyTorch ones. Exits with status 1 when any backend's minimum
+cosine falls below --min-cosine, so it doubles as a parity check after export.
+
+Export the ONNX model first:
+    python -m src.backend.services.onnx_embedding all-MiniLM-L6-v2 <onnx_dir> --quantize
+
+Usage:
+    python -m benchmarks.bench_embedding_backends [--onnx-dir DIR] [--texts 512] [--repeat 3]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+from src.backend import config
+from src.backend.services.onnx_embedding import MODEL_FILE, QUANTIZED_MODEL_FILE, OnnxSentenceEncoder
+
+from .fixtures import random_text
+
+
+def _timed_encode(model, texts, batch_size: int, repeat: int):
+    best = float("inf")
+    vectors = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        vectors = model.encode(texts, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False)
+        best = min(best, time.perf_counter() - start)
+    return np.asarray(vectors, dtype=np.float32), len(texts) / best
+
+
+def _cosines(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return (a * b).sum(axis=1)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=config.EMBEDDING_MODEL_NAME)
+    parser.add_argument("--onnx-dir", default=config.EMBEDDING_ONNX_DIR)
+    parser.add_argument("--texts", type=int, default=512, help="Number of synthetic chunks")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per backend; the best time is reported")
+    parser.add_argument("--min-cosine", type=float, default=0.99)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    texts = [random_text(rng, rng.randint(20, 200)) for _ in range(args.texts)]
+
+    from sentence_transformers import SentenceTransformer
+
+    reference = SentenceTransformer(args.model, device="cpu", local_files_only=True)
+    candidates = [("torch", reference)]
+    for name, quantized, filename in (("onnx", False, MODEL_FILE), ("onnx-int8", True, QUANTIZED_MODEL_FILE)):
+        if os.path.exists(os.path.join(args.onnx_dir, filename)):
+            candidates.append((name, OnnxSentenceEncoder(args.onnx_dir, quantized=quantized)))
+        else:
+            print(f"Skipping {name}: {filename} not found in {args.onnx_dir}")
+
+    print(f"{'backend':<10} {'texts/s':>9} {'speedup':>8} {'mean cos':>9} {'min cos':>8}")
+    reference_vectors, reference_rate = None, None
+    failed = False
+    for name, model in candidates:
+        model.encode(texts[:8], batch_size=args.batch_size)  # warm-up
+        vectors, rate = _timed_encode(model, texts, args.batch_size, args.repeat)
+        if reference_vectors is None:
+            reference_vectors, reference_rate = vectors, rate
+        cosines = _cosines(vectors, reference_vectors)
+        failed |= bool(cosines.min() < args.min_cosine)
+        print(
+            f"{name:<10} {rate:>9.1f} {rate / reference_rate:>7.2f}x "
+            f"{cosines.mean():>9.5f} {cosines.min():>8.5f}"
+        )
+
+    if failed:
+        print(f"Parity check failed: cosine below {args.min_cosine}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
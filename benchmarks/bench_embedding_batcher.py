@@ -0,0 +1,70 @@
+"""
+Compare per-request encoding with the shared embedding batcher under concurrency.
+
+Each simulated request encodes a few small batches of chunks, as the ingest
+pipeline does. Reports texts/second and p50/p99 request latency for direct
+`model.encode` calls and for the batcher, plus the batcher's own metrics.
+
+Usage:
+    python -m benchmarks.bench_embedding_batcher [--clients 8] [--requests 20] [--batch 16]
+"""
+import argparse
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from src.backend import config
+from src.backend.services.embedding_batcher import EmbeddingBatcher
+from src.backend.services.embedding_store import get_embedding_model
+
+from .fixtures import random_text
+
+
+def _run(encode, clients: int, requests: int, batch: int, seed: int = 0):
+    rng = random.Random(seed)
+    payloads = [[random_text(rng, 80) for _ in range(batch)] for _ in range(clients * requests)]
+    latencies = []
+
+    def one(texts):
+        start = time.perf_counter()
+        encode(texts)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(one, payloads))
+    elapsed = time.perf_counter() - start
+    latencies_ms = np.array(latencies) * 1000
+    return len(payloads) * batch / elapsed, np.percentile(latencies_ms, 50), np.percentile(latencies_ms, 99)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=8, help="Concurrent callers")
+    parser.add_argument("--requests", type=int, default=20, help="Encode calls per caller")
+    parser.add_argument("--batch", type=int, default=16, help="Texts per encode call")
+    parser.add_argument("--max-batch-size", type=int, default=config.EMBED_MAX_BATCH_SIZE)
+    parser.add_argument("--max-wait-ms", type=int, default=config.EMBED_MAX_WAIT_MS)
+    args = parser.parse_args()
+
+    model = get_embedding_model()
+
+    def direct(texts):
+        return model.encode(texts, convert_to_numpy=True, show_progress_bar=False)
+
+    batcher = EmbeddingBatcher(model, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms)
+    # Warm up the model once so neither mode pays first-call overhead
+    direct(["warm up"])
+
+    print(f"{'mode':<8} {'texts/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, encode in (("direct", direct), ("batched", batcher.encode)):
+        rate, p50, p99 = _run(encode, args.clients, args.requests, args.batch)
+        print(f"{name:<8} {rate:>9.1f} {p50:>8.1f} {p99:>8.1f}")
+    print()
+    print("Batcher metrics:", batcher.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Import-time profile and cold-start budget for the backend.
+
+Imports `src.backend.main` in a fresh interpreter with `-X importtime` and prints
+the slowest modules by cumulative time. Exits with status 1 when the import
+takes longer than --budget-ms or pulls in a module that should only load on
+first use (torch, transformers, faiss, google.genai, ...), so it can gate CI.
+
+With --with-model the same process also runs the embedding warm-up and reports
+how long a cold worker takes to become ready.
+
+Usage:
+    python -m benchmarks.bench_import_time [--budget-ms 1000] [--top 15] [--with-model]
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+# Heavy modules that must stay out of the startup path
+DEFERRED_MODULES = (
+    "torch",
+    "transformers",
+    "sentence_transformers",
+    "faiss",
+    "onnxruntime",
+    "google.genai",
+)
+
+_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+_SCRIPT = """
+import time
+start = time.perf_counter()
+import src.backend.main
+print("IMPORT_SECONDS", time.perf_counter() - start, flush=True)
+if {with_model}:
+    from src.backend.services import embedding_store
+    start = time.perf_counter()
+    embedding_store.warm_up()
+    print("WARMUP_SECONDS", time.perf_counter() - start, flush=True)
+"""
+
+
+def profile(with_model: bool = False):
+    """Return (import seconds, warm-up seconds or None, modules imported by src.backend.main).
+
+    Modules are (cumulative us, self us, depth, name) tuples.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _SCRIPT.format(with_model=with_model)],
+        cwd=root,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"Importing the backend failed:\n{proc.stderr[-2000:]}")
+    wall = time.perf_counter() - started
+
+    modules = []
+    for line in proc.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules.append((int(cumulative_us), int(self_us), len(indent) // 2, name))
+
+    timings = dict(line.split() for line in proc.stdout.splitlines() if line.startswith(("IMPORT_", "WARMUP_")))
+    import_seconds = float(timings.get("IMPORT_SECONDS", wall))
+    warmup = timings.get("WARMUP_SECONDS")
+    # -X importtime reports a module after its children, so everything up to the
+    # entry for src.backend.main was imported at startup; the rest during warm-up
+    names = [name for _, _, _, name in modules]
+    if "src.backend.main" in names:
+        modules = modules[:names.index("src.backend.main") + 1]
+    return import_seconds, float(warmup) if warmup else None, modules
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=1000, help="Maximum import time of src.backend.main")
+    parser.add_argument("--top", type=int, default=15, help="Number of modules to list")
+    parser.add_argument("--with-model", action="store_true", help="Also time loading and warming up the model")
+    args = parser.parse_args()
+
+    import_seconds, warmup_seconds, modules = profile(with_model=args.with_model)
+
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for cumulative_us, self_us, depth, name in sorted(modules, reverse=True)[:args.top]:
+        print(f"{cumulative_us / 1000:>14.1f} {self_us / 1000:>9.1f}  {'  ' * depth}{name}")
+    print()
+    print(f"import src.backend.main: {import_seconds * 1000:.0f} ms (budget {args.budget_ms:.0f} ms)")
+    if warmup_seconds is not None:
+        print(f"model load + warm-up:    {warmup_seconds * 1000:.0f} ms")
+
+    failures = []
+    if import_seconds * 1000 > args.budget_ms:
+        failures.append(f"import took {import_seconds * 1000:.0f} ms, over the {args.budget_ms:.0f} ms budget")
+    imported = {name for _, _, _, name in modules}
+    eager = [name for name in DEFERRED_MODULES if name in imported]
+    if eager:
+        failures.append(f"imported at startup but should be deferred: {', '.join(eager)}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
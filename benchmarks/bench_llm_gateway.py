@@ -0,0 +1,143 @@
+"""
+The LLM gateway under bursts, failures and tail latency, against a local stub API.
+
+Starts benchmarks/llm_stub_server.py on a free port and sends --requests
+prompts through services.llm_gateway.LLMGateway in four situations, each with the
+gateway's features switched on one at a time:
+
+- burst: the stub allows only --quota requests a minute and fails --error-rate of
+  calls with 503. Without retries the extra calls fail; retries recover the 503s;
+  the rate limiter makes the calls over quota wait instead of failing with 429s.
+- tail: 5% of calls take --slow-ms. Hedging re-sends calls still unanswered after
+  --hedge-ms and cuts the p99. The prompts are sent by --tail-clients clients one
+  after another, so ordinary calls answer well within --hedge-ms and connection
+  slots are spare.
+- outage: every call fails. The circuit breaker stops sending calls once it opens.
+- repeat: the same prompt again and again, as when a document is re-analyzed.
+  With the LLM response cache only the first call reaches the API.
+
+Reports successes, failures, calls that reached the stub, p50/p99 latency and wall time.
+
+Usage:
+    python -m benchmarks.bench_llm_gateway [--requests 60] [--quota 50] [--latency-ms 50]
+"""
+import argparse
+import asyncio
+import os
+import socket
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from src.backend.services.llm_cache import LLMResponseCache
+from src.backend.services.llm_client import new_client
+from src.backend.services.llm_gateway import LLMGateway
+
+from .llm_stub_server import StubSettings, create_app
+
+PROMPT = "Summarize: " + "the quarterly report shows growth in revenue and margin. " * 40
+
+
+def start_stub(settings: StubSettings) -> str:
+    import uvicorn
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(create_app(settings), host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+def configure(url: str, **settings) -> None:
+    import httpx
+
+    httpx.post(f"{url}/config", json=settings).raise_for_status()
+
+
+def served(url: str) -> int:
+    import httpx
+
+    return httpx.get(f"{url}/stats").json().get("requests", 0)
+
+
+async def send(url: str, requests: int, clients: int, **gateway_args):
+    """Send `requests` prompts from `clients` concurrent clients; returns failures, latencies (ms), wall time, stats."""
+    gateway = LLMGateway(new_client("stub", url), **gateway_args)
+    latencies = []
+    failed = 0
+    remaining = requests
+
+    async def client():
+        nonlocal failed, remaining
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            try:
+                await gateway.generate(PROMPT)
+            except Exception:
+                failed += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(clients)])
+    wall = time.perf_counter() - start
+    await gateway.client.aio.aclose()
+    return failed, np.array(latencies) * 1000, wall, gateway.stats()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=60, help="Prompts per run")
+    parser.add_argument("--quota", type=int, default=50, help="Stub's requests per minute in the burst runs")
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--error-rate", type=float, default=0.1)
+    parser.add_argument("--slow-ms", type=float, default=1000)
+    parser.add_argument("--hedge-ms", type=float, default=200)
+    parser.add_argument("--tail-clients", type=int, default=4, help="Concurrent clients in the tail runs")
+    parser.add_argument("--concurrency", type=int, default=16, help="Gateway connection slots")
+    args = parser.parse_args()
+
+    settings = StubSettings(latency_ms=args.latency_ms)
+    url = start_stub(settings)
+    # The quota is refilled per minute, so a run that has to wait for it takes a while
+    rpm_wait = (args.requests - args.quota) * 60 / args.quota if args.requests > args.quota else 0
+    cache = LLMResponseCache(os.path.join(tempfile.mkdtemp(), "llm.sqlite3"), 64 * 1024 * 1024, 3600)
+    fast = dict(retry_base=0.05, retry_max=1.0, max_concurrency=args.concurrency, requests_per_minute=0)
+    runs = (
+        ("burst", "no retries", dict(args=dict(fast, max_retries=0), stub=dict(requests_per_minute=args.quota, error_rate=args.error_rate))),
+        ("burst", "retries", dict(args=dict(fast), stub=dict(requests_per_minute=args.quota, error_rate=args.error_rate))),
+        ("burst", f"retries + {args.quota} rpm limit", dict(
+            args=dict(fast, requests_per_minute=args.quota),
+            stub=dict(requests_per_minute=args.quota, error_rate=args.error_rate),
+        )),
+        ("tail", "retries", dict(args=dict(fast), stub=dict(slow_fraction=0.05, slow_ms=args.slow_ms))),
+        ("tail", f"retries + hedge {args.hedge_ms:.0f} ms", dict(
+            args=dict(fast, hedge_after=args.hedge_ms / 1000), stub=dict(slow_fraction=0.05, slow_ms=args.slow_ms),
+        )),
+        ("outage", "retries, no breaker", dict(args=dict(fast, breaker_failures=0), stub=dict(error_rate=1.0))),
+        ("outage", "retries + breaker", dict(args=dict(fast, breaker_failures=5), stub=dict(error_rate=1.0))),
+        ("repeat", "retries", dict(args=dict(fast), stub={})),
+        ("repeat", "retries + response cache", dict(args=dict(fast, cache=cache), stub={})),
+    )
+
+    print(f"{args.requests} prompts, all at once except in the tail and repeat runs, stub latency {args.latency_ms:.0f} ms"
+          f" (the rate-limited run waits about {rpm_wait:.0f}s for quota)")
+    print(f"  {'case':<7} {'gateway':<28} {'ok':>4} {'failed':>7} {'sent':>5} {'429s':>5} {'hedges':>7}"
+          f" {'p50 ms':>8} {'p99 ms':>8} {'wall s':>7}")
+    for case, name, run in runs:
+        configure(url, **{"requests_per_minute": 0, "error_rate": 0.0, "slow_fraction": 0.0, **run["stub"]})
+        clients = args.tail_clients if case in ("tail", "repeat") else args.requests
+        failed, latencies, wall, stats = asyncio.run(send(url, args.requests, clients, **run["args"]))
+        p50, p99 = (np.percentile(latencies, 50), np.percentile(latencies, 99)) if len(latencies) else (0, 0)
+        print(f"  {case:<7} {name:<28} {args.requests - failed:>4} {failed:>7} {served(url):>5}"
+              f" {stats['rate_limited']:>5} {stats['hedges']:>7} {p50:>8.0f} {p99:>8.0f} {wall:>7.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Wall-clock scaling of map-reduce insight generation.
+
+Runs services.map_reduce.map_summaries plus the final reduce over synthetic
+documents of several lengths, with the Gemini call replaced by an async sleep of
+--latency-ms so only the orchestration is measured (bench_llm_gateway covers the
+gateway in front of the real call). Wall-clock time should
+follow (groups / concurrency) * latency plus the combine rounds, not the
+document length; the `ideal s` column is that estimate for the map step.
+
+Usage:
+    python -m benchmarks.bench_map_reduce [--chunks 50,200,800] [--concurrency 1,4,8] [--latency-ms 200]
+"""
+import argparse
+import asyncio
+import math
+import random
+import time
+
+from src.backend import config
+from src.backend.services import insight_generator, map_reduce
+
+from .fixtures import random_text
+
+
+def simulated_llm(latency_seconds: float):
+    calls = {"count": 0}
+
+    async def complete(prompt: str) -> str:
+        calls["count"] += 1
+        await asyncio.sleep(latency_seconds)
+        return "Summary of a part of the document."
+
+    return complete, calls
+
+
+async def generate(chunks, concurrency: int, group_tokens: int, fan_in: int) -> str:
+    summaries = await map_reduce.map_summaries(
+        chunks, [None] * len(chunks), group_tokens=group_tokens, concurrency=concurrency, fan_in=fan_in
+    )
+    return await insight_generator.reduce_summaries(summaries)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", default="50,200,800", help="Comma-separated document lengths, in chunks")
+    parser.add_argument("--chunk-words", type=int, default=150)
+    parser.add_argument("--concurrency", default="1,4,8", help="Comma-separated concurrency caps")
+    parser.add_argument("--latency-ms", type=float, default=200, help="Simulated latency of one LLM call")
+    parser.add_argument("--group-tokens", type=int, default=config.MAP_REDUCE_GROUP_TOKENS)
+    parser.add_argument("--fan-in", type=int, default=config.MAP_REDUCE_FAN_IN)
+    args = parser.parse_args()
+
+    complete, calls = simulated_llm(args.latency_ms / 1000)
+    insight_generator._complete = complete
+    rng = random.Random(0)
+
+    print(f"LLM latency {args.latency_ms:.0f} ms, groups of {args.group_tokens} tokens, fan-in {args.fan_in}")
+    print(f"  {'chunks':>7} {'groups':>7} {'concurrency':>12} {'LLM calls':>10} {'wall s':>8} {'ideal s':>8}")
+    for num_chunks in (int(n) for n in args.chunks.split(",")):
+        chunks = [random_text(rng, args.chunk_words) for _ in range(num_chunks)]
+        groups = len(map_reduce.group_chunks(chunks, [None] * num_chunks, args.group_tokens))
+        for concurrency in (int(c) for c in args.concurrency.split(",")):
+            calls["count"] = 0
+            start = time.perf_counter()
+            asyncio.run(generate(chunks, concurrency, args.group_tokens, args.fan_in))
+            wall = time.perf_counter() - start
+            ideal = math.ceil(groups / concurrency) * args.latency_ms / 1000
+            print(f"  {num_chunks:>7} {groups:>7} {concurrency:>12} {calls['count']:>10} {wall:>8.2f} {ideal:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Compare PDF extraction backends on a corpus.
+
+Reports pages/second and extracted-character parity against pypdf for every
+installed backend. Without arguments a synthetic corpus is generated.
+
+Usage:
+    python -m benchmarks.bench_pdf_backends [corpus_dir] [--repeat N]
+"""
+import argparse
+import glob
+import os
+import re
+import tempfile
+import time
+
+from src.backend.services.pdf_backends import PDF_BACKENDS, available_backends
+
+from .fixtures import write_corpus
+
+REFERENCE = "pypdf"
+
+
+def _normalized_chars(texts) -> int:
+    return sum(len(re.sub(r"\s+", "", t)) for t in texts)
+
+
+def run(paths, repeat: int = 1) -> None:
+    backends = available_backends()
+    print(f"Backends: {', '.join(backends)} (reference: {REFERENCE})")
+    print(f"{'document':<32} {'backend':<10} {'pages':>6} {'pages/s':>9} {'chars':>10} {'parity':>7}")
+    totals = {name: [0, 0.0] for name in backends}
+    for path in paths:
+        reference_chars = None
+        rows = []
+        for name in backends:
+            backend = PDF_BACKENDS[name]
+            best = float("inf")
+            texts = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                num_pages = backend.page_count(path)
+                texts = backend.extract(path, 0, num_pages)
+                best = min(best, time.perf_counter() - start)
+            chars = _normalized_chars(texts)
+            if name == REFERENCE:
+                reference_chars = chars
+            totals[name][0] += num_pages
+            totals[name][1] += best
+            rows.append((name, num_pages, best, chars))
+
+        for name, num_pages, elapsed, chars in rows:
+            parity = f"{chars / reference_chars:.3f}" if reference_chars else "n/a"
+            print(
+                f"{os.path.basename(path)[:32]:<32} {name:<10} {num_pages:>6} "
+                f"{num_pages / elapsed:>9.1f} {chars:>10} {parity:>7}"
+            )
+
+    print()
+    for name, (pages, elapsed) in totals.items():
+        if elapsed:
+            print(f"{name:<10} overall {pages / elapsed:.1f} pages/s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("corpus", nargs="?", help="Directory of PDFs (default: synthetic corpus)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per document; the best time is reported")
+    args = parser.parse_args()
+
+    if args.corpus:
+        paths = sorted(glob.glob(os.path.join(args.corpus, "*.pdf")))
+        run(paths, repeat=args.repeat)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            run(write_corpus(tmp), repeat=args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Batched multi-query retrieval and MMR de-duplication.
+
+Builds a flat index over synthetic chunk vectors in which neighbouring chunks
+overlap (each is a small perturbation of the previous one, like chunks sharing
+a 50-char overlap), then compares, for a handful of section queries:
+
+- one index.search call per query vs one call for all queries, and
+- plain top-k vs top-k re-ranked with vector_index.mmr,
+
+reporting latency, the mean relevance of the hits and how many hit pairs are
+near-duplicates (cosine above --dup-threshold).
+
+It then compares how much of the document one retrieval covers: the merged
+top hits of all queries vs query-free k-means representatives
+(vector_index.kmeans_representatives), counted in distinct sections.
+
+Usage:
+    python -m benchmarks.bench_retrieval [--chunks 5000] [--queries 4] [--k 5] [--lambda 0.7]
+"""
+import argparse
+import itertools
+import time
+
+import numpy as np
+
+from src.backend.services.vector_index import build_index, kmeans_representatives, mmr, normalize
+
+# Chunks per synthetic document section
+SECTION_CHUNKS = 20
+
+
+def overlapping_chunks(num_chunks: int, dim: int, seed: int = 0) -> np.ndarray:
+    """Runs of near-duplicate unit vectors: each chunk drifts slightly from the one before."""
+    rng = np.random.default_rng(seed)
+    vectors = np.empty((num_chunks, dim), dtype=np.float32)
+    current = rng.standard_normal(dim)
+    for i in range(num_chunks):
+        if i % SECTION_CHUNKS == 0:
+            # A new section of the document starts somewhere else
+            current = rng.standard_normal(dim)
+        current = current + 0.25 * rng.standard_normal(dim)
+        vectors[i] = current
+    return normalize(vectors)
+
+
+def duplicate_pairs(vectors: np.ndarray, hits, threshold: float) -> float:
+    """Mean number of near-duplicate pairs per hit list."""
+    pairs = 0
+    for ids in hits:
+        for a, b in itertools.combinations(ids, 2):
+            pairs += float(vectors[a] @ vectors[b]) > threshold
+    return pairs / len(hits)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=5000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=4, help="Section queries per retrieval")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--lambda", dest="lambda_", type=float, default=0.7, help="MMR trade-off")
+    parser.add_argument("--fetch-factor", type=int, default=4, help="Candidates per query = factor * k")
+    parser.add_argument("--dup-threshold", type=float, default=0.9)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    vectors = overlapping_chunks(args.chunks, args.dim)
+    index = build_index("Flat", args.dim, vectors)
+    rng = np.random.default_rng(1)
+    queries = normalize(vectors[rng.integers(0, args.chunks, args.queries)]
+                        + 0.5 * rng.standard_normal((args.queries, args.dim)).astype(np.float32))
+
+    def one_by_one():
+        return [index.search(queries[i:i + 1], args.k)[1][0] for i in range(args.queries)]
+
+    def batched():
+        return list(index.search(queries, args.k)[1])
+
+    def batched_mmr():
+        scores, ids = index.search(queries, args.k * args.fetch_factor)
+        candidates = np.unique(ids)
+        stored = index.reconstruct_batch(candidates)
+        hits = []
+        for row_scores, row_ids in zip(scores, ids):
+            picked = mmr(stored[np.searchsorted(candidates, row_ids)], row_scores, args.k, args.lambda_)
+            hits.append(row_ids[picked])
+        return hits
+
+    print(f"{args.chunks} chunks x {args.dim} dims, {args.queries} queries, top {args.k}")
+    print(f"  {'method':<22} {'ms/retrieval':>13} {'relevance':>10} {'dup pairs':>10}")
+    for name, fn in (("search per query", one_by_one), ("one batched search", batched), ("batched + MMR", batched_mmr)):
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            hits = fn()
+        elapsed_ms = (time.perf_counter() - start) * 1000 / args.repeat
+        relevance = np.mean([vectors[ids] @ queries[i] for i, ids in enumerate(hits)])
+        print(f"  {name:<22} {elapsed_ms:>13.3f} {relevance:>10.3f} {duplicate_pairs(vectors, hits, args.dup_threshold):>10.2f}")
+
+    # Same number of chunks either way: k-means with k = sqrt(chunks) as EmbeddingStore picks it
+    k = int(round(np.sqrt(args.chunks)))
+    merged = list(dict.fromkeys(int(i) for i in np.ravel(index.search(queries, k)[1], order="F")))[:k]
+    start = time.perf_counter()
+    representatives, _ = kmeans_representatives(vectors, k)
+    kmeans_ms = (time.perf_counter() - start) * 1000
+    print(f"\nCoverage of {k} chunks ({args.chunks // SECTION_CHUNKS} sections)")
+    print(f"  {'query hits':<22} {len({i // SECTION_CHUNKS for i in merged}):>4} sections")
+    print(f"  {'k-means':<22} {len({int(i) // SECTION_CHUNKS for i in representatives}):>4} sections  ({kmeans_ms:.0f} ms)")
+
+
+if __name__ == "__main__":
+    main()
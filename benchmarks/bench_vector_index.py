@@ -0,0 +1,88 @@
+"""
+Compare FAISS index configurations for normalized embeddings.
+
+For each corpus size, builds flat, HNSW and IVF indexes (with SQ8/PQ compression
+and optional PCA) over synthetic clustered unit vectors and reports build time,
+per-query latency, recall@k against exact search and index size. The row marked
+with * is the configuration EmbeddingStore picks for that size.
+
+Usage:
+    python -m benchmarks.bench_vector_index [--sizes 2000,20000,100000] [--queries 200] [--k 10]
+"""
+import argparse
+import math
+import time
+
+import faiss
+import numpy as np
+
+from src.backend.services.vector_index import build_index, choose_index_spec, normalize
+
+
+def synthetic_vectors(num_vectors: int, dim: int, seed: int = 0) -> np.ndarray:
+    """Unit vectors drawn around random topic centers, like chunk embeddings of related text."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, num_vectors // 50), dim)).astype(np.float32)
+    labels = rng.integers(0, len(centers), num_vectors)
+    vectors = centers[labels] + 0.6 * rng.standard_normal((num_vectors, dim)).astype(np.float32)
+    return normalize(vectors)
+
+
+def configurations(num_vectors: int, dim: int):
+    nlist = int(min(65536, max(16, 4 * math.sqrt(num_vectors))))
+    specs = [
+        "Flat",
+        "HNSW32",
+        "HNSW32_SQ8",
+        f"IVF{nlist},Flat",
+        f"IVF{nlist},SQ8",
+        f"IVF{nlist},PQ{dim // 8}",
+        "PCA128,HNSW32_SQ8",
+        f"PCA128,IVF{nlist},SQ8",
+    ]
+    chosen = choose_index_spec(num_vectors, dim)
+    if chosen not in specs:
+        specs.append(chosen)
+    return specs, chosen
+
+
+def run(num_vectors: int, dim: int, num_queries: int, k: int) -> None:
+    vectors = synthetic_vectors(num_vectors, dim)
+    rng = np.random.default_rng(1)
+    queries = normalize(vectors[rng.integers(0, num_vectors, num_queries)]
+                        + 0.3 * rng.standard_normal((num_queries, dim)).astype(np.float32))
+    exact = build_index("Flat", dim, vectors)
+    _, truth = exact.search(queries, k)
+
+    specs, chosen = configurations(num_vectors, dim)
+    print(f"\n{num_vectors} vectors x {dim} dims, {num_queries} queries, recall@{k}")
+    print(f"  {'index':<26} {'build s':>8} {'query ms':>9} {'recall':>7} {'size MB':>8}")
+    for spec in specs:
+        start = time.perf_counter()
+        index = build_index(spec, dim, vectors)
+        build_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        found = np.vstack([index.search(queries[i:i + 1], k)[1] for i in range(num_queries)])
+        query_ms = (time.perf_counter() - start) * 1000 / num_queries
+
+        recall = np.mean([len(set(found[i]) & set(truth[i])) / k for i in range(num_queries)])
+        size_mb = len(faiss.serialize_index(index)) / 1e6
+        marker = "*" if spec == chosen else " "
+        print(f"{marker} {spec:<26} {build_seconds:>8.2f} {query_ms:>9.3f} {recall:>7.3f} {size_mb:>8.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="2000,20000", help="Comma-separated corpus sizes")
+    parser.add_argument("--dim", type=int, default=384, help="Vector dimension (all-MiniLM-L6-v2: 384)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    for size in (int(s) for s in args.sizes.split(",")):
+        run(size, args.dim, args.queries, args.k)
+
+
+if __name__ == "__main__":
+    main()
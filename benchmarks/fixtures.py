@@ -0,0 +1,67 @@
+"""
+Synthetic fixture documents for the benchmarks.
+
+The corpus is generated on the fly so no binary fixtures live in the repo.
+Pass a directory of real documents to a benchmark for production-like numbers.
+"""
+import os
+import random
+from typing import List
+
+WORDS = (
+    "agreement party shall payment term notice liability risk revenue quarter "
+    "growth margin compliance audit report contract obligation termination clause "
+    "customer supplier delivery schedule penalty budget forecast review approval"
+).split()
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(pages: List[List[str]]) -> bytes:
+    """Build a minimal text-only PDF. Each page is a list of lines."""
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [%s] /Count %d >>" % (
+            " ".join(f"{4 + 2 * i} 0 R" for i in range(len(pages))), len(pages)
+        ),
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, lines in enumerate(pages):
+        content = "BT /F1 9 Tf 36 806 Td 11 TL " + " ".join(f"({_escape(line)}) '" for line in lines) + " ET"
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>"
+        )
+        objects.append(f"<< /Length {len(content)} >>\nstream\n{content}\nendstream")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode("latin-1")
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    return bytes(out)
+
+
+def random_text(rng: random.Random, num_words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(num_words))
+
+
+def write_corpus(directory: str, page_counts=(5, 50, 300), seed: int = 0) -> List[str]:
+    """Write one synthetic PDF per entry in `page_counts` and return their paths."""
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for num_pages in page_counts:
+        pages = [[random_text(rng, 12) for _ in range(60)] for _ in range(num_pages)]
+        path = os.path.join(directory, f"synthetic_{num_pages}p.pdf")
+        with open(path, "wb") as f:
+            f.write(make_pdf(pages))
+        paths.append(path)
+    return paths
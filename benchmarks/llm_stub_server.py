@@ -0,0 +1,138 @@
+"""
+Local stand-in for the Gemini API, for exercising services/llm_gateway.py.
+
+Serves the two endpoints the SDK calls, `models/{model}:generateContent` and
+`models/{model}:streamGenerateContent` (SSE), and answers with a canned text
+after a configurable delay. It can also misbehave like the real API under load:
+
+- a fraction of calls is slow (tail latency),
+- a fraction fails with 503,
+- calls over a --requests-per-minute quota get 429. Like the API's per-minute
+  quotas it refills continuously, up to a minute's worth.
+
+POST /config changes those settings (and resets the counters) while it runs;
+GET /stats reports what it has served.
+
+Usage:
+    python -m benchmarks.llm_stub_server [--port 8765] [--latency-ms 50] [--error-rate 0.05]
+    LLM_BASE_URL=http://127.0.0.1:8765 GEMINI_API_KEY=stub uvicorn src.backend.main:app
+"""
+import argparse
+import asyncio
+import collections
+import json
+import random
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+ANSWER = (
+    "### 1. Executive Summary\n\nA stub summary of the document.\n\n"
+    "### 2. Key Insights\n\n- A stub insight.\n\n"
+    "### 3. Risks / Issues\n\n- A stub risk.\n\n"
+    "### 4. Actionable Recommendations\n\n- A stub recommendation."
+)
+
+
+class StubSettings:
+    def __init__(self, latency_ms=50.0, slow_fraction=0.0, slow_ms=1000.0, error_rate=0.0, requests_per_minute=0):
+        self.latency_ms = latency_ms
+        self.slow_fraction = slow_fraction
+        self.slow_ms = slow_ms
+        self.error_rate = error_rate
+        self.requests_per_minute = requests_per_minute
+
+
+def create_app(settings: StubSettings, seed: int = 0) -> FastAPI:
+    app = FastAPI()
+    rng = random.Random(seed)
+    quota = {"level": float(settings.requests_per_minute), "updated": time.monotonic()}
+    counts = collections.Counter()
+
+    def error(code: int, status: str, message: str) -> JSONResponse:
+        counts[str(code)] += 1
+        return JSONResponse(status_code=code, content={"error": {"code": code, "message": message, "status": status}})
+
+    def response_body(prompt_tokens: int, text: str, final: bool = True) -> dict:
+        body = {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}]}
+        if final:
+            body["candidates"][0]["finishReason"] = "STOP"
+            output_tokens = len(ANSWER) // 4
+            body["usageMetadata"] = {
+                "promptTokenCount": prompt_tokens,
+                "candidatesTokenCount": output_tokens,
+                "totalTokenCount": prompt_tokens + output_tokens,
+            }
+        return body
+
+    @app.post("/{version}/models/{target}")
+    async def generate(version: str, target: str, request: Request):
+        _, _, method = target.partition(":")
+        payload = await request.json()
+        prompt = "".join(part.get("text", "") for content in payload.get("contents", []) for part in content.get("parts", []))
+        prompt_tokens = max(1, len(prompt) // 4)
+        counts["requests"] += 1
+
+        if settings.requests_per_minute:
+            now = time.monotonic()
+            rate = settings.requests_per_minute / 60
+            quota["level"] = min(settings.requests_per_minute, quota["level"] + (now - quota["updated"]) * rate)
+            quota["updated"] = now
+            if quota["level"] < 1:
+                return error(429, "RESOURCE_EXHAUSTED", "Quota exceeded: requests per minute")
+            quota["level"] -= 1
+        if rng.random() < settings.error_rate:
+            return error(503, "UNAVAILABLE", "The model is overloaded. Please try again later.")
+        slow = rng.random() < settings.slow_fraction
+        await asyncio.sleep((settings.slow_ms if slow else settings.latency_ms) / 1000)
+        counts["slow" if slow else "fast"] += 1
+
+        if method == "streamGenerateContent":
+            async def events():
+                pieces = ANSWER.split("\n\n")
+                for i, piece in enumerate(pieces):
+                    text = piece if i == 0 else "\n\n" + piece
+                    body = response_body(prompt_tokens, text, final=i == len(pieces) - 1)
+                    yield f"data: {json.dumps(body)}\r\n\r\n"
+                    await asyncio.sleep(0.005)
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+        return response_body(prompt_tokens, ANSWER)
+
+    @app.post("/config")
+    async def configure(request: Request):
+        for key, value in (await request.json()).items():
+            if not hasattr(settings, key):
+                return JSONResponse(status_code=400, content={"detail": f"Unknown setting {key!r}"})
+            setattr(settings, key, value)
+        quota.update(level=float(settings.requests_per_minute), updated=time.monotonic())
+        counts.clear()
+        return vars(settings)
+
+    @app.get("/stats")
+    async def stats():
+        return {"settings": vars(settings), **counts}
+
+    return app
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--slow-fraction", type=float, default=0.0, help="Fraction of calls that take --slow-ms")
+    parser.add_argument("--slow-ms", type=float, default=1000)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls answered with 503")
+    parser.add_argument("--requests-per-minute", type=int, default=0, help="Quota before 429s (0: none)")
+    args = parser.parse_args()
+
+    settings = StubSettings(args.latency_ms, args.slow_fraction, args.slow_ms, args.error_rate, args.requests_per_minute)
+    uvicorn.run(create_app(settings), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+import os
+
+from dotenv import load_dotenv
+
+# Load environment variables from .env once, before any setting below is read
+load_dotenv()
+
+
+def _env_int(name: str, default: int) -> int:
+    """Read an integer setting from the environment, falling back to `default`."""
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise RuntimeError(f"Environment variable {name} must be an integer, got {value!r}")
+
+
+def _env_float(name: str, default: float) -> float:
+    """Read a float setting from the environment, falling back to `default`."""
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        raise RuntimeError(f"Environment variable {name} must be a number, got {value!r}")
+
+
+# ---------------- STORAGE ----------------
+DATA_DIR = os.environ.get("DATA_DIR", "data")
+CACHE_DIR = os.environ.get("CACHE_DIR", os.path.join(DATA_DIR, "cache"))
+
+# ---------------- RESULT CACHE ----------------
+# Final insights are cached by the SHA-256 of the uploaded bytes.
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", os.path.join(CACHE_DIR, "results"))
+RESULT_CACHE_MAX_BYTES = _env_int("RESULT_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+RESULT_CACHE_TTL_SECONDS = _env_int("RESULT_CACHE_TTL_SECONDS", 7 * 24 * 3600)
+
+# ---------------- LLM RESPONSE CACHE ----------------
+# LLM responses are cached in SQLite by (model, generation config, prompt hash), so a
+# byte-identical prompt (the same pasted text, the same retrieved chunks) is answered
+# from disk without an API call. Least recently used responses are evicted past
+# LLM_CACHE_MAX_BYTES and expire after LLM_CACHE_TTL_SECONDS. LLM_CACHE_MAX_BYTES=0
+# disables the cache; `no_cache=true` on a request skips it (and refreshes its entries).
+LLM_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", os.path.join(CACHE_DIR, "llm_responses.sqlite3"))
+LLM_CACHE_MAX_BYTES = _env_int("LLM_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+LLM_CACHE_TTL_SECONDS = _env_int("LLM_CACHE_TTL_SECONDS", 7 * 24 * 3600)
+
+# ---------------- LLM ----------------
+LLM_MODEL_NAME = os.environ.get("LLM_MODEL_NAME", "models/gemini-2.5-flash")
+# Every Gemini call goes through one gateway on the SDK's async client (see
+# services/llm_gateway.py). LLM_BASE_URL replaces the API endpoint, e.g. with a local
+# stub server (benchmarks/llm_stub_server.py).
+LLM_BASE_URL = os.environ.get("LLM_BASE_URL", "")
+# At most LLM_MAX_CONCURRENCY calls are in flight, over as many pooled connections.
+# Calls wait for quota rather than exceed LLM_REQUESTS_PER_MINUTE requests or
+# LLM_TOKENS_PER_MINUTE tokens a minute (0 disables either limit).
+LLM_MAX_CONCURRENCY = _env_int("LLM_MAX_CONCURRENCY", _env_int("LLM_WORKERS", 8))
+LLM_REQUESTS_PER_MINUTE = _env_int("LLM_REQUESTS_PER_MINUTE", 1000)
+LLM_TOKENS_PER_MINUTE = _env_int("LLM_TOKENS_PER_MINUTE", 1_000_000)
+# A call that fails with 408, 429 or 5xx, a connection error, or gets no response (for
+# streams: no new text) within LLM_TIMEOUT_SECONDS is retried up to LLM_MAX_RETRIES
+# times after a random delay of up to LLM_RETRY_BASE_SECONDS * 2**retry, capped at
+# LLM_RETRY_MAX_SECONDS (or the server's Retry-After, if longer).
+LLM_TIMEOUT_SECONDS = _env_float("LLM_TIMEOUT_SECONDS", 60)
+LLM_MAX_RETRIES = _env_int("LLM_MAX_RETRIES", 3)
+LLM_RETRY_BASE_SECONDS = _env_float("LLM_RETRY_BASE_SECONDS", 0.5)
+LLM_RETRY_MAX_SECONDS = _env_float("LLM_RETRY_MAX_SECONDS", 20)
+# After LLM_BREAKER_FAILURES such failures in a row (429s aside), calls fail at once for
+# LLM_BREAKER_RESET_SECONDS; then one trial call is let through to test the API again.
+LLM_BREAKER_FAILURES = _env_int("LLM_BREAKER_FAILURES", 5)
+LLM_BREAKER_RESET_SECONDS = _env_float("LLM_BREAKER_RESET_SECONDS", 30)
+# A non-streaming call still unanswered after LLM_HEDGE_AFTER_MS is sent a second time,
+# if quota allows, and the first answer wins. 0 disables hedging.
+LLM_HEDGE_AFTER_MS = _env_int("LLM_HEDGE_AFTER_MS", 0)
+
+# ---------------- EMBEDDINGS ----------------
+EMBEDDING_MODEL_NAME = os.environ.get("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
+# A local copy of the model saved with safetensors weights, which load memory-mapped.
+# Used instead of the Hugging Face cache when present; create it with
+# `python -m src.backend.services.model_snapshot`.
+EMBEDDING_MODEL_DIR = os.environ.get("EMBEDDING_MODEL_DIR", os.path.join(DATA_DIR, "models", EMBEDDING_MODEL_NAME))
+
+# "torch" runs the SentenceTransformer in PyTorch; "onnx" runs an exported graph of the
+# same model in onnxruntime from EMBEDDING_ONNX_DIR (see services/onnx_embedding.py).
+# EMBEDDING_ONNX_QUANTIZED=1 uses the dynamically int8-quantized copy.
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "torch")
+EMBEDDING_ONNX_DIR = os.environ.get(
+    "EMBEDDING_ONNX_DIR", os.path.join(DATA_DIR, "models", f"{EMBEDDING_MODEL_NAME}-onnx")
+)
+EMBEDDING_ONNX_QUANTIZED = _env_int("EMBEDDING_ONNX_QUANTIZED", 0)
+# onnxruntime intra-op threads; 0 lets onnxruntime decide
+EMBEDDING_ONNX_THREADS = _env_int("EMBEDDING_ONNX_THREADS", 0)
+
+# Chunk embeddings are cached on disk by (model name, hash of chunk text).
+# Set EMBEDDING_CACHE_MAX_ROWS=0 to disable the cache.
+EMBEDDING_CACHE_DIR = os.environ.get("EMBEDDING_CACHE_DIR", os.path.join(CACHE_DIR, "embeddings"))
+EMBEDDING_CACHE_MAX_ROWS = _env_int("EMBEDDING_CACHE_MAX_ROWS", 500_000)
+
+# The model is loaded in the background at startup (EMBEDDING_PRELOAD=0 loads it on first
+# use instead), then EMBEDDING_WARMUP_TEXTS texts are encoded once so the first request
+# doesn't pay for lazy initialization. /health/ready reports ready after the warm-up.
+# A failed warm-up is retried with exponential backoff, up to
+# EMBEDDING_PRELOAD_RETRY_MAX_SECONDS apart, until it succeeds.
+EMBEDDING_PRELOAD = _env_int("EMBEDDING_PRELOAD", 1)
+EMBEDDING_WARMUP_TEXTS = _env_int("EMBEDDING_WARMUP_TEXTS", 8)
+EMBEDDING_PRELOAD_RETRY_MAX_SECONDS = _env_float("EMBEDDING_PRELOAD_RETRY_MAX_SECONDS", 60)
+
+# Encoding requests from all in-flight analyses are merged into model batches of up to
+# EMBED_MAX_BATCH_SIZE texts, waiting at most EMBED_MAX_WAIT_MS for a batch to fill.
+EMBED_MAX_BATCH_SIZE = _env_int("EMBED_MAX_BATCH_SIZE", 128)
+EMBED_MAX_WAIT_MS = _env_int("EMBED_MAX_WAIT_MS", 5)
+
+# ---------------- VECTOR INDEX ----------------
+# Vectors are normalized and searched by inner product (cosine). A document's index is
+# exact ("Flat") below FAISS_HNSW_MIN_VECTORS chunks, HNSW up to FAISS_IVF_MIN_VECTORS,
+# IVF above that. FAISS_INDEX takes an explicit faiss.index_factory string instead of "auto".
+FAISS_INDEX = os.environ.get("FAISS_INDEX", "auto")
+FAISS_HNSW_MIN_VECTORS = _env_int("FAISS_HNSW_MIN_VECTORS", 5_000)
+FAISS_IVF_MIN_VECTORS = _env_int("FAISS_IVF_MIN_VECTORS", 100_000)
+# Vector compression for HNSW/IVF: "sq8" (8-bit scalar), "pq" (product quantization, IVF only) or "none"
+FAISS_QUANTIZATION = os.environ.get("FAISS_QUANTIZATION", "sq8")
+# Reduce vectors to this many dimensions with PCA before HNSW/IVF indexing (0 disables)
+FAISS_PCA_DIM = _env_int("FAISS_PCA_DIM", 0)
+FAISS_HNSW_M = _env_int("FAISS_HNSW_M", 32)
+FAISS_HNSW_EF_SEARCH = _env_int("FAISS_HNSW_EF_SEARCH", 64)
+FAISS_IVF_NPROBE = _env_int("FAISS_IVF_NPROBE", 16)
+
+# ---------------- RETRIEVAL ----------------
+# Chunks for the insight prompt are retrieved with one query per report section, all
+# searched at once; RETRIEVAL_TOP_K chunks are kept in total. Each query's hits are
+# re-ranked with maximal marginal relevance among MMR_FETCH_FACTOR * top_k candidates:
+# MMR_LAMBDA=1 ranks by relevance only, lower values favour chunks unlike those already picked.
+RETRIEVAL_TOP_K = _env_int("RETRIEVAL_TOP_K", 5)
+MMR_LAMBDA = _env_float("MMR_LAMBDA", 0.7)
+MMR_FETCH_FACTOR = _env_int("MMR_FETCH_FACTOR", 4)
+# "queries" retrieves with the section queries. "kmeans" needs no query: it clusters the
+# document's chunk embeddings and sends the chunk nearest each centroid, so the prompt
+# covers the whole document. k is about sqrt(chunks), between RETRIEVAL_TOP_K and
+# KMEANS_MAX_CLUSTERS, and the chosen chunks are trimmed to KMEANS_TOKEN_BUDGET tokens.
+RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "queries")
+KMEANS_MAX_CLUSTERS = _env_int("KMEANS_MAX_CLUSTERS", 16)
+KMEANS_TOKEN_BUDGET = _env_int("KMEANS_TOKEN_BUDGET", 3000)
+
+# ---------------- PROMPT CONTEXT ----------------
+# Retrieved chunks are packed before prompting (see services/context_packer.py):
+# overlapping or adjacent chunks are merged back into contiguous passages, chunks whose
+# embeddings have cosine >= CONTEXT_DUPLICATE_THRESHOLD with one already taken are
+# dropped, and chunks are added in relevance order up to CONTEXT_TOKEN_BUDGET
+# estimated tokens per prompt.
+CONTEXT_TOKEN_BUDGET = _env_int("CONTEXT_TOKEN_BUDGET", 3000)
+CONTEXT_DUPLICATE_THRESHOLD = _env_float("CONTEXT_DUPLICATE_THRESHOLD", 0.95)
+
+# ---------------- GENERATION ----------------
+# "retrieval" sends the retrieved chunks to one LLM call. "sections" writes each of the
+# four report sections from its own retrieval with its own LLM call, all in parallel;
+# a section that fails or takes longer than SECTION_TIMEOUT_SECONDS is replaced by a
+# short note instead of failing the request. "map_reduce" covers the whole
+# document: consecutive chunks are packed into groups of about MAP_REDUCE_GROUP_TOKENS
+# tokens and summarized by parallel LLM calls, at most MAP_REDUCE_CONCURRENCY at once
+# (and never more than LLM_MAX_CONCURRENCY). Summaries are merged MAP_REDUCE_FAN_IN at a time
+# until that few remain, then reduced into the final insights.
+GENERATION_MODE = os.environ.get("GENERATION_MODE", "retrieval")
+MAP_REDUCE_GROUP_TOKENS = _env_int("MAP_REDUCE_GROUP_TOKENS", 6000)
+MAP_REDUCE_CONCURRENCY = _env_int("MAP_REDUCE_CONCURRENCY", 4)
+MAP_REDUCE_FAN_IN = _env_int("MAP_REDUCE_FAN_IN", 16)
+SECTION_TIMEOUT_SECONDS = _env_float("SECTION_TIMEOUT_SECONDS", 60)
+
+# ---------------- CORPUS INDEX ----------------
+# Every analyzed document's chunks are also added to a persistent index shared by all
+# workers (see services/corpus_index.py). Deltas are compacted into the memory-mapped
+# base once they reach CORPUS_COMPACT_DELTA_ROWS vectors, or once deleted documents
+# make up CORPUS_COMPACT_DEAD_PERCENT of the vectors. Each worker keeps its own copy of
+# the delta vectors in memory (dim * 4 bytes each, ~15 MB at 10k rows of 384 dims);
+# raising the threshold trades that for fewer rebuilds of the base.
+CORPUS_INDEX_ENABLED = _env_int("CORPUS_INDEX_ENABLED", 1)
+CORPUS_DIR = os.environ.get("CORPUS_DIR", os.path.join(DATA_DIR, "corpus"))
+CORPUS_COMPACT_DELTA_ROWS = _env_int("CORPUS_COMPACT_DELTA_ROWS", 10_000)
+CORPUS_COMPACT_DEAD_PERCENT = _env_int("CORPUS_COMPACT_DEAD_PERCENT", 20)
+
+# ---------------- FOLLOW-UP QUESTIONS ----------------
+# Indexes of recently analyzed documents stay in memory (LRU, up to DOCUMENT_CACHE_MAX_BYTES)
+# for POST /analyze/{doc_id}/ask; older ones are reloaded from the corpus index. With
+# CORPUS_INDEX_ENABLED=0 evicted documents are gone and must be uploaded again.
+DOCUMENT_CACHE_MAX_BYTES = _env_int("DOCUMENT_CACHE_MAX_BYTES", 256 * 1024 * 1024)
+ASK_TOP_K = _env_int("ASK_TOP_K", 5)
+
+# ---------------- UPLOADS ----------------
+# Uploads are parsed straight from the request's spooled buffer. Larger uploads are rejected with 413.
+MAX_UPLOAD_BYTES = _env_int("MAX_UPLOAD_BYTES", 200 * 1024 * 1024)
+
+# Optionally keep a copy of each upload, named by its content hash, for auditing or reprocessing.
+# Retained files are pruned by age and total size. UPLOAD_RETENTION_MAX_BYTES=0 keeps nothing.
+UPLOAD_DIR = os.environ.get("UPLOAD_DIR", os.path.join(DATA_DIR, "uploads"))
+UPLOAD_RETENTION_MAX_BYTES = _env_int("UPLOAD_RETENTION_MAX_BYTES", 0)
+UPLOAD_RETENTION_SECONDS = _env_int("UPLOAD_RETENTION_SECONDS", 24 * 3600)
+
+# ---------------- PDF EXTRACTION ----------------
+# PDFs with at least PDF_PARALLEL_MIN_PAGES pages are split into page ranges
+# extracted by a pool of PDF_WORKERS processes. PDF_WORKERS=1 disables the pool.
+PDF_WORKERS = _env_int("PDF_WORKERS", min(4, os.cpu_count() or 1))
+PDF_PARALLEL_MIN_PAGES = _env_int("PDF_PARALLEL_MIN_PAGES", 64)
+# Extraction backend: "auto" (pypdfium2 if installed, else pypdf), "pypdfium2", "pdfminer" or "pypdf".
+# Compare them on your own documents with `python -m benchmarks.bench_pdf_backends`.
+PDF_BACKEND = os.environ.get("PDF_BACKEND", "auto")
+
+# ---------------- INGEST PIPELINE ----------------
+# Chunks are embedded in batches of EMBED_BATCH_SIZE on a worker thread while extraction
+# continues. At most INGEST_QUEUE_BATCHES batches wait in between, which bounds memory.
+EMBED_BATCH_SIZE = _env_int("EMBED_BATCH_SIZE", 64)
+INGEST_QUEUE_BATCHES = _env_int("INGEST_QUEUE_BATCHES", 2)
+
+# ---------------- CHUNKING ----------------
+CHUNK_SIZE = _env_int("CHUNK_SIZE", 500)
+CHUNK_OVERLAP = _env_int("CHUNK_OVERLAP", 50)
+# Snap chunk ends back to a sentence end found within this many characters (0 disables)
+CHUNK_SNAP_TOLERANCE = _env_int("CHUNK_SNAP_TOLERANCE", 0)
+# "tokens" cuts chunks on the embedding tokenizer's token boundaries so none exceed the
+# model's sequence limit; "chars" uses CHUNK_SIZE/CHUNK_OVERLAP characters.
+CHUNK_MODE = os.environ.get("CHUNK_MODE", "tokens")
+# Tokens per chunk; 0 means the model's max sequence length minus special tokens
+CHUNK_TOKENS = _env_int("CHUNK_TOKENS", 0)
+CHUNK_TOKEN_OVERLAP = _env_int("CHUNK_TOKEN_OVERLAP", 32)
+# Pages handed to the chunker (and tokenized) together
+CHUNK_PAGE_BATCH = _env_int("CHUNK_PAGE_BATCH", 8)
+
+# ---------------- CONCURRENCY ----------------
+# Blocking ingest/retrieval work runs off the event loop on CPU_WORKERS threads
+# (LLM calls are async, see LLM_MAX_CONCURRENCY).
+CPU_WORKERS = _env_int("CPU_WORKERS", min(4, os.cpu_count() or 1))
+# At most MAX_ACTIVE_ANALYSES ingest and retrieve at once and MAX_QUEUED_ANALYSES wait;
+# further requests get 503 with a Retry-After of ADMISSION_RETRY_AFTER_SECONDS.
+MAX_ACTIVE_ANALYSES = _env_int("MAX_ACTIVE_ANALYSES", CPU_WORKERS)
+MAX_QUEUED_ANALYSES = _env_int("MAX_QUEUED_ANALYSES", 16)
+ADMISSION_RETRY_AFTER_SECONDS = _env_int("ADMISSION_RETRY_AFTER_SECONDS", 10)
+# The LLM phase (map step, report generation, /analyze/text) mostly waits on the API,
+# so it is admitted separately: MAX_ACTIVE_LLM_ANALYSES at once, MAX_QUEUED_LLM_ANALYSES
+# waiting. The gateway still caps calls in flight at LLM_MAX_CONCURRENCY.
+MAX_ACTIVE_LLM_ANALYSES = _env_int("MAX_ACTIVE_LLM_ANALYSES", 2 * LLM_MAX_CONCURRENCY)
+MAX_QUEUED_LLM_ANALYSES = _env_int("MAX_QUEUED_LLM_ANALYSES", 64)
+
+# ---------------- BACKGROUND JOBS ----------------
+# POST /analyze/?background=true returns a job id; finished jobs are kept this long.
+JOB_RETENTION_SECONDS = _env_int("JOB_RETENTION_SECONDS", 3600)
+# Uploads copied for background jobs stay in memory up to this size, then spill to a temp file
+JOB_SPOOL_MAX_BYTES = _env_int("JOB_SPOOL_MAX_BYTES", 8 * 1024 * 1024)
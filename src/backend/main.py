@@ -1,36 +1,61 @@
+import asyncio
 import logging
+from contextlib import aclosing, asynccontextmanager
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from google import genai
-import os
-from dotenv import load_dotenv
-
-# Load environment variables from .env file FIRST
-load_dotenv()
 
 # Configure logging if not already configured by the app environment
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Get API key from environment
-MODEL_NAME = "models/gemini-2.5-flash"
-api_key = os.environ.get("GEMINI_API_KEY")
-if not api_key:
-    logger.error("GEMINI_API_KEY is not set in environment or .env file!")
-    logger.error("Please create a .env file with: GEMINI_API_KEY=your_key_here")
-
-client = genai.Client(api_key=api_key) if api_key else None
-
-app = FastAPI()
-
 # Include file upload analyze router
 try:
+    from . import config
     from .routes import analyze
+    from .services import embedding_store
+    from .services import llm_cache, llm_gateway
+    from .services.llm_client import is_configured
+    from .services.workers import Saturated, llm_admission, run_cpu
 except ImportError:
     # Fallback when imported directly by uvicorn
     import sys, os
     sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import config
     from routes import analyze
+    from services import embedding_store
+    from services import llm_cache, llm_gateway
+    from services.llm_client import is_configured
+    from services.workers import Saturated, llm_admission, run_cpu
+
+
+async def _preload_embedding_model() -> None:
+    """Warm up the embedding model, retrying with backoff until it succeeds."""
+    delay = 1.0
+    while True:
+        try:
+            await run_cpu(embedding_store.warm_up)
+            return
+        except Exception:
+            # Readiness reports the failure meanwhile; requests also retry the load on first use
+            logger.exception("Embedding model warm-up failed, retrying in %.0fs", delay)
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, config.EMBEDDING_PRELOAD_RETRY_MAX_SECONDS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the model in the background so the server starts answering (liveness,
+    # /analyze/text) immediately; readiness flips once the warm-up is done
+    if config.EMBEDDING_PRELOAD:
+        app.state.preload = asyncio.create_task(_preload_embedding_model())
+    yield
+    if config.EMBEDDING_PRELOAD:
+        app.state.preload.cancel()
+    await llm_gateway.close_gateway()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.include_router(analyze.router, prefix="/analyze", tags=["Analyze"])
 
@@ -44,27 +69,49 @@ class AnalyzeResponse(BaseModel):
 # ---------------- ROUTES ----------------
 
 @app.get("/")
+@app.get("/health/live")
 def health_check():
+    """Liveness: the process is up and serving. Says nothing about the model."""
     return {"status": "ok"}
 
 
-def _extract_response_text(response) -> str:
-    if hasattr(response, "generations") and response.generations:
-        return response.generations[0].content
-    if hasattr(response, "text"):
-        return response.text
-    return str(response)
-
-
-@app.post("/analyze/text", response_model=AnalyzeResponse)
-def analyze_document(req: AnalyzeRequest):
-    if not client:
-        raise HTTPException(status_code=500, detail="LLM client is not configured")
-
-    try:
-        response = client.models.generate_content(
-            model=MODEL_NAME,
-            contents=f"""
+@app.get("/health/ready")
+def readiness_check():
+    """Readiness: 200 once the embedding model is warmed up and the LLM client is configured, else 503.
+
+    With EMBEDDING_PRELOAD=0 the model loads on first use, so it does not hold readiness back.
+    """
+    embedding = embedding_store.embedding_status()
+    embedding_ready = embedding["status"] == "ready" or (
+        not config.EMBEDDING_PRELOAD and embedding["status"] != "failed"
+    )
+    llm = {"status": "configured" if is_configured() else "missing"}
+    ready = embedding_ready and is_configured()
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "not_ready", "embedding_model": embedding, "llm_client": llm},
+    )
+
+
+@app.get("/metrics")
+def metrics():
+    """Embedding batcher and cache metrics (null until the model is loaded), the document cache,
+    the LLM gateway (null until the first LLM call) and the LLM response cache (null if disabled)."""
+    batcher = embedding_store.EMBEDDING_BATCHER
+    cache = embedding_store.EMBEDDING_CACHE
+    gateway = llm_gateway.GATEWAY
+    responses = llm_cache.get_llm_cache()
+    return {
+        "embedding_batcher": batcher.stats() if batcher is not None else None,
+        "embedding_cache": cache.stats() if cache is not None else None,
+        "document_cache": analyze.documents.stats(),
+        "llm_gateway": gateway.stats() if gateway is not None else None,
+        "llm_cache": responses.stats() if responses is not None else None,
+    }
+
+
+def _text_prompt(text: str) -> str:
+    return f"""
 You are an expert document analyst.
 
 Analyze the document and return:
@@ -74,14 +121,66 @@ Analyze the document and return:
 4. Recommendations
 
 Document:
-{req.text}
-""",
-            supported_actions=["generateContent"],
+{text}
+"""
+
+
+async def _text_events(prompt: str):
+    """Server-sent events: "delta" events with text as Gemini produces it, then "done" or "error"."""
+    try:
+        async with llm_admission.admit():
+            async with aclosing(llm_gateway.get_gateway().stream(prompt)) as pieces:
+                async for text in pieces:
+                    yield analyze.sse_event({"type": "delta", "text": text})
+        yield analyze.sse_event({"type": "done"})
+    except Saturated:
+        yield analyze.sse_event({"type": "error", "status_code": 503, "detail": "Server is busy, please retry later"})
+    except llm_gateway.LLMUnavailable:
+        yield analyze.sse_event({"type": "error", "status_code": 503, "detail": "LLM service is unavailable, please retry later"})
+    except Exception as e:
+        logger.exception("Text analyze stream failed: %s", e)
+        yield analyze.sse_event({"type": "error", "status_code": 500, "detail": "Insight generation failed"})
+
+
+@app.post("/analyze/text", response_model=AnalyzeResponse)
+async def analyze_document(req: AnalyzeRequest, stream: bool = False, no_cache: bool = False):
+    """Analyze pasted text. `no_cache=true` asks the LLM again instead of reusing a cached response."""
+    # Also covers the event stream below, which runs in a task copied from this context
+    llm_cache.bypass_cache.set(no_cache)
+    if not is_configured():
+        raise HTTPException(status_code=500, detail="LLM client is not configured")
+
+    if stream:
+        if not llm_admission.has_capacity():
+            raise HTTPException(
+                status_code=503,
+                detail="Server is busy, please retry later",
+                headers={"Retry-After": str(llm_admission.retry_after)},
+            )
+        return StreamingResponse(
+            _text_events(_text_prompt(req.text)),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache"},
         )
 
-        result_text = _extract_response_text(response)
+    try:
+        # Behind the LLM admission queue; the gateway handles quota and retries
+        async with llm_admission.admit():
+            result_text = await llm_gateway.get_gateway().generate(_text_prompt(req.text))
         return {"result": result_text}
 
+    except Saturated as e:
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy, please retry later",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except llm_gateway.LLMUnavailable as e:
+        raise HTTPException(
+            status_code=503,
+            detail="LLM service is unavailable, please retry later",
+            headers={"Retry-After": str(max(1, round(e.retry_after)))},
+        )
     except Exception as e:
         logger.exception("Text analyze failed: %s", e)
         raise HTTPException(status_code=500, detail="Insight generation failed")
@@ -1,12 +1,42 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi import APIRouter, UploadFile, File, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+import asyncio
 import os
-import shutil
+import hashlib
+import json
 import logging
+import shutil
+import tempfile
+import time
+from contextlib import aclosing
+from typing import BinaryIO, Dict, List, Optional, Tuple
 
-from ..services.document_loader import load_document
-from ..services.chunker import chunk_text
-from ..services.embedding_store import EmbeddingStore
-from ..services.insight_generator import generate_insights
+from .. import config
+from ..services.context_packer import document_passages, merge_stats, pack_context
+from ..services.corpus_index import get_corpus_index
+from ..services.document_cache import DocumentCache
+from ..services.embedding_store import EmbeddingStore, get_embedding_batcher
+from ..services.jobs import TERMINAL_STATUSES, EventLog, Job, JobStore
+from ..services.llm_cache import bypass_cache
+from ..services.llm_gateway import LLMUnavailable
+from ..services.insight_generator import (
+    SECTIONS,
+    answer_question,
+    format_section,
+    generate_insights,
+    generate_section,
+    reduce_summaries,
+    stream_insights,
+    stream_reduce_summaries,
+)
+from ..services.map_reduce import map_summaries
+from ..services.pdf_backends import get_backend
+from ..services.pipeline import ingest_document
+from ..services.result_cache import ResultCache, SingleFlight
+from ..services.upload_store import UploadStore
+from ..services.vector_index import normalize
+from ..services.workers import Saturated, analysis_admission, llm_admission, run_cpu
 
 # Import sanitize_filename from utils (sibling of backend)
 import sys
@@ -25,73 +55,829 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-UPLOAD_DIR = "data"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+# Retrieval queries for the sections of the insight report (see _retrieve)
+INSIGHT_QUERIES = tuple(query for _, _, query in SECTIONS)
+
+# Read uploads in 1 MiB pieces so hashing happens while the bytes stream in
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+result_cache = ResultCache(
+    config.RESULT_CACHE_DIR,
+    max_bytes=config.RESULT_CACHE_MAX_BYTES,
+    ttl_seconds=config.RESULT_CACHE_TTL_SECONDS,
+)
+upload_store = UploadStore(
+    config.UPLOAD_DIR,
+    max_bytes=config.UPLOAD_RETENTION_MAX_BYTES,
+    retention_seconds=config.UPLOAD_RETENTION_SECONDS,
+)
+jobs = JobStore(retention_seconds=config.JOB_RETENTION_SECONDS)
+documents = DocumentCache(config.DOCUMENT_CACHE_MAX_BYTES)
+_inflight = SingleFlight()
+
+# Settings that change what the pipeline produces for the same upload. Their fingerprint
+# is part of the result cache key, so a config change is not answered with stale reports
+PIPELINE_SETTINGS = (
+    "EMBEDDING_MODEL_NAME",
+    "CHUNK_MODE", "CHUNK_SIZE", "CHUNK_OVERLAP", "CHUNK_SNAP_TOLERANCE", "CHUNK_TOKENS", "CHUNK_TOKEN_OVERLAP",
+    "RETRIEVAL_MODE", "RETRIEVAL_TOP_K", "MMR_LAMBDA", "MMR_FETCH_FACTOR", "KMEANS_MAX_CLUSTERS",
+    "KMEANS_TOKEN_BUDGET", "CONTEXT_TOKEN_BUDGET", "CONTEXT_DUPLICATE_THRESHOLD",
+    "GENERATION_MODE", "MAP_REDUCE_GROUP_TOKENS", "MAP_REDUCE_FAN_IN", "LLM_MODEL_NAME",
+)
+# Streamed analyses in progress, by doc_id, for identical streamed uploads to follow
+_streams: Dict[str, Tuple[EventLog, asyncio.Task]] = {}
+
+
+def _result_key(doc_id: str) -> str:
+    """Result cache key of a document: its doc_id plus a fingerprint of PIPELINE_SETTINGS."""
+    settings = json.dumps([getattr(config, name) for name in PIPELINE_SETTINGS])
+    return f"{doc_id}.{hashlib.sha256(settings.encode('utf-8')).hexdigest()[:12]}"
+
+
+def _ingest(
+    stream: BinaryIO,
+    safe_name: str,
+    pdf_backend: Optional[str] = None,
+    job: Optional[Job] = None,
+    doc_id: Optional[str] = None,
+) -> Tuple[EmbeddingStore, int]:
+    """Extract, chunk and embed an uploaded document into a new store (CPU pool).
+
+    With a `doc_id` the chunks are also added to the corpus index, and the store is
+    kept for follow-up questions.
+    """
+    # 3-5. Stream the document from the upload buffer through extraction,
+    #      chunking and embedding, with embedding overlapped on a worker thread
+    stream.seek(0)
+    store = EmbeddingStore()
+    try:
+        num_chunks = ingest_document(
+            stream,
+            store,
+            filename=safe_name,
+            pdf_backend=pdf_backend,
+            progress=job.update if job else None,
+            finalize=False,
+        )
+    except RuntimeError as e:
+        logger.exception("Failed to create embeddings for %s: %s", safe_name, e)
+        raise HTTPException(status_code=500, detail="Failed to create embeddings")
+
+    if not num_chunks:
+        logger.warning("Document %s produced no chunks", safe_name)
+        raise HTTPException(status_code=400, detail="Document is empty or contained no text")
+    if doc_id:
+        # Before finalize, while the store still holds the exact vectors
+        _add_to_corpus(store, doc_id, safe_name, has_pages=pdf_backend is not None)
+    store.finalize()
+    if doc_id:
+        documents.put(doc_id, store)
+    return store, num_chunks
+
+
+def _add_to_corpus(store: EmbeddingStore, doc_id: str, safe_name: str, has_pages: bool) -> None:
+    """Add an ingested document to the corpus index. Failures are logged, not raised."""
+    corpus = get_corpus_index()
+    if corpus is None:
+        return
+    try:
+        count = len(store.texts)
+        corpus.add_document(
+            doc_id,
+            safe_name,
+            texts=[store.texts[i] for i in range(count)],
+            pages=[store.page(i) if has_pages else None for i in range(count)],
+            vectors=store.vectors(),
+        )
+    except Exception as e:
+        logger.exception("Failed to add %s to the corpus index: %s", safe_name, e)
+
+
+def _section_hits(store: EmbeddingStore) -> List[int]:
+    """One diversified hit list per report section, merged round-robin without repeats."""
+    per_query = store.search_many(INSIGHT_QUERIES, top_k=config.RETRIEVAL_TOP_K)
+    indices: List[int] = []
+    for rank in range(config.RETRIEVAL_TOP_K):
+        for query_hits in per_query:
+            if rank < len(query_hits) and query_hits[rank][0] not in indices and len(indices) < config.RETRIEVAL_TOP_K:
+                indices.append(query_hits[rank][0])
+    return indices
+
+
+def _retrieve(
+    store: EmbeddingStore, safe_name: str, has_pages: bool
+) -> Tuple[List[str], List[Optional[int]], Optional[dict]]:
+    """Retrieve top chunks and the pages they came from (CPU pool).
+
+    The chunks are packed into passages (see context_packer.pack_context), whose
+    stats are returned too. In map-reduce mode the passages cover the whole
+    document instead (context_packer.document_passages).
+    """
+    # 6. Retrieve top chunks (and the pages they came from) for insights
+    if config.GENERATION_MODE == "map_reduce":
+        # Map-reduce summarizes the whole document, in order, one group-sized passage at a time
+        return document_passages(store, has_pages, config.MAP_REDUCE_GROUP_TOKENS)
+    if config.RETRIEVAL_MODE == "kmeans":
+        indices = store.representatives(
+            config.KMEANS_TOKEN_BUDGET, config.KMEANS_MAX_CLUSTERS, min_clusters=config.RETRIEVAL_TOP_K
+        )
+    elif config.RETRIEVAL_MODE == "queries":
+        indices = _section_hits(store)
+    else:
+        raise ValueError(f"Unknown RETRIEVAL_MODE {config.RETRIEVAL_MODE!r}. Choose from: queries, kmeans")
+    retrieved_chunks, retrieved_pages, context = pack_context(store, indices, has_pages)
+
+    if not retrieved_chunks:
+        logger.warning("No relevant chunks retrieved for %s", safe_name)
+    return retrieved_chunks, retrieved_pages, context
+
+
+async def _generate(chunks: List[str], pages: List[Optional[int]], safe_name: str) -> str:
+    """Generate structured insights."""
+    # 7. Generate structured insights
+    try:
+        return await generate_insights(chunks, pages=pages)
+    except LLMUnavailable as e:
+        raise _llm_unavailable(e)
+    except Exception as e:
+        logger.exception("Insight generation failed for %s: %s", safe_name, e)
+        raise HTTPException(status_code=500, detail="Insight generation failed")
+
+
+def _retrieve_sections(
+    store: EmbeddingStore, safe_name: str, has_pages: bool
+) -> Tuple[List[Tuple[List[str], List[Optional[int]]]], dict]:
+    """Packed passages and pages for each report section, from one batched search (CPU pool).
+
+    Also returns the packing stats summed over the sections.
+    """
+    sections, stats = [], []
+    for hits in store.search_many(INSIGHT_QUERIES, top_k=config.RETRIEVAL_TOP_K):
+        chunks, pages, context = pack_context(store, [idx for idx, _ in hits], has_pages)
+        sections.append((chunks, pages))
+        stats.append(context)
+    if not any(chunks for chunks, _ in sections):
+        logger.warning("No relevant chunks retrieved for %s", safe_name)
+    return sections, merge_stats(stats)
+
+
+async def _write_section(
+    number: int, chunks: List[str], pages: List[Optional[int]], safe_name: str
+) -> Tuple[str, Optional[Exception]]:
+    """One section of the report as markdown, and the error if it was not generated.
+
+    A section that fails or times out gets a note in its place, so the other
+    sections (and the layout) survive.
+    """
+    title, instruction, _ = SECTIONS[number - 1]
+    try:
+        body = await asyncio.wait_for(
+            generate_section(instruction, chunks, pages), config.SECTION_TIMEOUT_SECONDS
+        )
+        return format_section(number, title, body), None
+    except asyncio.TimeoutError as e:
+        logger.warning("Section %r for %s timed out after %ss", title, safe_name, config.SECTION_TIMEOUT_SECONDS)
+        body, error = "_This section could not be generated in time. Please try again later._", e
+    except LLMUnavailable as e:
+        logger.warning("Section %r for %s skipped: the LLM service is unavailable", title, safe_name)
+        body, error = "_This section could not be generated: the LLM service is unavailable. Please try again later._", e
+    except Exception as e:
+        logger.exception("Section %r for %s failed: %s", title, safe_name, e)
+        body, error = "_This section could not be generated._", e
+    return format_section(number, title, body), error
+
+
+def _sections_failed(errors: List[Exception]) -> HTTPException:
+    """The error for a report none of whose sections could be generated."""
+    if all(isinstance(e, LLMUnavailable) for e in errors):
+        return _llm_unavailable(max(errors, key=lambda e: e.retry_after))
+    return HTTPException(status_code=500, detail="Insight generation failed")
+
+
+def _section_tasks(sections: List[Tuple[List[str], List[Optional[int]]]], safe_name: str) -> List[asyncio.Task]:
+    """Start writing every section at once; each task resolves to `_write_section`'s result."""
+    return [
+        asyncio.create_task(_write_section(number, chunks, pages, safe_name))
+        for number, (chunks, pages) in enumerate(sections, 1)
+    ]
+
+
+async def _reduce(summaries: List[str], safe_name: str) -> str:
+    """Reduce part summaries to structured insights."""
+    try:
+        return await reduce_summaries(summaries)
+    except LLMUnavailable as e:
+        raise _llm_unavailable(e)
+    except Exception as e:
+        logger.exception("Insight generation failed for %s: %s", safe_name, e)
+        raise HTTPException(status_code=500, detail="Insight generation failed")
+
+
+async def _summarize_parts(
+    chunks: List[str], pages: List[Optional[int]], safe_name: str, job: Optional[Job] = None
+) -> List[str]:
+    """Map step of GENERATION_MODE=map_reduce: part summaries covering the whole document."""
+    start = time.perf_counter()
+    try:
+        summaries = await map_summaries(chunks, pages, progress=job.update if job else None)
+    except LLMUnavailable as e:
+        raise _llm_unavailable(e)
+    except RuntimeError as e:
+        logger.exception("Summarizing parts of %s failed: %s", safe_name, e)
+        raise HTTPException(status_code=500, detail="Insight generation failed")
+    logger.info("Summarized %s into %d parts in %.2fs", safe_name, len(summaries), time.perf_counter() - start)
+    return summaries
+
+
+async def _prepare(
+    stream: BinaryIO,
+    safe_name: str,
+    pdf_backend: Optional[str] = None,
+    job: Optional[Job] = None,
+    doc_id: Optional[str] = None,
+) -> Tuple[dict, List[str], List[Optional[int]], Optional[list]]:
+    """Load, chunk, embed and retrieve: everything before generation.
+
+    Returns the result fields known so far, the retrieved chunks and their pages and,
+    with GENERATION_MODE=sections, the (chunks, pages) retrieved for each section.
+    """
+    if job:
+        job.update(status="running", stage="ingesting")
+    store, num_chunks = await run_cpu(_ingest, stream, safe_name, pdf_backend, job, doc_id)
+    chunk_stats = store.texts.length_stats()
+    logger.info("Chunked %s: %s", safe_name, chunk_stats)
+
+    if job:
+        job.update(stage="retrieving")
+    sections = None
+    if config.GENERATION_MODE == "sections":
+        sections, context = await run_cpu(_retrieve_sections, store, safe_name, pdf_backend is not None)
+        retrieved_chunks = [chunk for chunks, _ in sections for chunk in chunks]
+        retrieved_pages = [page for _, pages in sections for page in pages]
+    else:
+        retrieved_chunks, retrieved_pages, context = await run_cpu(
+            _retrieve, store, safe_name, pdf_backend is not None
+        )
+    if context is not None:
+        logger.info("Packed prompt context for %s: %s", safe_name, context)
+    if job:
+        job.update(stage="generating", llm="running")
+
+    meta = {
+        "doc_id": doc_id,
+        "num_chunks": num_chunks,
+        "source_pages": sorted({page for page in retrieved_pages if page is not None}),
+        "chunk_stats": chunk_stats,
+    }
+    if context is not None:
+        meta["context"] = context
+    return meta, retrieved_chunks, retrieved_pages, sections
+
+
+async def _run_pipeline(
+    stream: BinaryIO,
+    safe_name: str,
+    pdf_backend: Optional[str] = None,
+    job: Optional[Job] = None,
+    doc_id: Optional[str] = None,
+) -> dict:
+    """Load, chunk, embed, retrieve and generate insights for an uploaded document.
+
+    Blocking stages run on the worker pools so the event loop stays responsive.
+    Ingest and retrieval hold an analysis (CPU) admission slot, generation an LLM one.
+    Stage changes and progress are reported to `job` when one is given.
+    """
+    async with analysis_admission.admit():
+        meta, retrieved_chunks, retrieved_pages, sections = await _prepare(stream, safe_name, pdf_backend, job, doc_id)
+    async with llm_admission.admit():
+        if sections is not None:
+            written = await asyncio.gather(*_section_tasks(sections, safe_name))
+            errors = [error for _, error in written if error is not None]
+            if len(errors) == len(written):
+                raise _sections_failed(errors)
+            failed = [SECTIONS[i][0] for i, (_, error) in enumerate(written) if error is not None]
+            if failed:
+                meta["failed_sections"] = failed
+            insights = "\n\n".join(text for text, _ in written)
+        elif config.GENERATION_MODE == "map_reduce":
+            summaries = await _summarize_parts(retrieved_chunks, retrieved_pages, safe_name, job)
+            insights = await _reduce(summaries, safe_name)
+        else:
+            insights = await _generate(retrieved_chunks, retrieved_pages, safe_name)
+    if job:
+        job.update(llm="done")
+    return {**meta, "insights": insights}
+
+
+async def _compute(
+    stream: BinaryIO, safe_name: str, pdf_backend: Optional[str], doc_id: str, job: Optional[Job] = None
+) -> dict:
+    """Run the pipeline (behind admission control) and cache the result."""
+    # Only the request doing the work takes admission slots; identical
+    # concurrent uploads just wait for its result
+    result = await _run_pipeline(stream, safe_name, pdf_backend=pdf_backend, job=job, doc_id=doc_id)
+    # Don't keep a report with placeholder sections; the next request tries again
+    if not result.get("failed_sections"):
+        await asyncio.to_thread(result_cache.put, _result_key(doc_id), result)
+    return result
+
+
+def _spool_copy(stream: BinaryIO) -> BinaryIO:
+    """Copy an upload into a buffer we own, since the request's file is closed after the response."""
+    spooled = tempfile.SpooledTemporaryFile(max_size=config.JOB_SPOOL_MAX_BYTES)
+    stream.seek(0)
+    shutil.copyfileobj(stream, spooled)
+    spooled.seek(0)
+    return spooled
+
+
+async def _run_job(job: Job, stream: BinaryIO, safe_name: str, pdf_backend: Optional[str], doc_id: str) -> None:
+    try:
+        result = await _inflight.run(
+            doc_id, lambda: _compute(stream, safe_name, pdf_backend, doc_id, job=job)
+        )
+        job.finish(result={"filename": safe_name, **result})
+    except Saturated:
+        job.finish(error={"status_code": 503, "detail": "Server is busy, please retry later"})
+    except HTTPException as e:
+        job.finish(error={"status_code": e.status_code, "detail": e.detail})
+    except Exception as e:
+        logger.exception("Unexpected error in job %s for %s: %s", job.id, safe_name, e)
+        job.finish(error={"status_code": 500, "detail": "Unexpected server error"})
+    finally:
+        stream.close()
+
+
+def _busy() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Server is busy, please retry later",
+        headers={"Retry-After": str(analysis_admission.retry_after)},
+    )
+
+
+def _llm_unavailable(e: LLMUnavailable) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="LLM service is unavailable, please retry later",
+        headers={"Retry-After": str(max(1, round(e.retry_after)))},
+    )
+
+
+def sse_event(payload: dict) -> str:
+    """Format one server-sent event carrying a JSON payload."""
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+def _event_stream_response(events) -> StreamingResponse:
+    return StreamingResponse(events, media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+def _result_events(safe_name: str, result: dict) -> List[dict]:
+    """Stream events delivering a finished result at once."""
+    meta = {key: value for key, value in result.items() if key not in ("insights", "failed_sections")}
+    failed = result.get("failed_sections")
+    return [
+        {"type": "meta", "filename": safe_name, **meta},
+        {"type": "delta", "text": result["insights"]},
+        {"type": "done", "failed_sections": failed} if failed else {"type": "done"},
+    ]
+
+
+def _error_event(e: Exception) -> dict:
+    if isinstance(e, Saturated):
+        return {"type": "error", "status_code": 503, "detail": "Server is busy, please retry later"}
+    if isinstance(e, HTTPException):
+        return {"type": "error", "status_code": e.status_code, "detail": e.detail}
+    return {"type": "error", "status_code": 500, "detail": "Unexpected server error"}
+
+
+async def _stream_cached(safe_name: str, cached: dict):
+    for event in _result_events(safe_name, cached):
+        yield sse_event(event)
+
+
+async def _produce_stream(
+    log: EventLog, stream: BinaryIO, safe_name: str, pdf_backend: Optional[str], doc_id: str
+) -> dict:
+    """Run the pipeline for `stream=true`, appending its events to `log`; returns the result like `_compute`.
+
+    Events are JSON objects with a `type` of "progress", "meta", "delta", "done" or "error":
+    progress snapshots, result metadata, then insight text as generated. With
+    GENERATION_MODE=map_reduce the map step reports progress too and the reduce
+    step is streamed. The complete result is cached once generation finishes.
+    """
+    map_reduce = config.GENERATION_MODE == "map_reduce"
+    job = Job(safe_name)
+
+    async def with_progress(work):
+        """Await `work` in a task, appending the job's progress snapshots to the log meanwhile."""
+        task = asyncio.create_task(work)
+        # Make sure the progress loop below wakes up even if the work fails
+        task.add_done_callback(lambda _: job.update())
+        try:
+            async for snapshot in job.events():
+                snapshot.pop("job_id")
+                log.append({"type": "progress", **snapshot})
+                if task.done() or snapshot["status"] in TERMINAL_STATUSES:
+                    break
+            return await task
+        finally:
+            # When every client has gone, stop the work before the upload is closed
+            # and the admission slot released
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    try:
+        # Ingest and retrieval hold a CPU slot; the LLM phase only an LLM one
+        async with analysis_admission.admit():
+            meta, chunks, pages, sections = await with_progress(
+                _prepare(stream, safe_name, pdf_backend, job, doc_id=doc_id)
+            )
+        async with llm_admission.admit():
+            summaries = await with_progress(_summarize_parts(chunks, pages, safe_name, job)) if map_reduce else None
+            log.append({"type": "meta", "filename": safe_name, **meta})
+
+            pieces = []
+            failed = []
+            errors = []
+            if sections is not None:
+                # Sections are written concurrently and sent in report order as they finish
+                tasks = _section_tasks(sections, safe_name)
+                try:
+                    for number, task in enumerate(tasks, 1):
+                        text, error = await task
+                        if error is not None:
+                            failed.append(SECTIONS[number - 1][0])
+                            errors.append(error)
+                        text = text if number == 1 else f"\n\n{text}"
+                        pieces.append(text)
+                        log.append({"type": "delta", "text": text})
+                finally:
+                    for task in tasks:
+                        task.cancel()
+                if len(errors) == len(tasks):
+                    raise _sections_failed(errors)
+            else:
+                if map_reduce:
+                    generation = stream_reduce_summaries(summaries)
+                else:
+                    generation = stream_insights(chunks, pages=pages)
+                try:
+                    async with aclosing(generation):
+                        async for text in generation:
+                            pieces.append(text)
+                            log.append({"type": "delta", "text": text})
+                except LLMUnavailable as e:
+                    raise _llm_unavailable(e)
+                except Exception as e:
+                    logger.exception("Insight generation failed for %s: %s", safe_name, e)
+                    raise HTTPException(status_code=500, detail="Insight generation failed")
+
+        result = {**meta, "insights": "".join(pieces)}
+        if failed:
+            result["failed_sections"] = failed
+            log.append({"type": "done", "failed_sections": failed})
+        else:
+            await asyncio.to_thread(result_cache.put, _result_key(doc_id), result)
+            log.append({"type": "done"})
+        return result
+
+    except Exception as e:
+        if not isinstance(e, (Saturated, HTTPException)):
+            logger.exception("Unexpected error streaming %s: %s", safe_name, e)
+        log.append(_error_event(e))
+        raise
+
+
+async def _run_stream(
+    log: EventLog, stream: BinaryIO, safe_name: str, pdf_backend: Optional[str], doc_id: str
+) -> None:
+    """Produce a streamed analysis behind `_inflight`, so identical uploads of any kind share it.
+
+    If an identical upload that is not streamed got there first, its result is sent instead.
+    """
+    produced = False
+
+    def produce():
+        nonlocal produced
+        produced = True
+        return _produce_stream(log, stream, safe_name, pdf_backend, doc_id)
+
+    try:
+        result = await _inflight.run(doc_id, produce)
+        if not produced:
+            for event in _result_events(safe_name, result):
+                log.append(event)
+    except Exception as e:
+        # What _produce_stream raises it has already sent as an "error" event
+        if not produced:
+            log.append(_error_event(e))
+    finally:
+        _streams.pop(doc_id, None)
+        log.close()
+        stream.close()
+
+
+def _start_stream(
+    stream: BinaryIO, safe_name: str, pdf_backend: Optional[str], doc_id: str
+) -> Tuple[EventLog, asyncio.Task]:
+    """Start analyzing an upload for `stream=true` streams to follow; closes `stream` when done."""
+    log = EventLog()
+    task = asyncio.create_task(_run_stream(log, stream, safe_name, pdf_backend, doc_id))
+    _streams[doc_id] = (log, task)
+    return log, task
+
+
+def _follow_stream(log: EventLog, task: asyncio.Task, safe_name: str, doc_id: str):
+    """Event stream for `stream=true`: the shared analysis's events, from the start.
+
+    Subscribes (synchronously, before the response starts) so the work is never
+    left without one. When the last stream goes away and no other request waits
+    for the result, the work is cancelled.
+    """
+    log.subscribers += 1
+
+    async def events():
+        try:
+            async for event in log.follow():
+                if "filename" in event:
+                    event = {**event, "filename": safe_name}
+                yield sse_event(event)
+        finally:
+            log.subscribers -= 1
+            if not log.subscribers and not _inflight.waiters(doc_id) and not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+
+    return events()
+
+
+async def _stream_waiting(safe_name: str, future: asyncio.Future):
+    """Event stream for a streamed upload identical to one being analyzed without streaming: its result."""
+    try:
+        events = _result_events(safe_name, await asyncio.shield(future))
+    except asyncio.CancelledError:
+        if not future.cancelled():
+            raise
+        # The request doing the work went away
+        events = [{"type": "error", "status_code": 503, "detail": "The analysis was interrupted, please retry"}]
+    except Exception as e:
+        events = [_error_event(e)]
+    for event in events:
+        yield sse_event(event)
+
 
 @router.post("/")
-async def analyze_document(file: UploadFile = File(...)):
-    # 1. Validate file type
+async def analyze_document(
+    response: Response,
+    file: UploadFile = File(...),
+    pdf_backend: Optional[str] = None,
+    background: bool = False,
+    stream: bool = False,
+    no_cache: bool = False,
+):
+    """Analyze an uploaded PDF or TXT file.
+
+    With `background=true` the analysis runs as a job: the response (202) carries a
+    job id to poll at /analyze/jobs/{id} or stream from /analyze/jobs/{id}/events.
+    With `stream=true` the response is a server-sent event stream that delivers the
+    insights as they are generated (see `_produce_stream`).
+    With `no_cache=true` neither cached insights nor cached LLM responses are used;
+    the fresh result replaces them.
+    """
+    # Jobs, streams and LLM calls started for this request run in copies of this context
+    bypass_cache.set(no_cache)
+    # 1. Validate file type (and the PDF backend, if one was requested)
     if not file.filename.lower().endswith((".pdf", ".txt")):
         raise HTTPException(
             status_code=400,
             detail="Only PDF and TXT files are supported"
         )
+    backend_name = None
+    if file.filename.lower().endswith(".pdf"):
+        try:
+            backend_name = get_backend(pdf_backend or config.PDF_BACKEND).name
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
-    # 2. Save uploaded file (sanitize filename to avoid path traversal)
+    # 2. Hash the upload as it streams in, enforcing the size limit. The bytes stay in
+    #    the request's spooled buffer, which is parsed directly (sanitize filename for logs/keys)
     safe_name = sanitize_filename(file.filename)
-    file_path = os.path.join(UPLOAD_DIR, safe_name)
+    ext = os.path.splitext(safe_name)[1].lower()
+    digest = hashlib.sha256()
+    size = 0
     try:
-        with open(file_path, "wb") as buffer:
-            file.file.seek(0)
-            shutil.copyfileobj(file.file, buffer)
-        logger.info("Saved uploaded file %s to %s", safe_name, file_path)
+        await file.seek(0)
+        while True:
+            piece = await file.read(UPLOAD_CHUNK_SIZE)
+            if not piece:
+                break
+            size += len(piece)
+            if size > config.MAX_UPLOAD_BYTES:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"File exceeds the upload limit of {config.MAX_UPLOAD_BYTES} bytes"
+                )
+            digest.update(piece)
+        logger.info("Received uploaded file %s (%d bytes)", safe_name, size)
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.exception("Failed to save uploaded file %s: %s", safe_name, e)
-        raise HTTPException(status_code=500, detail="Failed to save uploaded file")
+        logger.exception("Failed to read uploaded file %s: %s", safe_name, e)
+        raise HTTPException(status_code=500, detail="Failed to read uploaded file")
 
-    # Process the file with guarded steps and clear logging
-    try:
-        # 3. Load document
-        text = load_document(file_path)
-        logger.debug("Loaded document %s (length=%d)", safe_name, len(text))
-
-        # 4. Chunk document
-        chunks = chunk_text(text)
-        if not chunks:
-            logger.warning("Document %s produced no chunks", safe_name)
-            raise HTTPException(status_code=400, detail="Document is empty or contained no text")
-
-        # 5. Create embedding store and add texts
-        store = EmbeddingStore()
-        try:
-            store.add_texts(chunks)
-        except Exception as e:
-            logger.exception("Failed to create embeddings for %s: %s", safe_name, e)
-            raise HTTPException(status_code=500, detail="Failed to create embeddings")
+    await run_cpu(upload_store.save, file.file, digest.hexdigest(), ext)
 
-        # 6. Retrieve top chunks for insights
-        retrieved = store.search("key insights and risks", top_k=5)
-        retrieved_chunks = [text for text, _ in retrieved]
+    # The extension and PDF backend decide how text is extracted, so they are part of the
+    # document's id, which keys the corpus index, in-flight work and (with the pipeline
+    # settings) the result cache
+    doc_id = f"{digest.hexdigest()}{ext}"
+    if backend_name:
+        doc_id = f"{doc_id}.{backend_name}"
+    # Cache file I/O runs on the default thread pool: a hit shouldn't wait behind CPU work
+    cached = None if no_cache else await asyncio.to_thread(result_cache.get, _result_key(doc_id))
+    if cached is not None:
+        logger.info("Serving cached insights for %s (%s)", safe_name, doc_id)
+        if stream:
+            return _event_stream_response(_stream_cached(safe_name, cached))
+        if background:
+            job = jobs.create(safe_name)
+            job.finish(result={"filename": safe_name, **cached})
+            response.status_code = 202
+            return {"job_id": job.id, "status": job.status}
+        return {"filename": safe_name, **cached}
 
-        if not retrieved_chunks:
-            logger.warning("No relevant chunks retrieved for %s", safe_name)
+    if stream:
+        # Identical uploads being analyzed: follow the streamed one, or wait for the other's result
+        shared = _streams.get(doc_id)
+        if shared is not None:
+            return _event_stream_response(_follow_stream(*shared, safe_name, doc_id))
+        waiting = _inflight.get(doc_id)
+        if waiting is not None:
+            return _event_stream_response(_stream_waiting(safe_name, waiting))
 
-        # 7. Generate structured insights
-        try:
-            insights = generate_insights(retrieved_chunks)
-        except Exception as e:
-            logger.exception("Insight generation failed for %s: %s", safe_name, e)
-            raise HTTPException(status_code=500, detail="Insight generation failed")
+    if background or stream:
+        # Refuse up front rather than accept work that would fail admission later.
+        # The upload is copied because the request's file is closed once we respond
+        if not analysis_admission.has_capacity():
+            raise _busy()
+        spooled = await run_cpu(_spool_copy, file.file)
+        if stream:
+            log, task = _start_stream(spooled, safe_name, backend_name, doc_id)
+            return _event_stream_response(_follow_stream(log, task, safe_name, doc_id))
+        job = jobs.create(safe_name)
+        job.task = asyncio.create_task(_run_job(job, spooled, safe_name, backend_name, doc_id))
+        response.status_code = 202
+        return {"job_id": job.id, "status": job.status}
 
-        return {
-            "filename": safe_name,
-            "num_chunks": len(chunks),
-            "insights": insights
-        }
+    # Process the file with guarded steps and clear logging
+    try:
+        result = await _inflight.run(
+            doc_id, lambda: _compute(file.file, safe_name, backend_name, doc_id)
+        )
+        return {"filename": safe_name, **result}
 
+    except Saturated:
+        raise _busy()
     except HTTPException:
         # Re-raise HTTPExceptions so FastAPI can handle them
         raise
     except Exception as e:
         logger.exception("Unexpected error analyzing %s: %s", safe_name, e)
         raise HTTPException(status_code=500, detail="Unexpected server error")
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status, per-stage progress and (once finished) result or error of a background job."""
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job.snapshot()
+
+
+@router.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """Server-sent events: one `data:` line with the job snapshot per change, until it finishes."""
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+
+    async def event_stream():
+        async for snapshot in job.events():
+            yield sse_event(snapshot)
+
+    return _event_stream_response(event_stream())
+
+
+@router.get("/documents")
+async def list_documents():
+    """Documents in the corpus index."""
+    corpus = await run_cpu(get_corpus_index)
+    if corpus is None:
+        raise HTTPException(status_code=404, detail="The corpus index is disabled")
+    return {"documents": await run_cpu(corpus.documents), "stats": await run_cpu(corpus.stats)}
+
+
+@router.delete("/documents/{doc_id}")
+async def delete_document(doc_id: str):
+    """Remove a document from the corpus index (and its cached insights)."""
+    corpus = await run_cpu(get_corpus_index)
+    if corpus is None:
+        raise HTTPException(status_code=404, detail="The corpus index is disabled")
+    if not await run_cpu(corpus.delete_document, doc_id):
+        raise HTTPException(status_code=404, detail="Document not found")
+    await asyncio.to_thread(result_cache.delete_prefix, doc_id)
+    documents.discard(doc_id)
+    return {"doc_id": doc_id, "deleted": True}
+
+
+@router.get("/search")
+async def search_corpus(q: str, top_k: int = 5, doc_id: Optional[List[str]] = Query(None)):
+    """Chunks across all analyzed documents (or only `doc_id`s) closest to the query `q`."""
+    if not 1 <= top_k <= 100:
+        raise HTTPException(status_code=400, detail="top_k must be between 1 and 100")
+    corpus = await run_cpu(get_corpus_index)
+    if corpus is None:
+        raise HTTPException(status_code=404, detail="The corpus index is disabled")
+
+    def search() -> List[dict]:
+        query = normalize(get_embedding_batcher().encode([q]))
+        return corpus.search(query, top_k=top_k, doc_ids=doc_id)
+
+    return {"query": q, "hits": await run_cpu(search)}
+
+
+class AskRequest(BaseModel):
+    question: str
+    top_k: int = config.ASK_TOP_K
+
+
+@router.post("/{doc_id}/ask")
+async def ask_document(doc_id: str, req: AskRequest):
+    """Answer a question about an analyzed document (`doc_id` from its analysis result).
+
+    Reuses the document's stored embeddings: one query encode, one index search and
+    one LLM call. `timings_ms` gives the latency of each stage; `load` is near zero
+    when the document is still in memory and covers reading it back from the corpus
+    index otherwise.
+    """
+    question = req.question.strip()
+    if not question:
+        raise HTTPException(status_code=400, detail="Question must not be empty")
+    if not 1 <= req.top_k <= 50:
+        raise HTTPException(status_code=400, detail="top_k must be between 1 and 50")
+
+    timings = {}
+    started = time.perf_counter()
+
+    def lap(stage: str) -> None:
+        nonlocal started
+        now = time.perf_counter()
+        timings[stage] = round((now - started) * 1000, 2)
+        started = now
+
+    store = await run_cpu(documents.get, doc_id)
+    lap("load")
+    if store is None:
+        if not config.CORPUS_INDEX_ENABLED:
+            # Documents only live in memory, so this one may have been analyzed and evicted
+            raise HTTPException(
+                status_code=404,
+                detail="Document not found or no longer in memory; upload it again to ask about it",
+            )
+        raise HTTPException(status_code=404, detail="Document not found; analyze it first")
+
+    try:
+        query = await run_cpu(store.encode_query, question)
+    except Exception as e:
+        logger.exception("Failed to embed question for %s: %s", doc_id, e)
+        raise HTTPException(status_code=500, detail="Failed to embed question")
+    lap("encode")
+    hits = await run_cpu(store.search_vector, query, req.top_k, config.MMR_LAMBDA)
+    lap("search")
+
+    # Document ids end in the upload's extension (and PDF backend); only PDFs have real page numbers
+    has_pages = not doc_id.endswith(".txt")
+    chunks, pages, context = await run_cpu(pack_context, store, [idx for idx, _ in hits], has_pages)
+    lap("pack")
+    try:
+        answer = await answer_question(question, chunks, pages)
+    except LLMUnavailable as e:
+        raise _llm_unavailable(e)
+    except RuntimeError as e:
+        logger.exception("Answering a question about %s failed: %s", doc_id, e)
+        raise HTTPException(status_code=500, detail="Answer generation failed")
+    lap("generate")
+    timings["total"] = round(sum(timings.values()), 2)
+
+    return {
+        "doc_id": doc_id,
+        "question": question,
+        "answer": answer,
+        "source_pages": sorted({page for page in pages if page is not None}),
+        "scores": [round(score, 4) for _, score in hits],
+        "context": context,
+        "timings_ms": timings,
+    }
@@ -1,4 +1,73 @@
+import logging
 import re
+from array import array
+from bisect import bisect_right
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from .. import config
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r'\s+')
+_NON_WHITESPACE = re.compile(r'\S')
+# End of a sentence: terminal punctuation, optional closing quote/bracket, then whitespace
+_SENTENCE_END = re.compile(r'[.!?]["\')\]]?(?=\s)')
+
+
+def iter_chunks(pieces: Iterable[str], chunk_size: int = 500, overlap: int = 50) -> Iterator[str]:
+    """
+    Split a stream of text pieces into overlapping chunks, incrementally.
+
+    Pieces (e.g. pages) are treated as one continuous text, so chunks span piece
+    boundaries. Only the text not yet covered by an emitted chunk is buffered,
+    which keeps memory proportional to the piece size, not the document size.
+    Produces exactly the chunks `chunk_text` would for the concatenated text.
+
+    Args:
+        pieces: Iterable of text pieces, in document order.
+        chunk_size: Number of characters per chunk.
+        overlap: Number of overlapping characters between chunks.
+
+    Yields:
+        Text chunks.
+    """
+    step = chunk_size - overlap
+    buffer = ""
+    at_start = True
+    # Whether the text so far ends in a space; the buffer alone can't tell once it is trimmed
+    ends_with_space = False
+    for piece in pieces:
+        # 1. Normalize whitespace, collapsing runs that straddle piece boundaries
+        piece = _WHITESPACE.sub(' ', piece)
+        if at_start:
+            piece = piece.lstrip()
+            at_start = not piece
+        if ends_with_space and piece.startswith(' '):
+            piece = piece[1:]
+        if not piece:
+            continue
+        buffer += piece
+        ends_with_space = piece.endswith(' ')
+
+        # 2. Emit every chunk that is complete
+        start = 0
+        while len(buffer) - start >= chunk_size:
+            chunk = buffer[start:start + chunk_size].strip()
+            if chunk:  # skip empty chunks
+                yield chunk
+            start += step
+        buffer = buffer[start:]
+
+    # 3. Emit the tail
+    buffer = buffer.rstrip()
+    start = 0
+    while start < len(buffer):
+        chunk = buffer[start:start + chunk_size].strip()
+        if chunk:
+            yield chunk
+        start += step
+
+
 def chunk_text(text: str, chunk_size: int = 500, overlap: int = 50) -> list[str]:
     """
     Split text into overlapping chunks for embeddings or analysis.
@@ -11,19 +80,352 @@ def chunk_text(text: str, chunk_size: int = 500, overlap: int = 50) -> list[str]
     Returns:
         List of text chunks.
     """
-    # 1. Normalize whitespace
-    text = re.sub(r'\s+', ' ', text).strip()
-    
-    # 2. Create chunks
-    chunks = []
-    start = 0
-    text_length = len(text)
-    
-    while start < text_length:
-        end = min(start + chunk_size, text_length)
-        chunk = text[start:end].strip()
-        if chunk:  # skip empty chunks
-            chunks.append(chunk)
-        start += chunk_size - overlap
-    
-    return chunks
+    return list(iter_chunks([text], chunk_size=chunk_size, overlap=overlap))
+
+
+class ChunkSpans:
+    """
+    Compact, array-backed chunk records: (start, end, page) offsets into a document text.
+
+    Chunk text is only materialized (with whitespace normalized) when indexed, e.g.
+    for embedding or prompting, so overlapping regions are never stored twice.
+    Supports len() and indexing like a list of chunk strings.
+    """
+
+    __slots__ = ("text", "starts", "ends", "pages", "token_counts", "page_starts", "page_numbers")
+
+    def __init__(self, text: str = ""):
+        self.text = text
+        self.starts = array("q")
+        self.ends = array("q")
+        self.pages = array("l")
+        # Filled by the token-budgeted chunker only
+        self.token_counts = array("l")
+        # Offset where each page begins, for mapping offsets back to pages
+        self.page_starts = array("q")
+        self.page_numbers = array("l")
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __getitem__(self, i: int) -> str:
+        return _WHITESPACE.sub(' ', self.text[self.starts[i]:self.ends[i]])
+
+    def __iter__(self) -> Iterator[str]:
+        return (self[i] for i in range(len(self)))
+
+    def span(self, i: int) -> Tuple[int, int, int]:
+        return self.starts[i], self.ends[i], self.pages[i]
+
+    def passage(self, start: int, end: int) -> str:
+        """Text between two document offsets, whitespace-normalized like the chunks."""
+        return _WHITESPACE.sub(' ', self.text[start:end])
+
+    def page(self, i: int) -> int:
+        return self.pages[i]
+
+    def page_at(self, offset: int) -> int:
+        """Page number containing `offset` (1 if no pages were recorded)."""
+        i = bisect_right(self.page_starts, offset) - 1
+        return self.page_numbers[i] if i >= 0 else 1
+
+    def length_stats(self) -> dict:
+        """Chunk-length distribution, in tokens when known, otherwise in characters."""
+        if len(self.token_counts) == len(self):
+            return chunk_length_stats(self.token_counts, unit="tokens")
+        return chunk_length_stats([end - start for start, end in zip(self.starts, self.ends)], unit="chars")
+
+
+def chunk_length_stats(lengths: Sequence[int], unit: str = "chars") -> dict:
+    """Summarize a chunk-length distribution (count, min/max/mean and percentiles)."""
+    if not lengths:
+        return {"unit": unit, "count": 0}
+    ordered = sorted(lengths)
+    n = len(ordered)
+
+    def percentile(q: float) -> int:
+        return ordered[min(n - 1, int(q * n))]
+
+    return {
+        "unit": unit,
+        "count": n,
+        "min": ordered[0],
+        "p50": percentile(0.5),
+        "p90": percentile(0.9),
+        "max": ordered[-1],
+        "mean": round(sum(ordered) / n, 1),
+    }
+
+
+class SpanChunker:
+    """
+    Incremental, offset-based chunker over a stream of (page, text) pairs.
+
+    Chunks are recorded as spans in `spans`. Only the text not yet covered by a
+    chunk is buffered while feeding; the full document text is joined once in
+    `finish()`. Boundaries are measured in raw characters of the original text.
+
+    Args:
+        chunk_size: Maximum number of characters per chunk.
+        overlap: Number of characters shared by consecutive chunks.
+        snap_tolerance: If > 0, end a chunk at the last sentence end within this many
+            characters before the size limit, when there is one.
+    """
+
+    def __init__(self, chunk_size: int = 500, overlap: int = 50, snap_tolerance: int = 0):
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.snap_tolerance = snap_tolerance
+        self.spans = ChunkSpans()
+        self._parts: List[str] = []
+        self._window = ""
+        self._window_start = 0
+        self._length = 0
+        self._next = 0
+        self._prev_end = 0
+        self._page: Optional[int] = None
+
+    def feed(self, page: int, text: str) -> List[str]:
+        """Add the next piece of text; return the materialized text of newly completed chunks."""
+        self._begin_page(page)
+        self._append(text)
+        return self._emit(final=False)
+
+    def feed_pages(self, pages: Sequence[Tuple[int, str]]) -> List[str]:
+        """Add several (page, text) pieces at once."""
+        chunks = []
+        for page, text in pages:
+            chunks.extend(self.feed(page, text))
+        return chunks
+
+    def finish(self) -> List[str]:
+        """Close the last chunk; afterwards `spans.text` holds the full document text."""
+        chunks = self._emit(final=True)
+        self.spans.text = "".join(self._parts)
+        self._parts = []
+        self._window = ""
+        return chunks
+
+    def _begin_page(self, page: int) -> None:
+        if self._page is not None and page != self._page:
+            # Keep the last word of one page from fusing with the first of the next
+            self._append("\n")
+        if page != self._page:
+            self.spans.page_starts.append(self._length)
+            self.spans.page_numbers.append(page)
+            self._page = page
+
+    def _append(self, text: str) -> None:
+        self._parts.append(text)
+        self._window += text
+        self._length += len(text)
+
+    def _snap(self, start: int, end: int) -> int:
+        # Never snap so far back that the chunk adds nothing past the previous one
+        lower = max(end - self.snap_tolerance, start + 1, self._prev_end + 1)
+        base = self._window_start
+        last = None
+        for match in _SENTENCE_END.finditer(self._window, lower - base, end - base):
+            last = match
+        return base + last.end() if last else end
+
+    def _emit(self, final: bool) -> List[str]:
+        chunks = []
+        base = self._window_start
+        while True:
+            match = _NON_WHITESPACE.search(self._window, self._next - base)
+            if match is None:
+                if final:
+                    self._next = self._length
+                break
+            start = base + match.start()
+            end = start + self.chunk_size
+            last = end >= self._length
+            if last:
+                if not final:
+                    break
+                end = self._length
+            elif self.snap_tolerance > 0:
+                end = self._snap(start, end)
+
+            raw = self._window[start - base:end - base].rstrip()
+            end = start + len(raw)
+            if end <= self._prev_end:
+                # Only whitespace past the previous chunk: resume after it instead
+                if last:
+                    self._next = self._length
+                    break
+                self._next = self._prev_end
+                continue
+            self._prev_end = end
+            self.spans.starts.append(start)
+            self.spans.ends.append(end)
+            self.spans.pages.append(self.spans.page_at(start))
+            chunks.append(_WHITESPACE.sub(' ', raw))
+
+            if last:
+                self._next = self._length
+                break
+            self._next = max(end - self.overlap, start + 1)
+
+        # Drop text that no future chunk can start in
+        self._window = self._window[self._next - base:]
+        self._window_start = self._next
+        return chunks
+
+
+class TokenSpanChunker(SpanChunker):
+    """
+    Span chunker that cuts on token boundaries of the embedding model's tokenizer.
+
+    Every chunk holds at most `max_tokens` tokens (so nothing is truncated by the
+    model's sequence limit) and consecutive chunks share about `overlap_tokens`
+    tokens. Chunks start and end on word starts, since a chunk that begins on a
+    subword continuation tokenizes longer on its own than inside the page; each
+    chunk is tokenized again and that count is what `spans.token_counts` records.
+    Pages are tokenized in batches with offset mapping and word ids, which requires
+    a fast (Rust-backed) Hugging Face tokenizer.
+    """
+
+    def __init__(self, tokenizer, max_tokens: int = 254, overlap_tokens: int = 32):
+        if not getattr(tokenizer, "is_fast", False):
+            raise ValueError("Token chunking needs a fast tokenizer with offset mapping")
+        if not 0 <= overlap_tokens < max_tokens:
+            raise ValueError("overlap_tokens must be smaller than max_tokens")
+        super().__init__(chunk_size=0, overlap=0)
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        # Absolute character offsets of the tokens not yet fully consumed
+        self._token_starts: List[int] = []
+        self._token_ends: List[int] = []
+        # Whether each of those tokens begins a word (False for subword continuations)
+        self._word_starts: List[bool] = []
+
+    def feed(self, page: int, text: str) -> List[str]:
+        return self.feed_pages([(page, text)])
+
+    def feed_pages(self, pages: Sequence[Tuple[int, str]]) -> List[str]:
+        if not pages:
+            return []
+        bases = []
+        for page, text in pages:
+            self._begin_page(page)
+            bases.append(self._length)
+            self._append(text)
+
+        encoded = self.tokenizer(
+            [text for _, text in pages],
+            add_special_tokens=False,
+            return_offsets_mapping=True,
+            return_attention_mask=False,
+            verbose=False,
+        )
+        for k, (base, offsets) in enumerate(zip(bases, encoded["offset_mapping"])):
+            previous = None
+            for (start, end), word in zip(offsets, encoded.word_ids(k)):
+                if end > start:
+                    self._token_starts.append(base + start)
+                    self._token_ends.append(base + end)
+                    self._word_starts.append(word is None or word != previous)
+                previous = word
+        return self._emit(final=False)
+
+    def _count(self, text: str) -> int:
+        encoded = self.tokenizer(
+            text, add_special_tokens=False, return_attention_mask=False, verbose=False
+        )
+        return len(encoded["input_ids"])
+
+    def _word_start_before(self, i: int, j: int) -> int:
+        """Last word start in (i, j], or j itself when the whole range is one word."""
+        k = j
+        while k > i + 1 and not self._word_starts[k]:
+            k -= 1
+        return k if self._word_starts[k] else j
+
+    def _emit(self, final: bool) -> List[str]:
+        chunks = []
+        base = self._window_start
+        starts, ends, word_starts = self._token_starts, self._token_ends, self._word_starts
+        n = len(starts)
+        i = 0
+        while i < n:
+            # Until the last page is in, keep one token past the chunk to see whether it starts a word
+            if n - i <= self.max_tokens and not final:
+                break
+            j = min(i + self.max_tokens, n)
+            if j < n:
+                j = self._word_start_before(i, j)
+            text = _WHITESPACE.sub(' ', self._window[starts[i] - base:ends[j - 1] - base])
+            count = self._count(text)
+            while count > self.max_tokens and j - i > 1:
+                # Tokenized on its own the text can split differently; drop words off the end
+                j = self._word_start_before(i, j - 1)
+                text = _WHITESPACE.sub(' ', self._window[starts[i] - base:ends[j - 1] - base])
+                count = self._count(text)
+
+            start, end = starts[i], ends[j - 1]
+            self.spans.starts.append(start)
+            self.spans.ends.append(end)
+            self.spans.pages.append(self.spans.page_at(start))
+            self.spans.token_counts.append(count)
+            chunks.append(text)
+            if final and j >= n:
+                i = n
+                break
+            # Back up `overlap_tokens` from the end, then to the start of that word
+            nxt = self._word_start_before(i, max(i + 1, j - self.overlap_tokens))
+            while not word_starts[nxt] and nxt < j:
+                nxt += 1
+            i = nxt
+
+        del starts[:i], ends[:i], word_starts[:i]
+        new_start = starts[0] if starts else self._length
+        self._window = self._window[new_start - base:]
+        self._window_start = new_start
+        return chunks
+
+
+def make_chunker(tokenizer=None, max_seq_length: Optional[int] = None) -> SpanChunker:
+    """Build the span chunker selected by config.CHUNK_MODE.
+
+    In token mode the chunk budget defaults to the model's `max_seq_length` minus the
+    two special tokens the model adds. Token mode falls back to character chunks when
+    no fast tokenizer is available.
+    """
+    if config.CHUNK_MODE == "tokens":
+        if tokenizer is not None and getattr(tokenizer, "is_fast", False):
+            max_tokens = config.CHUNK_TOKENS or (max_seq_length or 256) - 2
+            return TokenSpanChunker(
+                tokenizer,
+                max_tokens=max_tokens,
+                overlap_tokens=min(config.CHUNK_TOKEN_OVERLAP, max_tokens - 1),
+            )
+        logger.warning("CHUNK_MODE=tokens needs a fast tokenizer; falling back to character chunks")
+    return SpanChunker(
+        chunk_size=config.CHUNK_SIZE,
+        overlap=config.CHUNK_OVERLAP,
+        snap_tolerance=config.CHUNK_SNAP_TOLERANCE,
+    )
+
+
+def chunk_spans(
+    text: str, chunk_size: int = 500, overlap: int = 50, snap_tolerance: int = 0
+) -> ChunkSpans:
+    """
+    Split text into overlapping chunk spans without copying chunk text.
+
+    Args:
+        text: The input document text.
+        chunk_size: Maximum number of characters per chunk.
+        overlap: Number of overlapping characters between chunks.
+        snap_tolerance: If > 0, snap chunk ends back to a sentence end within this many characters.
+
+    Returns:
+        ChunkSpans over `text`.
+    """
+    chunker = SpanChunker(chunk_size=chunk_size, overlap=overlap, snap_tolerance=snap_tolerance)
+    chunker.feed(1, text)
+    chunker.finish()
+    return chunker.spans
@@ -0,0 +1,187 @@
+"""
+Token-aware packing of retrieved chunks into prompt context.
+
+Retrieved chunks overlap their neighbours (CHUNK_OVERLAP / CHUNK_TOKEN_OVERLAP)
+and neighbouring hits often say the same thing, so joining them as-is pays for
+the same text several times. `pack_context` takes a store's chunk indices in
+relevance order and:
+
+- drops chunks whose embedding is a near-duplicate of one already taken,
+- merges overlapping or adjacent chunks back into contiguous passages, so
+  shared text appears once, and
+- keeps adding chunks in relevance order while the packed passages fit the
+  token budget.
+
+Map-reduce sends the whole document instead: `document_passages` cuts it into
+contiguous passages of a token budget, taking each chunk's text past the
+previous one, so the overlap between chunks is not summarized twice.
+
+When the chunks were cut on the embedding model's tokens (CHUNK_MODE=tokens),
+passages are counted with that tokenizer and chunks by their recorded
+token_counts; otherwise tokens are estimated from length (CHARS_PER_TOKEN).
+The stats returned with the passages compare the packed size with what the
+unpacked chunks would cost.
+"""
+import logging
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .. import config
+from .chunker import ChunkSpans
+from .embedding_store import CHARS_PER_TOKEN, EmbeddingStore
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text: str, tokenizer=None) -> int:
+    """Tokens in `text`: counted with `tokenizer` if given, otherwise estimated from length."""
+    if tokenizer is not None:
+        encoded = tokenizer(text, add_special_tokens=False, return_attention_mask=False, verbose=False)
+        return max(1, len(encoded["input_ids"]))
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def passage_tokenizer(store: EmbeddingStore):
+    """The tokenizer the store's chunks were cut with, if they were cut on tokens, else None."""
+    texts = store.texts
+    if isinstance(texts, ChunkSpans) and len(texts) and len(texts.token_counts) == len(texts):
+        return getattr(store.model, "tokenizer", None)
+    return None
+
+
+def _passages(store: EmbeddingStore, indices: Sequence[int], has_pages: bool) -> List[Tuple[str, Optional[int]]]:
+    """(text, first page) of the passages covering `indices`, in document order."""
+    texts = store.texts
+    if not isinstance(texts, ChunkSpans):
+        # No document offsets to merge on
+        return [(texts[idx], store.page(idx) if has_pages else None) for idx in sorted(indices)]
+
+    passages = []
+    start = end = page = None
+    for idx in sorted(indices, key=lambda i: texts.starts[i]):
+        chunk_start, chunk_end, chunk_page = texts.span(idx)
+        # Overlapping, or separated from the passage by whitespace only
+        if start is not None and (chunk_start <= end or not texts.text[end:chunk_start].strip()):
+            end = max(end, chunk_end)
+            continue
+        if start is not None:
+            passages.append((texts.passage(start, end).strip(), page if has_pages else None))
+        start, end, page = chunk_start, chunk_end, chunk_page
+    if start is not None:
+        passages.append((texts.passage(start, end).strip(), page if has_pages else None))
+    return passages
+
+
+def pack_context(
+    store: EmbeddingStore,
+    indices: Sequence[int],
+    has_pages: bool,
+    token_budget: int = config.CONTEXT_TOKEN_BUDGET,
+    duplicate_threshold: float = config.CONTEXT_DUPLICATE_THRESHOLD,
+) -> Tuple[List[str], List[Optional[int]], dict]:
+    """Pack the chunks `indices` (best first) into passages within `token_budget` estimated tokens.
+
+    Returns the passages and the page each starts on (None unless `has_pages`), in
+    document order, plus stats: candidates, chunks used, passages,
+    duplicates_dropped, tokens (packed) and unpacked_tokens (the candidates joined as-is).
+    The most relevant chunk is always kept, even if it alone exceeds the budget.
+    """
+    indices = list(dict.fromkeys(int(idx) for idx in indices))
+    stats = {
+        "candidates": len(indices),
+        "chunks": 0,
+        "passages": 0,
+        "duplicates_dropped": 0,
+        "tokens": 0,
+        "unpacked_tokens": 0,
+    }
+    if not indices:
+        return [], [], stats
+    stats["unpacked_tokens"] = int(store.token_counts()[indices].sum())
+    tokenizer = passage_tokenizer(store)
+    # Trial packings mostly repeat the passages of the previous one
+    counted: dict = {}
+
+    def count(text: str) -> int:
+        if text not in counted:
+            counted[text] = estimate_tokens(text, tokenizer)
+        return counted[text]
+
+    vectors = store.index.reconstruct_batch(np.array(indices, dtype=np.int64))
+    taken: List[int] = []
+    passages: List[Tuple[str, Optional[int]]] = []
+    for position, idx in enumerate(indices):
+        if taken and float(np.max(vectors[taken] @ vectors[position])) >= duplicate_threshold:
+            stats["duplicates_dropped"] += 1
+            continue
+        trial = _passages(store, [indices[p] for p in taken] + [idx], has_pages)
+        tokens = sum(count(text) for text, _ in trial)
+        if taken and tokens > token_budget:
+            # A smaller, less relevant chunk may still fit
+            continue
+        taken.append(position)
+        passages = trial
+        stats["tokens"] = tokens
+
+    stats["chunks"] = len(taken)
+    stats["passages"] = len(passages)
+    return [text for text, _ in passages], [page for _, page in passages], stats
+
+
+def document_passages(
+    store: EmbeddingStore, has_pages: bool, token_budget: int
+) -> Tuple[List[str], List[Optional[int]], dict]:
+    """The whole document as contiguous passages of about `token_budget` tokens, in order.
+
+    A passage takes each chunk's text past the end of the one before, so text shared
+    by overlapping chunks appears once. Returns the passages, the page each starts on
+    (None unless `has_pages`) and stats like `pack_context`'s.
+    """
+    texts = store.texts
+    counts = store.token_counts()
+    stats = {
+        "candidates": len(texts),
+        "chunks": len(texts),
+        "passages": 0,
+        "duplicates_dropped": 0,
+        "tokens": 0,
+        "unpacked_tokens": int(counts.sum()),
+    }
+    if not isinstance(texts, ChunkSpans):
+        # No document offsets to merge on
+        passages = [(texts[idx], store.page(idx) if has_pages else None) for idx in range(len(texts))]
+    else:
+        passages = []
+        start = end = None
+        used = 0.0
+        for idx in range(len(texts)):
+            chunk_start, chunk_end, _ = texts.span(idx)
+            if end is not None and chunk_end <= end:
+                continue
+            new_start = chunk_start if end is None else max(chunk_start, end)
+            # The chunk's tokens, pro rata for the part not in the passage yet
+            tokens = counts[idx] * (chunk_end - new_start) / max(1, chunk_end - chunk_start)
+            if start is not None and used + tokens > token_budget:
+                passages.append((texts.passage(start, end).strip(), texts.page_at(start) if has_pages else None))
+                start, used = None, 0.0
+            if start is None:
+                start = new_start
+            end = chunk_end
+            used += tokens
+        if start is not None:
+            passages.append((texts.passage(start, end).strip(), texts.page_at(start) if has_pages else None))
+
+    tokenizer = passage_tokenizer(store)
+    stats["passages"] = len(passages)
+    stats["tokens"] = sum(estimate_tokens(text, tokenizer) for text, _ in passages)
+    return [text for text, _ in passages], [page for _, page in passages], stats
+
+
+def merge_stats(stats: Sequence[dict]) -> dict:
+    """Sum the stats of several `pack_context` calls (e.g. one per report section)."""
+    total: dict = {}
+    for entry in stats:
+        for key, value in entry.items():
+            total[key] = total.get(key, 0) + value
+    return total
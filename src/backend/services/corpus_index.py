@@ -0,0 +1,549 @@
+"""
+Persistent multi-document vector index.
+
+Layout of the corpus directory:
+
+- `manifest.json` names the current base segment and delta files.
+- `base-<gen>.faiss` is an IndexIDMap2 (chunk id -> vector) of the type
+  vector_index.choose_index_spec picks for its size. It is memory-mapped
+  read-only, so restarts are instant and workers share its pages.
+  `base-<gen>.ids.npy` and `.vectors.npy` hold the exact vectors for rebuilds.
+- `delta-<gen>.bin` is an append-only file of (id, vector) records for documents
+  added since the base was built. Every worker reads it into memory and picks up
+  appends, so CORPUS_COMPACT_DELTA_ROWS bounds what each worker holds outside the
+  shared, memory-mapped base.
+- `chunks.sqlite3` holds documents, chunk texts and pages, and the ids of
+  deleted chunks.
+
+Adding a document appends to the delta under a shared flock on `delta.lock`;
+deleting one removes its metadata and tombstones its chunk ids. Compaction folds the deltas into a new base without
+the deleted vectors. It runs in the background once the delta or the dead
+vectors grow past their thresholds.
+"""
+import fcntl
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from .. import config
+from .vector_index import build_index, choose_index_spec, configure_search
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+# Appenders hold it shared while they write to the delta named in the manifest;
+# compaction takes it exclusively to wait for appends to the delta it is folding in
+DELTA_LOCK = "delta.lock"
+# A compaction lock older than this is assumed to belong to a crashed process
+STALE_LOCK_SECONDS = 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    doc_id TEXT PRIMARY KEY,
+    filename TEXT,
+    num_chunks INTEGER,
+    created_at REAL
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    doc_id TEXT NOT NULL,
+    ordinal INTEGER NOT NULL,
+    page INTEGER,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chunks_doc ON chunks (doc_id);
+CREATE TABLE IF NOT EXISTS deleted_chunks (id INTEGER PRIMARY KEY);
+"""
+
+
+class CorpusIndex:
+    """Chunk vectors and texts of every analyzed document, persisted under `directory`.
+
+    Vectors must be L2-normalized; scores are cosine similarities.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        dim: int,
+        compact_delta_rows: int = config.CORPUS_COMPACT_DELTA_ROWS,
+        compact_dead_percent: int = config.CORPUS_COMPACT_DEAD_PERCENT,
+    ):
+        self.directory = directory
+        self.dim = dim
+        self.compact_delta_rows = compact_delta_rows
+        self.compact_dead_percent = compact_dead_percent
+        self.record_dtype = np.dtype([("id", "<i8"), ("vec", "<f4", (dim,))])
+        self.db_path = os.path.join(directory, "chunks.sqlite3")
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._compaction: Optional[threading.Thread] = None
+        self._manifest: dict = {}
+        self._base_name = None
+        self._base_index = None
+        self._base_ids = np.zeros(0, dtype=np.int64)
+        self._base_vectors = np.zeros((0, dim), dtype=np.float32)
+        self._delta_rows: Dict[str, int] = {}
+        self._delta_ids: List[np.ndarray] = []
+        self._delta_vectors: List[np.ndarray] = []
+        self._delta_row_of: Dict[int, int] = {}
+
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+        if not os.path.exists(self._path(MANIFEST)):
+            self._write_manifest({"generation": 0, "dim": dim, "base": None, "deltas": ["delta-0.bin"]})
+        self._refresh()
+
+    # ---------------- FILES ----------------
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _write_manifest(self, manifest: dict) -> None:
+        tmp_path = self._path(f"{MANIFEST}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self._path(MANIFEST))
+
+    @contextmanager
+    def _delta_lock(self, operation: int):
+        """Hold `delta.lock` with `operation` (fcntl.LOCK_SH or LOCK_EX), across threads and processes."""
+        with open(self._path(DELTA_LOCK), "a") as f:
+            fcntl.flock(f, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _write_file(self, name: str, write) -> None:
+        tmp_path = self._path(f"{name}.tmp")
+        with open(tmp_path, "wb") as f:
+            write(f)
+        os.replace(tmp_path, self._path(name))
+
+    def _refresh(self) -> None:
+        """Pick up a new base segment and any records appended to the delta files."""
+        with self._lock:
+            while True:
+                with open(self._path(MANIFEST), "r", encoding="utf-8") as f:
+                    manifest = json.load(f)
+                if manifest.get("dim", self.dim) != self.dim:
+                    raise RuntimeError(f"Corpus index in {self.directory} holds {manifest['dim']}-dim vectors, not {self.dim}")
+                self._manifest = manifest
+
+                try:
+                    if manifest["base"] != self._base_name:
+                        self._load_base(manifest["base"])
+                    if any(name not in manifest["deltas"] for name in self._delta_rows):
+                        # A compaction folded some deltas into the base
+                        self._delta_rows, self._delta_ids, self._delta_vectors, self._delta_row_of = {}, [], [], {}
+                    for name in manifest["deltas"]:
+                        self._read_delta(name)
+                    return
+                except FileNotFoundError as e:
+                    # A compaction removed the files after we read the manifest; the manifest
+                    # it wrote first names their replacements
+                    if manifest["generation"] == self._read_generation():
+                        raise
+                    logger.debug("Corpus file %s was compacted away, reloading the manifest", e.filename)
+
+    def _read_generation(self) -> int:
+        with open(self._path(MANIFEST), "r", encoding="utf-8") as f:
+            return json.load(f)["generation"]
+
+    def _load_base(self, name: Optional[str]) -> None:
+        import faiss
+
+        if name is None:
+            self._base_name = None
+            self._base_index = None
+            self._base_ids = np.zeros(0, dtype=np.int64)
+            self._base_vectors = np.zeros((0, self.dim), dtype=np.float32)
+            return
+        path = self._path(f"{name}.faiss")
+        # The arrays first: np.load raises FileNotFoundError if a compaction removed the base
+        base_ids = np.load(self._path(f"{name}.ids.npy"), mmap_mode="r")
+        base_vectors = np.load(self._path(f"{name}.vectors.npy"), mmap_mode="r")
+        try:
+            # IO_FLAG_MMAP only maps IVF lists and reads Flat and HNSW storage into memory;
+            # IO_FLAG_MMAP_IFC (faiss >= 1.11) maps the vectors and codes of every index type
+            mmap_flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+            index = faiss.read_index(path, mmap_flag | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            if not os.path.exists(path):
+                raise FileNotFoundError(2, "No such file or directory", path)
+            # Not every index type supports mmap; fall back to reading it into memory
+            logger.debug("Index %s cannot be memory-mapped, reading it", path)
+            index = faiss.read_index(path)
+        configure_search(index)
+        self._base_name, self._base_index = name, index
+        self._base_ids, self._base_vectors = base_ids, base_vectors
+        logger.info("Loaded corpus base %s (%d vectors)", name, len(self._base_ids))
+
+    def _read_delta(self, name: str) -> None:
+        path = self._path(name)
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return
+        done = self._delta_rows.get(name, 0)
+        # Ignore a trailing partial record from a write in progress
+        rows = size // self.record_dtype.itemsize
+        if rows <= done:
+            return
+        records = np.fromfile(
+            path, dtype=self.record_dtype, count=rows - done, offset=done * self.record_dtype.itemsize
+        )
+        start = sum(len(ids) for ids in self._delta_ids)
+        self._delta_ids.append(records["id"].copy())
+        self._delta_vectors.append(records["vec"].copy())
+        for offset, chunk_id in enumerate(records["id"].tolist()):
+            self._delta_row_of[chunk_id] = start + offset
+        self._delta_rows[name] = rows
+
+    def _delta_arrays(self):
+        if not self._delta_ids:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, self.dim), dtype=np.float32)
+        if len(self._delta_ids) > 1:
+            self._delta_ids = [np.concatenate(self._delta_ids)]
+            self._delta_vectors = [np.concatenate(self._delta_vectors)]
+        return self._delta_ids[0], self._delta_vectors[0]
+
+    # ---------------- DOCUMENTS ----------------
+    def add_document(
+        self,
+        doc_id: str,
+        filename: str,
+        texts: Sequence[str],
+        pages: Sequence[Optional[int]],
+        vectors: np.ndarray,
+    ) -> bool:
+        """Index a document's chunks. Returns False if `doc_id` is already indexed."""
+        if len(texts) != len(vectors):
+            raise ValueError(f"Got {len(texts)} texts for {len(vectors)} vectors")
+        with self._connect() as conn:
+            # BEGIN IMMEDIATE serializes writers, so chunk ids and delta appends stay in step
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("SELECT 1 FROM documents WHERE doc_id = ?", (doc_id,)).fetchone():
+                conn.rollback()
+                return False
+            conn.execute(
+                "INSERT INTO documents (doc_id, filename, num_chunks, created_at) VALUES (?, ?, ?, ?)",
+                (doc_id, filename, len(texts), time.time()),
+            )
+            ids = [
+                conn.execute(
+                    "INSERT INTO chunks (doc_id, ordinal, page, text) VALUES (?, ?, ?, ?)",
+                    (doc_id, ordinal, page, text),
+                ).lastrowid
+                for ordinal, (text, page) in enumerate(zip(texts, pages))
+            ]
+            records = np.empty(len(ids), dtype=self.record_dtype)
+            records["id"] = ids
+            records["vec"] = vectors
+            with self._delta_lock(fcntl.LOCK_SH), self._lock:
+                self._refresh()
+                # One O_APPEND write per document keeps records from different workers whole
+                with open(self._path(self._manifest["deltas"][-1]), "ab") as f:
+                    f.write(records.tobytes())
+            conn.commit()
+        logger.info("Indexed %s (%s): %d chunks", doc_id, filename, len(ids))
+        self._maybe_compact()
+        return True
+
+    def delete_document(self, doc_id: str) -> bool:
+        """Remove a document. Its vectors are dropped at the next compaction."""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("INSERT OR IGNORE INTO deleted_chunks (id) SELECT id FROM chunks WHERE doc_id = ?", (doc_id,))
+            conn.execute("DELETE FROM chunks WHERE doc_id = ?", (doc_id,))
+            deleted = conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,)).rowcount
+            conn.commit()
+        if deleted:
+            logger.info("Deleted %s from the corpus index", doc_id)
+            self._maybe_compact()
+        return bool(deleted)
+
+    def documents(self) -> List[dict]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT doc_id, filename, num_chunks, created_at FROM documents ORDER BY created_at"
+            ).fetchall()
+        return [
+            {"doc_id": doc_id, "filename": filename, "num_chunks": num_chunks, "created_at": created_at}
+            for doc_id, filename, num_chunks, created_at in rows
+        ]
+
+    def has_document(self, doc_id: str) -> bool:
+        with self._connect() as conn:
+            return conn.execute("SELECT 1 FROM documents WHERE doc_id = ?", (doc_id,)).fetchone() is not None
+
+    def _chunks(self, ids: Iterable[int]) -> Dict[int, dict]:
+        ids = list(ids)
+        found: Dict[int, dict] = {}
+        with self._connect() as conn:
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT id, doc_id, ordinal, page, text FROM chunks WHERE id IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                for chunk_id, doc_id, ordinal, page, text in rows:
+                    found[chunk_id] = {"chunk_id": chunk_id, "doc_id": doc_id, "ordinal": ordinal, "page": page, "text": text}
+        return found
+
+    # ---------------- SEARCH ----------------
+    def search(self, query: np.ndarray, top_k: int = 5, doc_ids: Optional[Sequence[str]] = None) -> List[dict]:
+        """Return the `top_k` chunks closest to the normalized `query` vector, best first.
+
+        With `doc_ids`, only those documents' chunks are scored, exactly.
+        Each hit is a dict with chunk_id, doc_id, ordinal, page, text and score.
+        """
+        query = np.asarray(query, dtype=np.float32).reshape(1, self.dim)
+        with self._lock:
+            self._refresh()
+            if doc_ids is not None:
+                return self._search_documents(query, top_k, doc_ids)
+            return self._search_all(query, top_k)
+
+    def _search_all(self, query: np.ndarray, top_k: int) -> List[dict]:
+        delta_ids, delta_vectors = self._delta_arrays()
+        base_total = self._base_index.ntotal if self._base_index is not None else 0
+        total = base_total + len(delta_ids)
+        fetch = top_k
+        while True:
+            candidates: Dict[int, float] = {}
+            if base_total:
+                scores, ids = self._base_index.search(query, min(fetch, base_total))
+                candidates.update((int(i), float(s)) for s, i in zip(scores[0], ids[0]) if i >= 0)
+            if len(delta_ids):
+                scores = delta_vectors @ query[0]
+                best = np.argsort(-scores)[:fetch]
+                for row in best:
+                    chunk_id = int(delta_ids[row])
+                    candidates[chunk_id] = max(candidates.get(chunk_id, -np.inf), float(scores[row]))
+
+            ranked = sorted(candidates.items(), key=lambda item: -item[1])
+            # Deleted chunks have no metadata left, which filters them out
+            chunks = self._chunks(chunk_id for chunk_id, _ in ranked)
+            hits = [{**chunks[chunk_id], "score": score} for chunk_id, score in ranked if chunk_id in chunks]
+            if len(hits) >= top_k or fetch >= total:
+                return hits[:top_k]
+            fetch *= 4
+
+    def _search_documents(self, query: np.ndarray, top_k: int, doc_ids: Sequence[str]) -> List[dict]:
+        with self._connect() as conn:
+            ids = [
+                row[0]
+                for doc_id in doc_ids
+                for row in conn.execute("SELECT id FROM chunks WHERE doc_id = ?", (doc_id,))
+            ]
+        if not ids:
+            return []
+        vectors, present = self._lookup(ids)
+        scores = np.where(present, vectors @ query[0], -np.inf)
+        best = [i for i in np.argsort(-scores)[:top_k] if present[i]]
+        chunks = self._chunks(ids[i] for i in best)
+        return [{**chunks[ids[i]], "score": float(scores[i])} for i in best if ids[i] in chunks]
+
+    def _lookup(self, ids: Sequence[int]):
+        """Return the stored vectors for chunk `ids` and a mask of the ones found.
+
+        Rows of ids not found are zeros; callers must drop them using the mask.
+        """
+        ids_array = np.array(ids, dtype=np.int64)
+        vectors = np.zeros((len(ids), self.dim), dtype=np.float32)
+        present = np.zeros(len(ids), dtype=bool)
+        # Base ids are stored sorted, so rows are found by binary search
+        if len(self._base_ids) and len(ids):
+            rows = np.minimum(np.searchsorted(self._base_ids, ids_array), len(self._base_ids) - 1)
+            in_base = self._base_ids[rows] == ids_array
+            vectors[in_base] = self._base_vectors[rows[in_base]]
+            present |= in_base
+        _, delta_vectors = self._delta_arrays()
+        for i, chunk_id in enumerate(ids):
+            row = self._delta_row_of.get(chunk_id)
+            if row is not None and not present[i]:
+                vectors[i] = delta_vectors[row]
+                present[i] = True
+        return vectors, present
+
+    def document_vectors(self, doc_id: str):
+        """Return a document's chunk texts, pages and vectors in chunk order, skipping chunks without a vector."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, page, text FROM chunks WHERE doc_id = ? ORDER BY ordinal", (doc_id,)
+            ).fetchall()
+        with self._lock:
+            self._refresh()
+            vectors, present = self._lookup([chunk_id for chunk_id, _, _ in rows])
+        if not present.all():
+            logger.warning("%d of %d chunks of %s have no vector; leaving them out", (~present).sum(), len(rows), doc_id)
+            rows = [row for row, found in zip(rows, present) if found]
+            vectors = vectors[present]
+        return [text for _, _, text in rows], [page for _, page, _ in rows], vectors
+
+    # ---------------- COMPACTION ----------------
+    def stats(self) -> dict:
+        with self._lock:
+            self._refresh()
+            delta_ids, _ = self._delta_arrays()
+            base_vectors = len(self._base_ids)
+            with self._connect() as conn:
+                documents, chunks = conn.execute(
+                    "SELECT (SELECT COUNT(*) FROM documents), (SELECT COUNT(*) FROM chunks)"
+                ).fetchone()
+                dead = conn.execute("SELECT COUNT(*) FROM deleted_chunks").fetchone()[0]
+            return {
+                "documents": documents,
+                "chunks": chunks,
+                "base_vectors": base_vectors,
+                "delta_vectors": len(delta_ids),
+                "dead_vectors": dead,
+                "base_index": self._manifest.get("base_spec"),
+                "generation": self._manifest["generation"],
+                "compacting": self._compaction is not None and self._compaction.is_alive(),
+            }
+
+    def _maybe_compact(self) -> None:
+        stats = self.stats()
+        total = stats["base_vectors"] + stats["delta_vectors"]
+        if stats["compacting"] or not total:
+            return
+        if (
+            stats["delta_vectors"] >= self.compact_delta_rows
+            or stats["dead_vectors"] * 100 >= total * self.compact_dead_percent
+        ):
+            self.start_compaction()
+
+    def start_compaction(self) -> None:
+        """Run `compact` on a background thread unless one is already running."""
+        with self._lock:
+            if self._compaction is not None and self._compaction.is_alive():
+                return
+            self._compaction = threading.Thread(target=self._compact_logged, name="corpus-compaction", daemon=True)
+            self._compaction.start()
+
+    def _compact_logged(self) -> None:
+        try:
+            self.compact()
+        except Exception:
+            logger.exception("Corpus index compaction failed")
+
+    def compact(self) -> bool:
+        """Fold the delta files into a new base segment, dropping deleted vectors.
+
+        Only one process compacts at a time; returns False if another one holds the lock.
+        """
+        lock_path = self._path("compact.lock")
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if time.time() - os.path.getmtime(lock_path) < STALE_LOCK_SECONDS:
+                return False
+            os.remove(lock_path)
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+
+        try:
+            start = time.perf_counter()
+            with self._lock:
+                self._refresh()
+                old = dict(self._manifest)
+            generation = old["generation"] + 1
+            new_delta = f"delta-{generation}.bin"
+            # 1. Send new appends to a fresh delta file, then wait for appends that
+            # read the old manifest to finish
+            self._write_manifest({**old, "generation": generation, "deltas": old["deltas"] + [new_delta]})
+            with self._delta_lock(fcntl.LOCK_EX):
+                pass
+
+            # 2. Gather base + old delta vectors, minus deleted ones
+            with self._lock:
+                self._refresh()
+                ids = [np.asarray(self._base_ids)]
+                vectors = [np.asarray(self._base_vectors)]
+                for name in old["deltas"]:
+                    path = self._path(name)
+                    if os.path.exists(path):
+                        records = np.fromfile(path, dtype=self.record_dtype)
+                        ids.append(records["id"])
+                        vectors.append(records["vec"])
+            ids = np.concatenate(ids)
+            vectors = np.concatenate(vectors)
+            with self._connect() as conn:
+                dead = np.array([row[0] for row in conn.execute("SELECT id FROM deleted_chunks")], dtype=np.int64)
+            keep = ~np.isin(ids, dead)
+            dropped = np.unique(ids[~keep])
+            order = np.argsort(ids[keep], kind="stable")
+            ids, vectors = ids[keep][order], np.ascontiguousarray(vectors[keep][order])
+
+            # 3. Build and write the new base, then switch the manifest over to it
+            import faiss
+
+            base_name = f"base-{generation}"
+            spec = choose_index_spec(len(ids), self.dim)
+            index = build_index(spec, self.dim)
+            if not index.is_trained and len(ids):
+                index.train(vectors)
+            index = faiss.IndexIDMap2(index)
+            if len(ids):
+                index.add_with_ids(vectors, ids)
+            self._write_file(f"{base_name}.faiss", lambda f: f.write(faiss.serialize_index(index).tobytes()))
+            self._write_file(f"{base_name}.ids.npy", lambda f: np.save(f, ids))
+            self._write_file(f"{base_name}.vectors.npy", lambda f: np.save(f, vectors))
+            with self._lock:
+                self._write_manifest(
+                    {"generation": generation, "dim": self.dim, "base": base_name, "base_spec": spec, "deltas": [new_delta]}
+                )
+                self._refresh()
+
+            with self._connect() as conn:
+                conn.executemany("DELETE FROM deleted_chunks WHERE id = ?", [(int(i),) for i in dropped])
+                conn.commit()
+            # Readers that still map the old files keep them alive until they refresh
+            for name in ([f"{old['base']}{s}" for s in (".faiss", ".ids.npy", ".vectors.npy")] if old["base"] else []) + old["deltas"]:
+                try:
+                    os.remove(self._path(name))
+                except OSError:
+                    pass
+            logger.info(
+                "Compacted corpus index to %s: %d vectors (%s), dropped %d, in %.2fs",
+                base_name, len(ids), spec, len(dropped), time.perf_counter() - start,
+            )
+            return True
+        finally:
+            os.close(fd)
+            os.remove(lock_path)
+
+
+
+_corpus: Optional[CorpusIndex] = None
+_corpus_lock = threading.Lock()
+
+
+def get_corpus_index() -> Optional[CorpusIndex]:
+    """The process-wide corpus index, or None when CORPUS_INDEX_ENABLED=0."""
+    global _corpus
+    if not config.CORPUS_INDEX_ENABLED:
+        return None
+    if _corpus is None:
+        with _corpus_lock:
+            if _corpus is None:
+                from .embedding_store import get_embedding_model
+
+                dim = get_embedding_model().get_sentence_embedding_dimension()
+                _corpus = CorpusIndex(config.CORPUS_DIR, dim)
+    return _corpus
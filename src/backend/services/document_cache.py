@@ -0,0 +1,87 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from .corpus_index import get_corpus_index
+from .embedding_store import EmbeddingStore
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentCache:
+    """LRU of recently analyzed documents' EmbeddingStores, for follow-up questions.
+
+    Stores are kept in memory up to `max_bytes` (see EmbeddingStore.nbytes). With
+    the corpus index enabled an evicted document is not lost: its exact vectors and
+    chunk texts are on disk there, and `get` rebuilds the store on the next question.
+    With CORPUS_INDEX_ENABLED=0 nothing is kept on disk, so an evicted (or, after a
+    restart, any) document is gone and has to be analyzed again.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # doc_id -> (store, size in bytes)
+        self._entries: "OrderedDict[str, tuple[EmbeddingStore, int]]" = OrderedDict()
+        self._total_bytes = 0
+        self.hits = 0
+        self.disk_loads = 0
+
+    def put(self, doc_id: str, store: EmbeddingStore) -> None:
+        size = store.nbytes()
+        with self._lock:
+            self._discard(doc_id)
+            if size > self.max_bytes:
+                return
+            self._entries[doc_id] = (store, size)
+            self._total_bytes += size
+            while self._total_bytes > self.max_bytes:
+                evicted, (_, evicted_size) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_size
+                logger.debug("Evicted %s from the document cache", evicted)
+
+    def get(self, doc_id: str) -> Optional[EmbeddingStore]:
+        """The store for `doc_id` from memory, else rebuilt from the corpus index; None if unknown."""
+        with self._lock:
+            entry = self._entries.get(doc_id)
+            if entry is not None:
+                self._entries.move_to_end(doc_id)
+                self.hits += 1
+                return entry[0]
+
+        corpus = get_corpus_index()
+        if corpus is None:
+            return None
+        start = time.perf_counter()
+        texts, pages, vectors = corpus.document_vectors(doc_id)
+        if not texts:
+            return None
+        store = EmbeddingStore.from_vectors(texts, pages, vectors)
+        logger.info(
+            "Loaded %s from the corpus index (%d chunks) in %.3fs", doc_id, len(texts), time.perf_counter() - start
+        )
+        with self._lock:
+            self.disk_loads += 1
+        self.put(doc_id, store)
+        return store
+
+    def discard(self, doc_id: str) -> None:
+        with self._lock:
+            self._discard(doc_id)
+
+    def _discard(self, doc_id: str) -> None:
+        entry = self._entries.pop(doc_id, None)
+        if entry is not None:
+            self._total_bytes -= entry[1]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "documents": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "disk_loads": self.disk_loads,
+            }
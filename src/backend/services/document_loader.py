@@ -1,53 +1,231 @@
+import codecs
+import multiprocessing
 import os
-try:
-    # Prefer pypdf (actively maintained). Fall back to PyPDF2 if pypdf is not installed.
-    from pypdf import PdfReader  # type: ignore
-except Exception:
-    from PyPDF2 import PdfReader  # type: ignore
-
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import BinaryIO, Callable, Iterator, List, Optional, Tuple, Union
 
 import logging
 
+from .. import config
+from .pdf_backends import Payload, get_backend
+
+# A document can be given as a path on disk or as an open binary stream
+# (e.g. the spooled temp file behind an upload), which avoids a round trip through disk.
+Source = Union[str, BinaryIO]
+
+
+def _describe(source: Source) -> str:
+    return source if isinstance(source, str) else str(getattr(source, "name", "<stream>"))
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # The server already runs threads (event loop, CPU pool, batchers), and forking
+            # a threaded process can copy locks held by another thread into the child
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            _pool = ProcessPoolExecutor(max_workers=config.PDF_WORKERS, mp_context=context)
+        return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor) -> None:
+    """Drop a broken pool so the next _get_pool() starts a fresh one."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _extract_page_range(backend_name: str, payload: Payload, start: int, end: int) -> List[str]:
+    """Worker: re-open the document with the given backend and extract pages [start, end)."""
+    return get_backend(backend_name).extract(payload, start, end)
+
+
+def iter_pdf_pages(
+    source: Source, backend: Optional[str] = None, on_page_count: Optional[Callable[[int], None]] = None
+) -> Iterator[Tuple[int, str]]:
+    """
+    Yield (page number, text) pairs from a PDF file path or binary stream, in page order.
+
+    Page numbers start at 1. Large documents are split into contiguous page ranges
+    that are extracted in parallel by a process pool; each range is yielded as soon
+    as it and all ranges before it are done, so consumers can start early.
+
+    Args:
+        source: Path to the PDF, or an open binary stream.
+        backend: Name of the extraction backend (see pdf_backends). Defaults to config.PDF_BACKEND.
+        on_page_count: Called with the total number of pages before extraction starts.
+    """
+    logger = logging.getLogger(__name__)
+    if isinstance(source, str) and not os.path.exists(source):
+        raise FileNotFoundError(f"File not found: {source}")
+
+    pdf_backend = get_backend(backend or config.PDF_BACKEND)
+    # Backends (and pool workers) re-open the document themselves: paths are
+    # passed as-is, streams are read into bytes once (and spilled to disk for the pool)
+    if isinstance(source, str):
+        payload = source
+    else:
+        source.seek(0)
+        payload = source.read()
+
+    num_pages = pdf_backend.page_count(payload)
+    if on_page_count is not None:
+        on_page_count(num_pages)
+    workers = min(config.PDF_WORKERS, num_pages)
+    if workers <= 1 or num_pages < config.PDF_PARALLEL_MIN_PAGES:
+        yield from enumerate(pdf_backend.iter_pages(payload, 0, num_pages), start=1)
+        return
+
+    # Every range task would get its own pickled copy of in-memory bytes, so they are
+    # written to a temp file once and the workers open that instead
+    spilled = None
+    if isinstance(payload, bytes):
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+            f.write(payload)
+        payload = spilled = f.name
+
+    # Smaller ranges than one per worker let the first pages reach the consumer sooner
+    step = max(1, -(-num_pages // (workers * 4)))
+    ranges = [(start, min(start + step, num_pages)) for start in range(0, num_pages, step)]
+    futures = []
+    pool = None
+    retried = False
+    k = 0
+    try:
+        while k < len(ranges):
+            try:
+                if pool is None:
+                    pool = _get_pool()
+                    futures[k:] = [
+                        pool.submit(_extract_page_range, pdf_backend.name, payload, start, end)
+                        for start, end in ranges[k:]
+                    ]
+                pages = futures[k].result()
+            except BrokenProcessPool as e:
+                # A worker died (out of memory, or a crash inside the backend); the pool
+                # is unusable from then on, for this request and every later one
+                _discard_pool(pool)
+                if retried:
+                    raise RuntimeError(f"PDF extraction worker died on {_describe(source)}") from e
+                logger.warning(
+                    "PDF worker pool broke, retrying pages %d-%d on a new pool", ranges[k][0] + 1, num_pages
+                )
+                retried = True
+                pool = None
+                continue
+            yield from enumerate(pages, start=ranges[k][0] + 1)
+            k += 1
+    finally:
+        for future in futures:
+            future.cancel()
+        if spilled is not None:
+            # Ranges already running still read the file
+            wait(futures)
+            os.remove(spilled)
+    logger.debug("Extracted %d PDF pages in %d ranges", num_pages, len(ranges))
 
-def load_pdf(file_path: str) -> str:
+
+def load_pdf_pages(source: Source, backend: Optional[str] = None) -> List[Tuple[int, str]]:
     """
-    Load text from a PDF file.
+    Load text from a PDF file path or binary stream as (page number, text) pairs.
+    """
+    return list(iter_pdf_pages(source, backend=backend))
+
+
+def load_pdf(source: Source, backend: Optional[str] = None) -> str:
+    """
+    Load text from a PDF file path or binary stream.
     """
     logger = logging.getLogger(__name__)
-    if not os.path.exists(file_path):
-        raise FileNotFoundError(f"File not found: {file_path}")
-    
-    text = ""
-    with open(file_path, "rb") as f:
-        reader = PdfReader(f)
-        for page in reader.pages:
-            # extract_text() is available in both pypdf and PyPDF2
-            extracted = page.extract_text() or ""
-            text += extracted
-    logger.debug("Loaded PDF %s (length=%d)", file_path, len(text))
+    # Separate pages so the last word of one page doesn't fuse with the first of the next
+    text = "\n".join(text for _, text in load_pdf_pages(source, backend=backend))
+    logger.debug("Loaded PDF %s (length=%d)", _describe(source), len(text))
     return text
 
 
-def load_txt(file_path: str) -> str:
+def load_txt(source: Source) -> str:
     """
-    Load text from a TXT file safely (ignore bad bytes).
+    Load text from a TXT file path or binary stream safely (ignore bad bytes).
     """
     logger = logging.getLogger(__name__)
-    if not os.path.exists(file_path):
-        raise FileNotFoundError(f"File not found: {file_path}")
-    
-    with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-        data = f.read()
-    logger.debug("Loaded TXT %s (length=%d)", file_path, len(data))
+    if isinstance(source, str):
+        if not os.path.exists(source):
+            raise FileNotFoundError(f"File not found: {source}")
+        with open(source, "r", encoding="utf-8", errors="ignore") as f:
+            data = f.read()
+    else:
+        data = source.read().decode("utf-8", errors="ignore")
+    logger.debug("Loaded TXT %s (length=%d)", _describe(source), len(data))
     return data
 
-def load_document(file_path: str) -> str:
+def iter_txt(source: Source, block_size: int = 1024 * 1024) -> Iterator[str]:
+    """
+    Yield the decoded text of a TXT file path or binary stream in blocks (ignore bad bytes).
+    """
+    if isinstance(source, str):
+        if not os.path.exists(source):
+            raise FileNotFoundError(f"File not found: {source}")
+        with open(source, "r", encoding="utf-8", errors="ignore") as f:
+            while True:
+                block = f.read(block_size)
+                if not block:
+                    return
+                yield block
+    else:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        while True:
+            block = source.read(block_size)
+            text = decoder.decode(block, final=not block)
+            if text:
+                yield text
+            if not block:
+                return
+
+
+def iter_document_pages(
+    source: Source,
+    filename: Optional[str] = None,
+    pdf_backend: Optional[str] = None,
+    on_page_count: Optional[Callable[[int], None]] = None,
+) -> Iterator[Tuple[int, str]]:
+    """
+    Detect file type and yield content incrementally as (page number, text) pairs.
+
+    PDFs yield one item per page. TXT files have no pages: they are yielded in
+    blocks, all numbered page 1.
+    """
+    name = (filename or _describe(source)).lower()
+    if name.endswith(".pdf"):
+        return iter_pdf_pages(source, backend=pdf_backend, on_page_count=on_page_count)
+    elif name.endswith(".txt"):
+        return ((1, block) for block in iter_txt(source))
+    else:
+        raise ValueError("Unsupported file type. Only PDF and TXT are supported.")
+
+def load_document(source: Source, filename: Optional[str] = None, pdf_backend: Optional[str] = None) -> str:
     """
     Detect file type and load content.
+
+    Args:
+        source: Path to the document, or an open binary stream positioned at its start.
+        filename: Name used to detect the file type. Defaults to the path itself.
+        pdf_backend: PDF extraction backend to use instead of the configured default.
     """
-    if file_path.lower().endswith(".pdf"):
-        return load_pdf(file_path)
-    elif file_path.lower().endswith(".txt"):
-        return load_txt(file_path)
+    name = (filename or _describe(source)).lower()
+    if name.endswith(".pdf"):
+        return load_pdf(source, backend=pdf_backend)
+    elif name.endswith(".txt"):
+        return load_txt(source)
     else:
         raise ValueError("Unsupported file type. Only PDF and TXT are supported.")
@@ -0,0 +1,116 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingBatcher:
+    """Shared encoder that merges concurrent `encode` calls into larger model batches.
+
+    Callers on any thread submit texts and block on a future. A single worker thread
+    takes the oldest request, then keeps collecting requests until `max_batch_size`
+    texts are waiting or `max_wait_ms` has passed since that request arrived, encodes
+    everything in one model call and hands each caller its slice of the vectors.
+    One well-filled batch at a time also stops concurrent requests from fighting
+    over the same CPU threads.
+    """
+
+    def __init__(self, model, max_batch_size: int, max_wait_ms: float, history: int = 1024):
+        self.model = model
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._requests: "queue.Queue[Tuple[List[str], Future, float]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+
+        # Metrics
+        self._queued_texts = 0
+        self._max_queued_texts = 0
+        self._batches = 0
+        self._texts = 0
+        self._fill = 0.0
+        self._waits = deque(maxlen=history)
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Encode `texts` to a (len(texts), dim) float32 array, batched with other callers."""
+        if not texts:
+            return np.zeros((0, self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+        future: Future = Future()
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._worker.start()
+            self._queued_texts += len(texts)
+            self._max_queued_texts = max(self._max_queued_texts, self._queued_texts)
+        self._requests.put((list(texts), future, time.monotonic()))
+        return future.result()
+
+    def _run(self) -> None:
+        while True:
+            first = self._requests.get()
+            batch = [first]
+            size = len(first[0])
+            deadline = first[2] + self.max_wait
+            while size < self.max_batch_size:
+                # Past the deadline, still take whatever piled up during the last batch
+                timeout = deadline - time.monotonic()
+                try:
+                    if timeout > 0:
+                        request = self._requests.get(timeout=timeout)
+                    else:
+                        request = self._requests.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(request)
+                size += len(request[0])
+            self._encode_batch(batch, size)
+
+    def _encode_batch(self, batch: List[Tuple[List[str], Future, float]], size: int) -> None:
+        started = time.monotonic()
+        with self._lock:
+            self._queued_texts -= size
+            self._batches += 1
+            self._texts += size
+            self._fill += min(size, self.max_batch_size) / self.max_batch_size
+            self._waits.extend(started - submitted for _, _, submitted in batch)
+
+        texts = [text for request_texts, _, _ in batch for text in request_texts]
+        try:
+            vectors = self.model.encode(
+                texts,
+                batch_size=self.max_batch_size,
+                convert_to_numpy=True,
+                show_progress_bar=False
+            ).astype("float32")
+        except BaseException as e:
+            logger.exception("Batched encoding of %d texts failed", size)
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        offset = 0
+        for request_texts, future, _ in batch:
+            future.set_result(vectors[offset:offset + len(request_texts)])
+            offset += len(request_texts)
+        logger.debug("Encoded %d texts from %d requests in one batch", size, len(batch))
+
+    def stats(self) -> dict:
+        with self._lock:
+            waits_ms = np.array(self._waits, dtype=np.float64) * 1000
+            return {
+                "queue_depth": self._queued_texts,
+                "max_queue_depth": self._max_queued_texts,
+                "batches": self._batches,
+                "texts": self._texts,
+                "mean_batch_size": self._texts / self._batches if self._batches else 0.0,
+                "mean_batch_fill": self._fill / self._batches if self._batches else 0.0,
+                "wait_ms_p50": float(np.percentile(waits_ms, 50)) if len(waits_ms) else 0.0,
+                "wait_ms_p99": float(np.percentile(waits_ms, 99)) if len(waits_ms) else 0.0,
+            }
@@ -0,0 +1,173 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+KEY_SIZE = 16
+
+
+def text_key(text: str) -> bytes:
+    """Compact 16-byte digest used as the cache key for a chunk."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=KEY_SIZE).digest()
+
+
+class EmbeddingCache:
+    """Persistent chunk-embedding cache for one embedding model.
+
+    Vectors live in an append-only file of fixed-size records (16-byte text digest
+    followed by `dim` float32 values) that is memory-mapped for reads. The
+    digest -> row index is rebuilt from the key column on load, so there is no
+    second file to keep in sync. Records appended by other worker processes are
+    picked up on the next miss.
+
+    When the file grows past `max_rows`, it is compacted down to the most recently
+    used three quarters of the rows.
+    """
+
+    def __init__(self, directory: str, model_name: str, dim: int, max_rows: int):
+        self.dim = dim
+        self.max_rows = max_rows
+        self.record_dtype = np.dtype([("key", f"V{KEY_SIZE}"), ("vec", "<f4", (dim,))])
+        safe_model = re.sub(r"[^A-Za-z0-9._-]", "_", model_name)
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{safe_model}-{dim}.bin")
+
+        self._lock = threading.Lock()
+        self._rows: Dict[bytes, int] = {}
+        self._last_used = np.zeros(0, dtype=np.int64)
+        self._clock = 0
+        self._records = None
+        self._num_rows = 0
+        self._inode = None
+        self.hits = 0
+        self.misses = 0
+        self._reload()
+
+    # ---------------- FILE HANDLING ----------------
+    def _reload(self) -> None:
+        """(Re)map the record file and rebuild the index from scratch."""
+        self._rows = {}
+        self._records = None
+        self._num_rows = 0
+        self._inode = None
+        self._last_used = np.zeros(0, dtype=np.int64)
+        self._refresh()
+
+    def _refresh(self) -> None:
+        """Map records appended since the last look, reloading if the file was compacted."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            if self._num_rows:
+                self._reload()
+            return
+        if self._inode is not None and stat.st_ino != self._inode:
+            self._inode = None
+            self._reload()
+            return
+        self._inode = stat.st_ino
+
+        # Ignore a trailing partial record left by an interrupted write
+        num_rows = stat.st_size // self.record_dtype.itemsize
+        if num_rows == self._num_rows:
+            return
+        self._records = np.memmap(self.path, dtype=self.record_dtype, mode="r", shape=(num_rows,))
+        keys = self._records["key"][self._num_rows:num_rows].tobytes()
+        for offset, row in enumerate(range(self._num_rows, num_rows)):
+            self._rows[keys[offset * KEY_SIZE:(offset + 1) * KEY_SIZE]] = row
+        if self._num_rows == 0:
+            # Rows loaded at startup keep their insertion order as their recency
+            fresh = np.arange(num_rows, dtype=np.int64) - num_rows
+        else:
+            fresh = np.full(num_rows - self._num_rows, self._clock, dtype=np.int64)
+        self._last_used = np.concatenate([self._last_used, fresh])
+        self._num_rows = num_rows
+
+    def _append(self, keys: List[bytes], vectors: np.ndarray) -> None:
+        records = np.empty(len(keys), dtype=self.record_dtype)
+        records["key"] = np.frombuffer(b"".join(keys), dtype=f"V{KEY_SIZE}")
+        records["vec"] = vectors
+        # One O_APPEND write per batch keeps records from different workers whole
+        with open(self.path, "ab") as f:
+            f.write(records.tobytes())
+
+    def _compact(self) -> None:
+        keep = max(self.max_rows * 3 // 4, 1)
+        order = np.argsort(self._last_used[:self._num_rows], kind="stable")[-keep:]
+        order.sort()
+        kept = np.array(self._records[order])
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        kept.tofile(tmp_path)
+        os.replace(tmp_path, self.path)
+        logger.info("Compacted embedding cache %s from %d to %d rows", self.path, self._num_rows, len(kept))
+        last_used = self._last_used[order]
+        self._reload()
+        self._last_used[:len(last_used)] = last_used
+
+    # ---------------- PUBLIC API ----------------
+    def get_many(self, texts: List[str]) -> Tuple[np.ndarray, List[int]]:
+        """Look up `texts` in the cache.
+
+        Returns:
+            A (len(texts), dim) float32 array filled for cache hits, and the
+            positions of the texts that still need to be encoded.
+        """
+        keys = [text_key(t) for t in texts]
+        out = np.empty((len(texts), self.dim), dtype=np.float32)
+        missing: List[int] = []
+        with self._lock:
+            if any(k not in self._rows for k in keys):
+                self._refresh()
+            self._clock += 1
+            for i, key in enumerate(keys):
+                row = self._rows.get(key)
+                if row is None:
+                    missing.append(i)
+                    continue
+                out[i] = self._records[row]["vec"]
+                self._last_used[row] = self._clock
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        return out, missing
+
+    def put_many(self, texts: List[str], vectors: np.ndarray) -> None:
+        """Add freshly encoded `vectors` for `texts`, skipping ones already cached."""
+        with self._lock:
+            new_keys, new_rows, seen = [], [], set()
+            for i, text in enumerate(texts):
+                key = text_key(text)
+                if key in self._rows or key in seen:
+                    continue
+                seen.add(key)
+                new_keys.append(key)
+                new_rows.append(i)
+            if not new_keys:
+                return
+            try:
+                self._append(new_keys, np.asarray(vectors, dtype=np.float32)[new_rows])
+                self._refresh()
+                self._clock += 1
+                for key in new_keys:
+                    row = self._rows.get(key)
+                    if row is not None:
+                        self._last_used[row] = self._clock
+                if self._num_rows > self.max_rows:
+                    self._compact()
+            except OSError:
+                logger.exception("Failed to write embedding cache %s", self.path)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "rows": self._num_rows,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -1,67 +1,396 @@
-import faiss
 import numpy as np
-from typing import List, Tuple
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
 import logging
-from sentence_transformers import SentenceTransformer
+import math
+import os
+import threading
+import time
+
+from .. import config
+from .chunker import ChunkSpans
+from .embedding_batcher import EmbeddingBatcher
+from .embedding_cache import EmbeddingCache
+from .vector_index import build_index, choose_index_spec, kmeans_representatives, mmr, normalize
 
 logger = logging.getLogger(__name__)
 
-# Load ONCE (prevents HuggingFace retries)
-try:
-    EMBEDDING_MODEL = SentenceTransformer(
-        "all-MiniLM-L6-v2",
+
+def load_embedding_model(backend: str = config.EMBEDDING_BACKEND):
+    """Load the embedding model for `backend` ("torch" or "onnx"); both expose `encode`."""
+    if backend == "onnx":
+        from .onnx_embedding import OnnxSentenceEncoder
+
+        return OnnxSentenceEncoder(
+            config.EMBEDDING_ONNX_DIR,
+            quantized=bool(config.EMBEDDING_ONNX_QUANTIZED),
+            threads=config.EMBEDDING_ONNX_THREADS,
+        )
+    if backend != "torch":
+        raise ValueError(f"Unknown embedding backend {backend!r}. Choose from: torch, onnx")
+
+    from sentence_transformers import SentenceTransformer
+
+    # Prefer the local safetensors copy: its weights are memory-mapped rather than
+    # unpickled, and no Hugging Face cache lookup is needed
+    source = config.EMBEDDING_MODEL_NAME
+    if os.path.isfile(os.path.join(config.EMBEDDING_MODEL_DIR, "modules.json")):
+        source = config.EMBEDDING_MODEL_DIR
+    return SentenceTransformer(
+        source,
         device="cpu",
         local_files_only=True
     )
-except Exception as e:
-    logger.exception("Failed to load embedding model")
-    raise RuntimeError("Embedding model could not be loaded") from e
+
+
+def _cache_model_name() -> str:
+    # ONNX (and especially int8) vectors differ slightly from PyTorch ones, so they are cached separately
+    if config.EMBEDDING_BACKEND == "onnx":
+        suffix = "-onnx-int8" if config.EMBEDDING_ONNX_QUANTIZED else "-onnx"
+        return config.EMBEDDING_MODEL_NAME + suffix
+    return config.EMBEDDING_MODEL_NAME
+
+
+# Loaded once, on first use or by warm_up() at startup (prevents HuggingFace retries
+# and keeps the model out of processes that never embed)
+EMBEDDING_MODEL = None
+EMBEDDING_BATCHER: Optional[EmbeddingBatcher] = None
+EMBEDDING_CACHE: Optional[EmbeddingCache] = None
+
+_load_lock = threading.Lock()
+# Embeddings of recent queries. The fixed retrieval queries stay here for the life of the process
+_query_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_query_cache_lock = threading.Lock()
+QUERY_CACHE_SIZE = 1024
+# Token estimate for chunks whose exact token count is unknown
+CHARS_PER_TOKEN = 4
+_status = "not_loaded"
+_load_error: Optional[str] = None
+
+
+def _load() -> None:
+    global EMBEDDING_MODEL, EMBEDDING_BATCHER, EMBEDDING_CACHE, _status, _load_error
+    if EMBEDDING_BATCHER is not None:
+        return
+    with _load_lock:
+        if EMBEDDING_BATCHER is not None:
+            return
+        _status = "loading"
+        start = time.perf_counter()
+        try:
+            model = load_embedding_model()
+        except Exception as e:
+            _status, _load_error = "failed", f"{type(e).__name__}: {e}"
+            logger.exception("Failed to load embedding model")
+            raise RuntimeError("Embedding model could not be loaded") from e
+
+        cache = None
+        if config.EMBEDDING_CACHE_MAX_ROWS > 0:
+            try:
+                cache = EmbeddingCache(
+                    config.EMBEDDING_CACHE_DIR,
+                    model_name=_cache_model_name(),
+                    dim=model.get_sentence_embedding_dimension(),
+                    max_rows=config.EMBEDDING_CACHE_MAX_ROWS,
+                )
+            except Exception:
+                # The cache is an optimization; run without it rather than refuse to start
+                logger.exception("Failed to open embedding cache, continuing without it")
+
+        EMBEDDING_MODEL = model
+        EMBEDDING_CACHE = cache
+        # All stores encode through one batcher so concurrent requests share model batches
+        EMBEDDING_BATCHER = EmbeddingBatcher(
+            model,
+            max_batch_size=config.EMBED_MAX_BATCH_SIZE,
+            max_wait_ms=config.EMBED_MAX_WAIT_MS,
+        )
+        _status, _load_error = "loaded", None
+        logger.info("Loaded embedding model %s in %.2fs", config.EMBEDDING_MODEL_NAME, time.perf_counter() - start)
+
+
+def get_embedding_model():
+    _load()
+    return EMBEDDING_MODEL
+
+
+def get_embedding_batcher() -> EmbeddingBatcher:
+    _load()
+    return EMBEDDING_BATCHER
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    _load()
+    return EMBEDDING_CACHE
+
+
+def warm_up(num_texts: int = config.EMBEDDING_WARMUP_TEXTS) -> None:
+    """Load the model and run one throwaway encode so the first request doesn't pay for it.
+
+    The warm-up batch goes straight to the model, bypassing the batcher and the cache.
+    """
+    global _status
+    model = get_embedding_model()
+    if num_texts > 0:
+        start = time.perf_counter()
+        model.encode(["Warm-up sentence for the embedding model. " * 24] * num_texts, show_progress_bar=False)
+        logger.info("Warmed up embedding model with %d texts in %.2fs", num_texts, time.perf_counter() - start)
+    _status = "ready"
+
+
+def embedding_status() -> dict:
+    """Model state for the readiness probe: not_loaded, loading, loaded, ready or failed."""
+    status = {"status": _status}
+    if _load_error:
+        status["error"] = _load_error
+    return status
 
 
 class EmbeddingStore:
-    """Simple embedding store using SentenceTransformers + FAISS."""
+    """Simple embedding store using SentenceTransformers + FAISS.
+
+    Vectors are normalized and searched by inner product, so search scores are
+    cosine similarities. Chunks go into an exact flat index while a document is
+    ingested; `finalize` then rebuilds it as the index type chosen for its size.
+    """
 
     def __init__(self):
         self.logger = logger
-        self.model = EMBEDDING_MODEL
+        self.model = get_embedding_model()
+        self.encoder = get_embedding_batcher()
+        self.cache = get_embedding_cache()
         self.dim = self.model.get_sentence_embedding_dimension()
 
-        self.index = faiss.IndexFlatL2(self.dim)
-        self.texts: List[str] = []
+        self.index_spec = "Flat"
+        self.index = build_index(self.index_spec, self.dim)
+        # Either a list of chunk strings or ChunkSpans over the document text
+        self.texts: Sequence[str] = []
+        # Page of each chunk when texts is a plain list (ChunkSpans carry their own)
+        self.pages: Optional[List[Optional[int]]] = None
 
-    def add_texts(self, texts: List[str]) -> None:
+    @classmethod
+    def from_vectors(
+        cls, texts: List[str], pages: List[Optional[int]], vectors: np.ndarray
+    ) -> "EmbeddingStore":
+        """A finalized store over chunks that are already embedded (e.g. read back from the corpus index)."""
+        store = cls()
+        store.index_spec = choose_index_spec(len(vectors), store.dim)
+        store.index = build_index(store.index_spec, store.dim, normalize(vectors))
+        store.texts = texts
+        store.pages = pages
+        return store
+
+    def add_texts(self, texts: List[str], store_texts: bool = True) -> None:
+        """Embed and index `texts`.
+
+        Pass store_texts=False when the texts will be provided later as ChunkSpans
+        (see attach_spans), so the materialized strings are not kept alive.
+        """
         if not texts:
             return
 
         try:
-            embs = self.model.encode(
-                texts,
-                convert_to_numpy=True,
-                show_progress_bar=False
-            ).astype("float32")
+            embs = normalize(self._encode(texts))
 
             self.index.add(embs)
-            self.texts.extend(texts)
+            if store_texts:
+                self.texts.extend(texts)
 
         except Exception:
             self.logger.exception("Error creating embeddings")
             raise RuntimeError("Failed to create embeddings")
 
-    def search(self, query: str, top_k: int = 5) -> List[Tuple[str, float]]:
+    def finalize(self) -> None:
+        """Rebuild the index as the type chosen for its final size (see vector_index.choose_index_spec)."""
+        num_vectors = self.index.ntotal
+        spec = choose_index_spec(num_vectors, self.dim)
+        if spec == self.index_spec:
+            return
+        start = time.perf_counter()
+        vectors = self.index.reconstruct_n(0, num_vectors)
+        self.index = build_index(spec, self.dim, vectors)
+        self.index_spec = spec
+        self.logger.info(
+            "Built %s index over %d vectors in %.2fs", spec, num_vectors, time.perf_counter() - start
+        )
+
+    def vectors(self) -> np.ndarray:
+        """The indexed vectors in chunk order. Exact until `finalize` switches to a compressed index."""
+        return self.index.reconstruct_n(0, self.index.ntotal)
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """Encode texts, sending only embedding-cache misses to the model."""
+        if self.cache is None:
+            return self.encoder.encode(texts)
+
+        embs, missing = self.cache.get_many(texts)
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            fresh = self.encoder.encode(missing_texts)
+            embs[missing] = fresh
+            self.cache.put_many(missing_texts, fresh)
+        self.logger.debug(
+            "Embedded %d texts (%d from cache)", len(texts), len(texts) - len(missing)
+        )
+        return embs
+
+    def attach_spans(self, spans: ChunkSpans) -> None:
+        """Use `spans` as the chunk texts, one span per indexed vector."""
+        if len(spans) != self.index.ntotal:
+            raise ValueError(f"Got {len(spans)} spans for {self.index.ntotal} indexed vectors")
+        self.texts = spans
+
+    def page(self, idx: int) -> Optional[int]:
+        """Page number of chunk `idx`, if the chunks carry page provenance."""
+        if isinstance(self.texts, ChunkSpans):
+            return self.texts.page(idx)
+        if self.pages is not None:
+            return self.pages[idx]
+        return None
+
+    def token_counts(self) -> np.ndarray:
+        """Tokens per chunk: exact from the token-budgeted chunker, otherwise estimated from length."""
+        if isinstance(self.texts, ChunkSpans):
+            if len(self.texts.token_counts) == len(self.texts):
+                return np.asarray(self.texts.token_counts, dtype=np.int64)
+            lengths = np.asarray(self.texts.ends, dtype=np.int64) - np.asarray(self.texts.starts, dtype=np.int64)
+        else:
+            lengths = np.array([len(text) for text in self.texts], dtype=np.int64)
+        return np.maximum(1, lengths // CHARS_PER_TOKEN)
+
+    def representatives(self, token_budget: int, max_clusters: int, min_clusters: int = 1) -> List[int]:
+        """Chunk indices covering the whole document, without a query.
+
+        Runs k-means over the stored embeddings and takes the chunk closest to each
+        centroid. k grows with the square root of the chunk count, between
+        `min_clusters` and `max_clusters`, and is capped by how many average chunks fit
+        in `token_budget`. Representatives of the largest clusters are kept first
+        until the budget is spent; they are returned in document order.
+        """
+        count = self.index.ntotal
+        if count == 0:
+            return []
+        tokens = self.token_counts()
+        fit = max(1, token_budget // max(1, int(tokens.mean())))
+        k = int(min(count, fit, max_clusters, max(min_clusters, round(math.sqrt(count)))))
+
+        start = time.perf_counter()
+        positions, _ = kmeans_representatives(self.vectors(), k)
+        picked, used = [], 0
+        for idx in positions:
+            if picked and used + tokens[idx] > token_budget:
+                continue
+            picked.append(int(idx))
+            used += int(tokens[idx])
+        self.logger.debug(
+            "Picked %d of %d k-means representatives (%d tokens) in %.3fs",
+            len(picked), k, used, time.perf_counter() - start,
+        )
+        return sorted(picked)
+
+    def nbytes(self) -> int:
+        """Approximate memory held by the vectors and chunk texts."""
+        if isinstance(self.texts, ChunkSpans):
+            text_bytes = len(self.texts.text) + 24 * len(self.texts)
+        else:
+            text_bytes = sum(len(text) for text in self.texts)
+        return self.index.ntotal * self.dim * 4 + text_bytes
+
+    def encode_query(self, query: str) -> np.ndarray:
+        """Normalized (1, dim) embedding of `query`."""
+        return self.encode_queries([query])
+
+    def encode_queries(self, queries: Sequence[str]) -> np.ndarray:
+        """Normalized (len(queries), dim) embeddings, encoding uncached queries in one batch."""
+        found: Dict[str, np.ndarray] = {}
+        with _query_cache_lock:
+            for query in queries:
+                if query in _query_cache:
+                    _query_cache.move_to_end(query)
+                    found[query] = _query_cache[query]
+        missing = list(dict.fromkeys(query for query in queries if query not in found))
+        if missing:
+            fresh = normalize(self.encoder.encode(missing))
+            with _query_cache_lock:
+                for query, emb in zip(missing, fresh):
+                    found[query] = _query_cache[query] = emb
+                while len(_query_cache) > QUERY_CACHE_SIZE:
+                    _query_cache.popitem(last=False)
+        return np.ascontiguousarray(np.stack([found[query] for query in queries]), dtype=np.float32)
+
+    def search_indices(self, query: str, top_k: int = 5) -> List[Tuple[int, float]]:
+        """Return (chunk index, cosine similarity) pairs for the `top_k` chunks closest to `query`."""
         if self.index.ntotal == 0:
             return []
+        try:
+            q_emb = self.encode_query(query)
+        except Exception:
+            self.logger.exception("Query embedding failed")
+            return []
+        return self.search_vector(q_emb, top_k)
+
+    def search_vector(
+        self, q_emb: np.ndarray, top_k: int = 5, mmr_lambda: Optional[float] = None
+    ) -> List[Tuple[int, float]]:
+        """Like `search_indices`, for a query that is already encoded with `encode_query`."""
+        return self.search_vectors(q_emb, top_k, mmr_lambda)[0]
 
+    def search_vectors(
+        self, q_embs: np.ndarray, top_k: int = 5, mmr_lambda: Optional[float] = None
+    ) -> List[List[Tuple[int, float]]]:
+        """Search for several encoded queries with one index call; one hit list per query.
+
+        With `mmr_lambda` below 1, MMR_FETCH_FACTOR * top_k candidates are fetched per
+        query and re-ranked with maximal marginal relevance (vector_index.mmr), so
+        overlapping near-duplicate chunks don't crowd out other relevant ones.
+        """
+        if self.index.ntotal == 0:
+            return [[] for _ in range(len(q_embs))]
+
+        diverse = mmr_lambda is not None and mmr_lambda < 1
+        fetch_k = min(self.index.ntotal, top_k * config.MMR_FETCH_FACTOR if diverse else top_k)
         try:
-            q_emb = self.model.encode([query], convert_to_numpy=True).astype("float32")
-            distances, indices = self.index.search(q_emb, top_k)
+            scores, indices = self.index.search(q_embs, fetch_k)
+            if not diverse:
+                return [self._hits(row_scores, row_indices) for row_scores, row_indices in zip(scores, indices)]
 
-            return [
-                (self.texts[idx], float(dist))
-                for dist, idx in zip(distances[0], indices[0])
-                if idx < len(self.texts)
-            ]
+            # Reconstruct every candidate once, even if several queries share it
+            candidates = np.unique(indices[indices >= 0])
+            vectors = self.index.reconstruct_batch(candidates) if len(candidates) else None
+            results = []
+            for row_scores, row_indices in zip(scores, indices):
+                valid = row_indices >= 0
+                row_scores, row_indices = row_scores[valid], row_indices[valid]
+                row_vectors = vectors[np.searchsorted(candidates, row_indices)] if len(row_indices) else None
+                picked = mmr(row_vectors, row_scores, top_k, mmr_lambda) if len(row_indices) else []
+                results.append(self._hits(row_scores[picked], row_indices[picked]))
+            return results
 
         except Exception:
             self.logger.exception("FAISS search failed")
-            return []
+            return [[] for _ in range(len(q_embs))]
+
+    def _hits(self, scores: np.ndarray, indices: np.ndarray) -> List[Tuple[int, float]]:
+        return [
+            (int(idx), float(score))
+            for score, idx in zip(scores, indices)
+            if 0 <= idx < len(self.texts)
+        ]
+
+    def search_many(
+        self, queries: Sequence[str], top_k: int = 5, mmr_lambda: Optional[float] = config.MMR_LAMBDA
+    ) -> List[List[Tuple[int, float]]]:
+        """(chunk index, cosine similarity) hits for each of `queries`, encoded in one batch
+        and searched in one index call, diversified with MMR (see `search_vectors`)."""
+        if self.index.ntotal == 0:
+            return [[] for _ in queries]
+        try:
+            q_embs = self.encode_queries(queries)
+        except Exception:
+            self.logger.exception("Query embedding failed")
+            return [[] for _ in queries]
+        return self.search_vectors(q_embs, top_k, mmr_lambda)
+
+    def search(self, query: str, top_k: int = 5) -> List[Tuple[str, float]]:
+        return [(self.texts[idx], dist) for idx, dist in self.search_indices(query, top_k)]
 
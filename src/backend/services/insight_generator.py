@@ -1,86 +1,253 @@
-
-import os
 import logging
-from google import genai
-from dotenv import load_dotenv
+from contextlib import aclosing
+from typing import AsyncIterator, Optional
+
+from .llm_client import MODEL_NAME
+from .llm_gateway import LLMUnavailable, get_gateway
 
 logger = logging.getLogger(__name__)
 
-# Load environment variables (in case they weren't loaded by main.py)
-load_dotenv()
 
-# Get API key
-api_key = os.environ.get("GEMINI_API_KEY")
-if not api_key:
-    logger.error("GEMINI_API_KEY not found in environment!")
+def _excerpts(chunks: list[str], pages: Optional[list[Optional[int]]] = None) -> tuple[str, str]:
+    """Join chunks for a prompt, labelled with their pages when known. Returns (text, citation note)."""
+    if pages and any(page is not None for page in pages):
+        joined_text = "\n\n".join(
+            f"[Page {page}]\n{chunk}" if page is not None else chunk
+            for chunk, page in zip(chunks, pages)
+        )
+        return joined_text, "\nCite the page numbers of the excerpts you rely on, e.g. (p. 3).\n"
+    return "\n\n".join(chunks), ""
+
+
+def _build_prompt(chunks: list[str], pages: Optional[list[Optional[int]]] = None) -> str:
+    # Join text with clear separation
+    joined_text, citation_note = _excerpts(chunks, pages)
+
+    # Construct a clean prompt for Gemini
+    return f"""
+You are a professional document analyst. 
+
+Analyze the following document excerpts and provide structured output:
+
+1. Executive Summary (3-4 lines)
+2. Key Insights (bullet points)
+3. Risks / Issues (if any)
+4. Actionable Recommendations
+{citation_note}
+Document Excerpts:
+{joined_text}
+"""
+
+
+def _build_question_prompt(question: str, chunks: list[str], pages: Optional[list[Optional[int]]] = None) -> str:
+    joined_text, citation_note = _excerpts(chunks, pages)
+    return f"""
+You are a professional document analyst.
+
+Answer the question below using only the following document excerpts. If they do not
+contain the answer, say so.
+{citation_note}
+Question: {question}
 
-# Create client
-client = genai.Client(api_key=api_key) if api_key else None
+Document Excerpts:
+{joined_text}
+"""
+
+
+def _build_map_prompt(chunks: list[str], pages: Optional[list[Optional[int]]] = None) -> str:
+    joined_text, citation_note = _excerpts(chunks, pages)
+    return f"""
+You are a professional document analyst. The excerpts below are one consecutive part
+of a longer document.
+
+Summarize this part in at most 200 words, keeping the main points, notable facts and
+figures, risks or issues, and any recommendations it makes.
+{citation_note}
+Document Excerpts:
+{joined_text}
+"""
+
+
+def _build_reduce_prompt(summaries: list[str]) -> str:
+    joined = "\n\n".join(f"[Part {i}]\n{summary}" for i, summary in enumerate(summaries, 1))
+    return f"""
+You are a professional document analyst.
 
-# Model configuration
-MODEL_NAME = "models/gemini-2.5-flash"
+The following are summaries of consecutive parts of one document. Combine them into
+structured output for the whole document:
 
+1. Executive Summary (3-4 lines)
+2. Key Insights (bullet points)
+3. Risks / Issues (if any)
+4. Actionable Recommendations
+
+Keep any page citations from the summaries.
 
-def _extract_response_text(response) -> str:
-    """Robustly extract text content from various GenAI response shapes."""
-    if not response:
-        return ""
-    # Newer client uses generations with `.content`
-    if hasattr(response, "generations") and response.generations:
-        try:
-            return response.generations[0].content
-        except Exception:
-            pass
-    # Some helpers expose `.text`
-    if hasattr(response, "text") and response.text:
-        return response.text
-    # Fallback to string representation
-    return str(response)
+Part Summaries:
+{joined}
+"""
+
+
+def _build_combine_prompt(summaries: list[str]) -> str:
+    joined = "\n\n".join(summaries)
+    return f"""
+You are a professional document analyst. The following are summaries of consecutive
+parts of a longer document.
+
+Merge them into one summary of at most 300 words, keeping the main points, notable
+facts and figures, risks or issues, recommendations and any page citations.
+
+Part Summaries:
+{joined}
+"""
+
+
+async def _complete(prompt: str) -> str:
+    """Send one prompt to Gemini through the gateway and return the response text.
+
+    Raises LLMUnavailable while the gateway's breaker is open, RuntimeError on other failures.
+    """
+    try:
+        result_text = await get_gateway().generate(prompt)
+    except LLMUnavailable:
+        raise
+    except Exception as e:
+        logger.exception(f"Gemini request failed: {type(e).__name__}: {e}")
+        raise RuntimeError(f"Generation failed: {str(e)}") from e
+    if not result_text:
+        logger.warning("Gemini API returned empty content")
+        raise RuntimeError("No text was generated")
+    return result_text
+
+
+async def _stream(prompt: str) -> AsyncIterator[str]:
+    """Yield Gemini's response text to `prompt` as it arrives.
+
+    Raises LLMUnavailable while the gateway's breaker is open, RuntimeError on other failures.
+    """
+    length = 0
+    try:
+        async with aclosing(get_gateway().stream(prompt)) as pieces:
+            async for text in pieces:
+                length += len(text)
+                yield text
+    except LLMUnavailable:
+        raise
+    except Exception as e:
+        logger.exception(f"Failed to stream insights: {type(e).__name__}: {e}")
+        raise RuntimeError(f"Insight generation failed: {str(e)}") from e
+    if not length:
+        logger.warning("Gemini API returned empty content")
+        raise RuntimeError("No insights were generated")
+    logger.debug(f"Successfully streamed insights (length: {length})")
 
 
 # ---------------- CORE FUNCTION ----------------
-def generate_insights(chunks: list[str]) -> str:
+async def generate_insights(chunks: list[str], pages: Optional[list[Optional[int]]] = None) -> str:
     """
     Generate structured insights from retrieved document chunks using Gemini.
+    When `pages` gives the page number of each chunk, excerpts are labelled and the
+    model is asked to cite them.
     Raises RuntimeError on failure so callers can log and return appropriate HTTP errors.
     """
     if not chunks:
         return "No relevant content found."
+    logger.debug(f"Calling Gemini API with model {MODEL_NAME}, chunk count: {len(chunks)}")
+    result_text = await _complete(_build_prompt(chunks, pages))
+    logger.debug(f"Successfully generated insights (length: {len(result_text)})")
+    return result_text
 
-    # Join text with clear separation
-    joined_text = "\n\n".join(chunks)
 
-    # Construct a clean prompt for Gemini
-    prompt = f"""
-You are a professional document analyst. 
+async def answer_question(question: str, chunks: list[str], pages: Optional[list[Optional[int]]] = None) -> str:
+    """
+    Answer `question` about a document from its retrieved chunks using Gemini.
+    Raises RuntimeError on failure.
+    """
+    if not chunks:
+        return "No relevant content found."
+    logger.debug(f"Answering question with model {MODEL_NAME}, chunk count: {len(chunks)}")
+    return await _complete(_build_question_prompt(question, chunks, pages))
 
-Analyze the following document excerpts and provide structured output:
 
-1. Executive Summary (3-4 lines)
-2. Key Insights (bullet points)
-3. Risks / Issues (if any)
-4. Actionable Recommendations
+async def stream_insights(chunks: list[str], pages: Optional[list[Optional[int]]] = None) -> AsyncIterator[str]:
+    """
+    Like `generate_insights`, but yield the text in pieces as Gemini produces them.
+    Raises RuntimeError on failure, possibly after some text has been yielded.
+    """
+    if not chunks:
+        yield "No relevant content found."
+        return
+    logger.debug(f"Streaming from Gemini API with model {MODEL_NAME}, chunk count: {len(chunks)}")
+    async with aclosing(_stream(_build_prompt(chunks, pages))) as pieces:
+        async for text in pieces:
+            yield text
+
+
+# ---------------- MAP-REDUCE ----------------
+# For documents too long for one prompt (see services/map_reduce.py): each group of
+# consecutive chunks is summarized (map), summaries are merged while there are too many
+# for one prompt (combine), and the rest become the four-section output (reduce).
+async def summarize_part(chunks: list[str], pages: Optional[list[Optional[int]]] = None) -> str:
+    """Summarize one group of consecutive chunks. Raises RuntimeError on failure."""
+    return await _complete(_build_map_prompt(chunks, pages))
+
+
+async def combine_summaries(summaries: list[str]) -> str:
+    """Merge consecutive part summaries into one. Raises RuntimeError on failure."""
+    return await _complete(_build_combine_prompt(summaries))
+
 
+async def reduce_summaries(summaries: list[str]) -> str:
+    """Structured insights for a whole document from its part summaries. Raises RuntimeError on failure."""
+    if not summaries:
+        return "No relevant content found."
+    return await _complete(_build_reduce_prompt(summaries))
+
+
+async def stream_reduce_summaries(summaries: list[str]) -> AsyncIterator[str]:
+    """Like `reduce_summaries`, but yield the text in pieces as Gemini produces them."""
+    if not summaries:
+        yield "No relevant content found."
+        return
+    async with aclosing(_stream(_build_reduce_prompt(summaries))) as pieces:
+        async for text in pieces:
+            yield text
+
+
+# ---------------- PER-SECTION ----------------
+# (title, what to write, retrieval query) for each section of the report, in order.
+# Titles and numbering match the single-prompt layout, which the frontend parses.
+SECTIONS = (
+    ("Executive Summary", "a 3-4 line executive summary of the document",
+     "executive summary and main purpose of the document"),
+    ("Key Insights", "the key insights, as bullet points",
+     "key insights and findings"),
+    ("Risks / Issues", "the risks and issues it raises, as bullet points (or say that there are none)",
+     "risks, issues and concerns"),
+    ("Actionable Recommendations", "actionable recommendations, as bullet points",
+     "recommendations and next steps"),
+)
+
+
+def _build_section_prompt(instruction: str, chunks: list[str], pages: Optional[list[Optional[int]]] = None) -> str:
+    joined_text, citation_note = _excerpts(chunks, pages)
+    return f"""
+You are a professional document analyst.
+
+Based on the following document excerpts, write {instruction}. Write only that
+section's content, without a heading.
+{citation_note}
 Document Excerpts:
 {joined_text}
 """
 
-    # Use try/except to catch API errors and let the caller handle them
-    try:
-        if not client:
-            raise RuntimeError("Gemini API client not initialized. Check GEMINI_API_KEY environment variable.")
-        
-        logger.debug(f"Calling Gemini API with model {MODEL_NAME}, chunk count: {len(chunks)}")
-        response = client.models.generate_content(
-            model=MODEL_NAME,
-            contents=prompt,
-        )
-        result_text = _extract_response_text(response)
-        if not result_text:
-            logger.warning("Gemini API returned empty content")
-            raise RuntimeError("No insights were generated")
-        logger.debug(f"Successfully generated insights (length: {len(result_text)})")
-        return result_text
-    except Exception as e:
-        logger.exception(f"Failed to generate insights: {type(e).__name__}: {e}")
-        raise RuntimeError(f"Insight generation failed: {str(e)}") from e
+
+async def generate_section(instruction: str, chunks: list[str], pages: Optional[list[Optional[int]]] = None) -> str:
+    """Write one report section from the chunks retrieved for it. Raises RuntimeError on failure."""
+    if not chunks:
+        return "No relevant content found."
+    return await _complete(_build_section_prompt(instruction, chunks, pages))
+
+
+def format_section(number: int, title: str, body: str) -> str:
+    return f"### {number}. {title}\n\n{body.strip()}"
@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ("done", "failed")
+
+
+class Job:
+    """State and progress of one background analysis.
+
+    `update` may be called from worker threads; subscribers (e.g. SSE streams)
+    receive a snapshot after every change.
+    """
+
+    def __init__(self, filename: str):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.status = "queued"
+        self.stage = "queued"
+        self.progress: Dict[str, object] = {
+            "total_pages": None,
+            "pages_extracted": 0,
+            "chunks_embedded": 0,
+            "llm": "pending",
+        }
+        self.result: Optional[dict] = None
+        self.error: Optional[dict] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self._lock = threading.Lock()
+        self._subscribers: List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = []
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            data = {
+                "job_id": self.id,
+                "filename": self.filename,
+                "status": self.status,
+                "stage": self.stage,
+                "progress": dict(self.progress),
+            }
+            if self.result is not None:
+                data["result"] = self.result
+            if self.error is not None:
+                data["error"] = self.error
+            return data
+
+    def update(self, status: Optional[str] = None, stage: Optional[str] = None, **progress) -> None:
+        """Record a status/stage change and/or progress fields, then notify subscribers."""
+        with self._lock:
+            if status is not None:
+                self.status = status
+            if stage is not None:
+                self.stage = stage
+            self.progress.update(progress)
+        self._publish()
+
+    def finish(self, result: Optional[dict] = None, error: Optional[dict] = None) -> None:
+        with self._lock:
+            self.status = "failed" if error is not None else "done"
+            self.stage = self.status
+            self.result = result
+            self.error = error
+            self.finished_at = time.time()
+        self._publish()
+
+    def _publish(self) -> None:
+        snapshot = self.snapshot()
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(queue.put_nowait, snapshot)
+
+    async def events(self) -> AsyncIterator[dict]:
+        """Yield the current snapshot, then one per change, until the job finishes."""
+        queue: asyncio.Queue = asyncio.Queue()
+        entry = (asyncio.get_running_loop(), queue)
+        with self._lock:
+            self._subscribers.append(entry)
+        try:
+            snapshot = self.snapshot()
+            while True:
+                yield snapshot
+                if snapshot["status"] in TERMINAL_STATUSES:
+                    return
+                snapshot = await queue.get()
+        finally:
+            with self._lock:
+                self._subscribers.remove(entry)
+
+
+class EventLog:
+    """Append-only list of events that any number of subscribers replay from the start and follow.
+
+    Lets identical streamed analyses share one computation: it appends its events
+    here once, and every stream waiting for it sends them on.
+    """
+
+    def __init__(self):
+        self.subscribers = 0
+        self.closed = False
+        self._events: List[dict] = []
+        self._changed = asyncio.Event()
+
+    def append(self, event: dict) -> None:
+        self._events.append(event)
+        self._wake()
+
+    def close(self) -> None:
+        self.closed = True
+        self._wake()
+
+    def _wake(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self) -> AsyncIterator[dict]:
+        """Yield every event so far, then each new one, until the log is closed."""
+        sent = 0
+        while True:
+            changed = self._changed
+            while sent < len(self._events):
+                yield self._events[sent]
+                sent += 1
+            if self.closed:
+                return
+            await changed.wait()
+
+
+class JobStore:
+    """In-memory registry of background jobs; finished jobs expire after `retention_seconds`."""
+
+    def __init__(self, retention_seconds: int):
+        self.retention_seconds = retention_seconds
+        self._jobs: Dict[str, Job] = {}
+
+    def create(self, filename: str) -> Job:
+        self.prune()
+        job = Job(filename)
+        self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self.prune()
+        return self._jobs.get(job_id)
+
+    def prune(self) -> None:
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at is not None and now - job.finished_at > self.retention_seconds
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+        if expired:
+            logger.debug("Expired %d finished jobs", len(expired))
@@ -0,0 +1,181 @@
+"""
+Exact-match cache of LLM responses.
+
+Both analyze endpoints often send byte-identical prompts: the same pasted text, or
+the same retrieved chunks of a document analyzed before. The gateway
+(services/llm_gateway.py) looks each prompt up here before spending quota on it
+and stores every new response, so a repeated prompt is answered from disk in
+about a millisecond.
+
+Entries live in one SQLite file (WAL mode), shared by all worker processes, keyed
+by a hash of the model, the generation config and the prompt. Entries older than
+the TTL are dropped, and once the stored responses exceed `max_bytes` the least
+recently used go first. A request can skip the lookup by setting `bypass_cache`
+(`no_cache=true` on the endpoints); its fresh responses still replace the
+cached ones.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from .. import config
+
+logger = logging.getLogger(__name__)
+
+# True while serving a request that asked to skip the cache; tasks started by the
+# request (report sections, map-reduce parts, background jobs) inherit it
+bypass_cache: ContextVar[bool] = ContextVar("bypass_cache", default=False)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+CREATE INDEX IF NOT EXISTS responses_created_at ON responses (created_at);
+-- Running total of the stored response sizes, kept by triggers so puts need not sum the table
+CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL);
+INSERT OR IGNORE INTO totals (id, bytes) SELECT 0, COALESCE(SUM(size), 0) FROM responses;
+CREATE TRIGGER IF NOT EXISTS responses_inserted AFTER INSERT ON responses
+BEGIN UPDATE totals SET bytes = bytes + NEW.size WHERE id = 0; END;
+CREATE TRIGGER IF NOT EXISTS responses_updated AFTER UPDATE OF size ON responses
+BEGIN UPDATE totals SET bytes = bytes - OLD.size + NEW.size WHERE id = 0; END;
+CREATE TRIGGER IF NOT EXISTS responses_deleted AFTER DELETE ON responses
+BEGIN UPDATE totals SET bytes = bytes - OLD.size WHERE id = 0; END;
+"""
+
+
+def cache_key(model: str, prompt: str, generation_config: Optional[dict] = None) -> str:
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    settings = json.dumps(generation_config or {}, sort_keys=True, default=str)
+    return hashlib.sha256(f"{model}\0{settings}\0{prompt_hash}".encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """SQLite-backed LLM response cache with LRU eviction past `max_bytes` and a TTL."""
+
+    def __init__(self, path: str, max_bytes: int, ttl_seconds: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get(self, key: str) -> Optional[str]:
+        """The cached response for `key`, or None if missing, expired or bypassed by the current request."""
+        if bypass_cache.get():
+            self._count("bypassed")
+            return None
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                row = conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None and now - row[1] > self.ttl_seconds:
+                    conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    row = None
+                elif row is not None:
+                    conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+        except sqlite3.Error:
+            logger.exception("LLM cache lookup failed")
+            row = None
+        self._count("misses" if row is None else "hits")
+        return None if row is None else row[0]
+
+    def put(self, key: str, model: str, response: str) -> None:
+        """Store `response` under `key`, then drop expired and least recently used entries past the size cap."""
+        size = len(response.encode("utf-8"))
+        if not response or size > self.max_bytes:
+            return
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                # An upsert rather than INSERT OR REPLACE, whose implicit delete skips the triggers
+                conn.execute(
+                    "INSERT INTO responses (key, model, response, size, created_at, last_used)"
+                    " VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET model = excluded.model,"
+                    " response = excluded.response, size = excluded.size, created_at = excluded.created_at,"
+                    " last_used = excluded.last_used",
+                    (key, model, response, size, now, now),
+                )
+                evicted = conn.execute(
+                    "DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,)
+                ).rowcount
+                total = conn.execute("SELECT bytes FROM totals WHERE id = 0").fetchone()[0]
+                if total > self.max_bytes:
+                    stale = []
+                    for old_key, old_size in conn.execute("SELECT key, size FROM responses ORDER BY last_used"):
+                        if total <= self.max_bytes:
+                            break
+                        stale.append((old_key,))
+                        total -= old_size
+                    conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+                    evicted += len(stale)
+        except sqlite3.Error:
+            logger.exception("Failed to write LLM cache entry")
+            return
+        if evicted:
+            with self._lock:
+                self.evictions += evicted
+
+    def stats(self) -> dict:
+        try:
+            with self._connect() as conn:
+                entries, size = conn.execute(
+                    "SELECT (SELECT COUNT(*) FROM responses), (SELECT bytes FROM totals WHERE id = 0)"
+                ).fetchone()
+        except sqlite3.Error:
+            entries, size = None, None
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "bytes": size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "bypassed": self.bypassed,
+                "evictions": self.evictions,
+            }
+
+
+_cache: Optional[LLMResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> Optional[LLMResponseCache]:
+    """The process-wide LLM response cache, or None when LLM_CACHE_MAX_BYTES=0."""
+    global _cache
+    if config.LLM_CACHE_MAX_BYTES <= 0:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = LLMResponseCache(
+                    config.LLM_CACHE_PATH, config.LLM_CACHE_MAX_BYTES, config.LLM_CACHE_TTL_SECONDS
+                )
+    return _cache
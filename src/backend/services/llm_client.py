@@ -0,0 +1,49 @@
+import logging
+import os
+from typing import Optional
+
+from .. import config
+
+logger = logging.getLogger(__name__)
+
+# Model configuration
+MODEL_NAME = config.LLM_MODEL_NAME
+
+
+def api_key() -> Optional[str]:
+    return os.environ.get("GEMINI_API_KEY")
+
+
+def is_configured() -> bool:
+    return bool(api_key())
+
+
+def new_client(key: Optional[str] = None, base_url: Optional[str] = None):
+    """Create a Gemini client, or return None when no API key is given or set in GEMINI_API_KEY.
+
+    `base_url` defaults to LLM_BASE_URL (the public API when empty). The async client
+    pools up to LLM_MAX_CONCURRENCY connections. google.genai is imported here, which
+    keeps it out of the server's startup time. Use llm_gateway.get_gateway() rather
+    than calling the client directly.
+    """
+    key = key or api_key()
+    if not key:
+        return None
+    import httpx
+    from google import genai
+    from google.genai import types
+
+    limits = httpx.Limits(
+        max_connections=config.LLM_MAX_CONCURRENCY,
+        max_keepalive_connections=config.LLM_MAX_CONCURRENCY,
+    )
+    options = types.HttpOptions(
+        base_url=base_url or config.LLM_BASE_URL or None,
+        async_client_args={"limits": limits},
+    )
+    return genai.Client(api_key=key, http_options=options)
+
+
+if not is_configured():
+    logger.error("GEMINI_API_KEY is not set in environment or .env file!")
+    logger.error("Please create a .env file with: GEMINI_API_KEY=your_key_here")
@@ -0,0 +1,451 @@
+"""
+One gateway for every Gemini call.
+
+Both analyze endpoints send their prompts through `get_gateway()`, which wraps the
+SDK's async client: calls run on the event loop instead of tying up a thread each,
+and share one pool of keep-alive connections. Around each call the gateway:
+
+- waits for quota from two token buckets, one for requests and one for tokens a
+  minute (LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE), so bursts are smoothed
+  out here instead of being rejected by the API with 429s;
+- keeps at most LLM_MAX_CONCURRENCY calls in flight;
+- retries timeouts, connection errors and 408/429/5xx responses with jittered
+  exponential backoff (LLM_MAX_RETRIES, LLM_RETRY_BASE_SECONDS, LLM_RETRY_MAX_SECONDS);
+- fails fast with LLMUnavailable while a circuit breaker is open, after
+  LLM_BREAKER_FAILURES such failures in a row (429s excluded: running out of quota
+  calls for backing off, not for giving up);
+- with LLM_HEDGE_AFTER_MS, sends a second copy of a non-streaming call that has
+  not answered that long after it was sent, if a connection slot and quota are
+  spare, and takes whichever answers first, trimming tail latency.
+
+Responses are looked up in and added to the LLM response cache
+(services/llm_cache.py) first, so a repeated prompt costs neither quota nor a call.
+
+Prompt tokens are estimated up front (context_packer.estimate_tokens) and the
+bucket is corrected with the usage Gemini reports. Point LLM_BASE_URL at
+`python -m benchmarks.llm_stub_server` to exercise all of this locally
+(see benchmarks/bench_llm_gateway.py).
+"""
+import asyncio
+import itertools
+import logging
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional, Tuple
+
+from .. import config
+from .context_packer import estimate_tokens
+from .llm_cache import LLMResponseCache, cache_key, get_llm_cache
+from .llm_client import MODEL_NAME, new_client
+
+logger = logging.getLogger(__name__)
+
+# HTTP statuses worth retrying: request timeout, rate limited, server errors
+RETRYABLE_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+
+
+class LLMUnavailable(RuntimeError):
+    """Raised without calling the API while the circuit breaker is open."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"LLM API unavailable, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Refills at `per_minute` a minute and holds at most a minute's worth. 0 disables it."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60
+        self._level = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def ready(self, amount: float) -> bool:
+        """Whether `amount` could be taken now. More than the capacity only fits a full bucket."""
+        if not self.rate:
+            return True
+        self._refill()
+        return self._level >= min(amount, self.capacity)
+
+    def charge(self, amount: float) -> None:
+        """Take `amount` (negative gives some back) without waiting; the level may go below zero."""
+        if self.rate:
+            self._refill()
+            self._level -= amount
+
+    async def take(self, amount: float) -> float:
+        """Wait until `amount` is available, take it and return the seconds waited. Waiters go in turn."""
+        if not self.rate:
+            return 0.0
+        start = time.monotonic()
+        async with self._lock:
+            while not self.ready(amount):
+                await asyncio.sleep((min(amount, self.capacity) - self._level) / self.rate)
+            self.charge(amount)
+        return time.monotonic() - start
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures (0 disables it).
+
+    While open, calls are refused. Every `reset_seconds` one trial call is let
+    through (half-open): a success closes the breaker, a failure keeps it open.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self._opened_at = 0.0
+
+    def retry_after(self) -> float:
+        return max(0.0, self._opened_at + self.reset_seconds - time.monotonic())
+
+    @property
+    def state(self) -> str:
+        if self.failure_threshold <= 0 or self.failures < self.failure_threshold:
+            return "closed"
+        return "open" if self.retry_after() > 0 else "half_open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "half_open":
+            # Let this call through as the trial; the next one waits for another period
+            self._opened_at = time.monotonic()
+        return state != "open"
+
+    def record_success(self) -> None:
+        self.failures = 0
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.failure_threshold > 0 and self.failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+
+
+def _retryable(error: BaseException) -> bool:
+    import httpx
+    from google.genai import errors
+
+    if isinstance(error, errors.APIError):
+        return error.code in RETRYABLE_STATUSES
+    return isinstance(error, (asyncio.TimeoutError, httpx.TransportError))
+
+
+def _answered(error: BaseException) -> bool:
+    """Whether `error` is a response from the API, as opposed to a failure on our side."""
+    from google.genai import errors
+
+    return isinstance(error, errors.APIError)
+
+
+def _retry_after(error: BaseException) -> float:
+    """Seconds the server asked us to wait (Retry-After header), or 0."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return max(0.0, float(headers.get("retry-after", 0)))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _describe(error: BaseException) -> str:
+    if isinstance(error, asyncio.TimeoutError):
+        return "timed out"
+    code = getattr(error, "code", None)
+    return f"HTTP {code}" if code else type(error).__name__
+
+
+class LLMGateway:
+    """Rate-limited, retrying, circuit-broken access to one Gemini model (see module docstring).
+
+    Create it inside the event loop that will use it, like its asyncio locks and the
+    client's connection pool.
+    """
+
+    def __init__(
+        self,
+        client,
+        model: str = MODEL_NAME,
+        max_concurrency: int = config.LLM_MAX_CONCURRENCY,
+        requests_per_minute: int = config.LLM_REQUESTS_PER_MINUTE,
+        tokens_per_minute: int = config.LLM_TOKENS_PER_MINUTE,
+        timeout: float = config.LLM_TIMEOUT_SECONDS,
+        max_retries: int = config.LLM_MAX_RETRIES,
+        retry_base: float = config.LLM_RETRY_BASE_SECONDS,
+        retry_max: float = config.LLM_RETRY_MAX_SECONDS,
+        breaker_failures: int = config.LLM_BREAKER_FAILURES,
+        breaker_reset: float = config.LLM_BREAKER_RESET_SECONDS,
+        hedge_after: float = config.LLM_HEDGE_AFTER_MS / 1000,
+        cache: Optional[LLMResponseCache] = None,
+    ):
+        self.client = client
+        self.cache = cache
+        self.model = model
+        self.max_concurrency = max(1, max_concurrency)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.hedge_after = hedge_after
+        self.breaker = CircuitBreaker(breaker_failures, breaker_reset)
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._in_flight = 0
+        self._stats = {
+            "cached": 0,
+            "calls": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "rejected": 0,
+            "retries": 0,
+            "timeouts": 0,
+            "rate_limited": 0,
+            "hedges": 0,
+            "hedges_won": 0,
+            "quota_wait_seconds": 0.0,
+        }
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "quota_wait_seconds": round(self._stats["quota_wait_seconds"], 3),
+            "in_flight": self._in_flight,
+            "breaker": self.breaker.state,
+        }
+
+    # ---------------- CALLS ----------------
+    async def generate(self, prompt: str, generation_config: Optional[dict] = None) -> str:
+        """Gemini's response text to `prompt`, from the cache if it was answered before.
+
+        Raises LLMUnavailable while the breaker is open, or the last error once
+        retries are exhausted or on an error that is not worth retrying.
+        """
+        key, cached = await self._cached(prompt, generation_config)
+        if cached is not None:
+            return cached
+        tokens = estimate_tokens(prompt)
+        self._stats["calls"] += 1
+        for attempt in itertools.count():
+            await self._admit(tokens)
+            try:
+                response = await self._hedged(prompt, tokens, generation_config)
+            except LLMUnavailable:
+                # The breaker opened while this call waited for a slot: nothing was sent
+                raise
+            except Exception as e:
+                await self._recover(e, attempt)
+                continue
+            self._succeeded(tokens, getattr(response, "usage_metadata", None))
+            text = response.text or ""
+            if key is not None:
+                await asyncio.to_thread(self.cache.put, key, self.model, text)
+            return text
+
+    async def stream(self, prompt: str, generation_config: Optional[dict] = None) -> AsyncIterator[str]:
+        """Yield Gemini's response text to `prompt` in pieces as it arrives.
+
+        A cached response is yielded in one piece. Failures before the first piece
+        are retried as in `generate`; later ones are raised, since the caller already
+        has part of the text. Streams are not hedged.
+
+        Until it is exhausted or closed, the generator holds a concurrency slot and the
+        HTTP stream; callers that may stop early close it (contextlib.aclosing).
+        """
+        key, cached = await self._cached(prompt, generation_config)
+        if cached is not None:
+            yield cached
+            return
+        tokens = estimate_tokens(prompt)
+        self._stats["calls"] += 1
+        for attempt in itertools.count():
+            await self._admit(tokens)
+            received = []
+            usage = None
+            try:
+                async with self._slot():
+                    pieces = await asyncio.wait_for(
+                        self.client.aio.models.generate_content_stream(
+                            model=self.model, contents=prompt, config=generation_config
+                        ),
+                        self.timeout,
+                    )
+                    try:
+                        while True:
+                            try:
+                                piece = await asyncio.wait_for(pieces.__anext__(), self.timeout)
+                            except StopAsyncIteration:
+                                break
+                            usage = piece.usage_metadata or usage
+                            if piece.text:
+                                received.append(piece.text)
+                                yield piece.text
+                    finally:
+                        # Ends the HTTP stream on a retry, an error or a consumer that stopped early
+                        await pieces.aclose()
+            except LLMUnavailable:
+                raise
+            except Exception as e:
+                if not received:
+                    await self._recover(e, attempt)
+                    continue
+                if _retryable(e) and getattr(e, "code", None) != 429:
+                    self.breaker.record_failure()
+                self._stats["failed"] += 1
+                raise
+            self._succeeded(tokens, usage)
+            if key is not None:
+                await asyncio.to_thread(self.cache.put, key, self.model, "".join(received))
+            return
+
+    # ---------------- INTERNALS ----------------
+    async def _cached(self, prompt: str, generation_config: Optional[dict]) -> Tuple[Optional[str], Optional[str]]:
+        """The cache key for this call (None without a cache) and the cached response, if any."""
+        if self.cache is None:
+            return None, None
+        key = cache_key(self.model, prompt, generation_config)
+        # SQLite I/O runs on a thread, off the event loop; to_thread carries the
+        # request's bypass_cache setting along
+        cached = await asyncio.to_thread(self.cache.get, key)
+        if cached is not None:
+            self._stats["cached"] += 1
+        return key, cached
+
+    async def _admit(self, tokens: int) -> None:
+        """Check the breaker, then wait for a request's and `tokens` tokens' worth of quota."""
+        if not self.breaker.allow():
+            self._stats["rejected"] += 1
+            raise LLMUnavailable(self.breaker.retry_after())
+        waited = await self._requests.take(1)
+        waited += await self._tokens.take(tokens)
+        self._stats["quota_wait_seconds"] += waited
+
+    @asynccontextmanager
+    async def _slot(self):
+        async with self._slots:
+            if self.breaker.state == "open":
+                # It opened while this call was queued
+                self._stats["rejected"] += 1
+                raise LLMUnavailable(self.breaker.retry_after())
+            self._in_flight += 1
+            try:
+                yield
+            finally:
+                self._in_flight -= 1
+
+    async def _send(self, prompt: str, generation_config: Optional[dict]):
+        return await asyncio.wait_for(
+            self.client.aio.models.generate_content(model=self.model, contents=prompt, config=generation_config),
+            self.timeout,
+        )
+
+    async def _send_in_slot(self, prompt: str, generation_config: Optional[dict]):
+        async with self._slot():
+            return await self._send(prompt, generation_config)
+
+    async def _hedged(self, prompt: str, tokens: int, generation_config: Optional[dict]):
+        """One attempt; if it is still running `hedge_after` after it was sent, race it against a second copy."""
+        async with self._slot():
+            if not self.hedge_after:
+                return await self._send(prompt, generation_config)
+            tasks = [asyncio.ensure_future(self._send(prompt, generation_config))]
+            try:
+                done, _ = await asyncio.wait(tasks, timeout=self.hedge_after)
+                # Hedges only use spare capacity: a free slot and quota, never waiting for either
+                if done or self._slots.locked() or not (self._requests.ready(1) and self._tokens.ready(tokens)):
+                    return await tasks[0]
+                self._requests.charge(1)
+                self._tokens.charge(tokens)
+                self._stats["hedges"] += 1
+                tasks.append(asyncio.ensure_future(self._send_in_slot(prompt, generation_config)))
+                pending, error = set(tasks), None
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task.exception() is None:
+                            if task is tasks[1]:
+                                self._stats["hedges_won"] += 1
+                            return task.result()
+                        error = task.exception()
+                raise error
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+    async def _recover(self, error: Exception, attempt: int) -> None:
+        """Sleep before retrying after `error`, or re-raise it when it should not be retried."""
+        if isinstance(error, asyncio.TimeoutError):
+            self._stats["timeouts"] += 1
+        rate_limited = getattr(error, "code", None) == 429
+        if rate_limited:
+            # Out of quota is not an outage: back off, but leave the breaker alone
+            self._stats["rate_limited"] += 1
+        elif not _retryable(error):
+            if _answered(error):
+                # The API answered, so it is up; the request itself was bad
+                self.breaker.record_success()
+            self._stats["failed"] += 1
+            raise error
+        else:
+            self.breaker.record_failure()
+        if attempt >= self.max_retries:
+            self._stats["failed"] += 1
+            raise error
+        # Full jitter: spreads out the retries of calls that failed together
+        delay = random.uniform(0, min(self.retry_max, self.retry_base * 2 ** attempt))
+        delay = max(delay, min(self.retry_max, _retry_after(error)))
+        self._stats["retries"] += 1
+        logger.warning(
+            "Gemini call %s, retry %d/%d in %.2fs", _describe(error), attempt + 1, self.max_retries, delay
+        )
+        await asyncio.sleep(delay)
+
+    def _succeeded(self, tokens: int, usage) -> None:
+        self.breaker.record_success()
+        self._stats["succeeded"] += 1
+        total = getattr(usage, "total_token_count", None)
+        if total:
+            # Settle the estimate against what was actually used, output included
+            self._tokens.charge(total - tokens)
+            logger.debug(
+                "Gemini usage: %s prompt tokens, %s output tokens",
+                getattr(usage, "prompt_token_count", None), getattr(usage, "candidates_token_count", None),
+            )
+
+
+# ---------------- SHARED GATEWAY ----------------
+GATEWAY: Optional[LLMGateway] = None
+_gateway_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_gateway() -> LLMGateway:
+    """The process-wide gateway, created on first use in the running event loop.
+
+    Raises RuntimeError when GEMINI_API_KEY is not set.
+    """
+    global GATEWAY, _gateway_loop
+    loop = asyncio.get_running_loop()
+    if GATEWAY is None or _gateway_loop is not loop:
+        # Locks and pooled connections belong to one loop (only scripts run several)
+        client = new_client()
+        if client is None:
+            raise RuntimeError("Gemini API client not initialized. Check GEMINI_API_KEY environment variable.")
+        GATEWAY, _gateway_loop = LLMGateway(client, cache=get_llm_cache()), loop
+    return GATEWAY
+
+
+async def close_gateway() -> None:
+    """Close the shared gateway's connections (at shutdown)."""
+    global GATEWAY, _gateway_loop
+    if GATEWAY is not None and _gateway_loop is asyncio.get_running_loop():
+        await GATEWAY.client.aio.aclose()
+    GATEWAY, _gateway_loop = None, None
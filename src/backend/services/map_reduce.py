@@ -0,0 +1,115 @@
+"""
+Map-reduce insight generation for documents too long for one prompt.
+
+A document's chunks are packed, in order, into groups of at most
+MAP_REDUCE_GROUP_TOKENS tokens. Each group is summarized by its own LLM call
+(map), with at most MAP_REDUCE_CONCURRENCY calls in flight, so wall-clock time
+grows with groups / concurrency rather than with document length. While more
+than MAP_REDUCE_FAN_IN summaries remain, consecutive runs of them are merged
+the same way (combine). The caller turns what is left into the final
+four-section output with insight_generator.reduce_summaries (or
+stream_reduce_summaries).
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Optional, Sequence, Tuple
+
+from .. import config
+from .context_packer import estimate_tokens
+from .insight_generator import combine_summaries, summarize_part
+
+logger = logging.getLogger(__name__)
+
+
+def group_chunks(
+    chunks: Sequence[str], pages: Sequence[Optional[int]], token_budget: int
+) -> List[Tuple[List[str], List[Optional[int]]]]:
+    """Pack consecutive chunks (and their pages) into groups of at most `token_budget` estimated tokens.
+
+    A chunk larger than the budget gets a group of its own.
+    """
+    groups: List[Tuple[List[str], List[Optional[int]]]] = []
+    current_chunks, current_pages, used = [], [], 0
+    for chunk, page in zip(chunks, pages):
+        tokens = estimate_tokens(chunk)
+        if current_chunks and used + tokens > token_budget:
+            groups.append((current_chunks, current_pages))
+            current_chunks, current_pages, used = [], [], 0
+        current_chunks.append(chunk)
+        current_pages.append(page)
+        used += tokens
+    if current_chunks:
+        groups.append((current_chunks, current_pages))
+    return groups
+
+
+async def _bounded(
+    calls: Sequence[Callable[[], Awaitable]],
+    concurrency: int,
+    on_done: Optional[Callable[[int], None]] = None,
+) -> list:
+    """Await `calls` with at most `concurrency` running at once; results in call order.
+
+    On the first failure the calls that have not started yet are cancelled.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    finished = 0
+
+    async def run(call):
+        nonlocal finished
+        async with semaphore:
+            result = await call()
+        finished += 1
+        if on_done is not None:
+            on_done(finished)
+        return result
+
+    tasks = [asyncio.ensure_future(run(call)) for call in calls]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+async def map_summaries(
+    chunks: Sequence[str],
+    pages: Sequence[Optional[int]],
+    progress: Optional[Callable[..., None]] = None,
+    group_tokens: int = config.MAP_REDUCE_GROUP_TOKENS,
+    concurrency: int = config.MAP_REDUCE_CONCURRENCY,
+    fan_in: int = config.MAP_REDUCE_FAN_IN,
+) -> List[str]:
+    """Summarize a whole document in parallel; returns at most `fan_in` summaries, in document order.
+
+    If given, `progress` is called with map_groups and map_groups_done as groups finish.
+
+    Raises:
+        RuntimeError: if an LLM call fails.
+    """
+    def report(**fields) -> None:
+        if progress is not None:
+            progress(**fields)
+
+    groups = group_chunks(chunks, pages, group_tokens)
+    report(map_groups=len(groups), map_groups_done=0)
+    logger.debug("Map-reduce over %d chunks: %d groups, %d at a time", len(chunks), len(groups), concurrency)
+    summaries = await _bounded(
+        [lambda group=group: summarize_part(*group) for group in groups],
+        concurrency,
+        on_done=lambda done: report(map_groups_done=done),
+    )
+
+    fan_in = max(2, fan_in)
+    while len(summaries) > fan_in:
+        runs = [summaries[i:i + fan_in] for i in range(0, len(summaries), fan_in)]
+        logger.debug("Combining %d summaries into %d", len(summaries), len(runs))
+        summaries = await _bounded([lambda run=run: _combine(run) for run in runs], concurrency)
+    return summaries
+
+
+async def _combine(summaries: List[str]) -> str:
+    if len(summaries) == 1:
+        return summaries[0]
+    return await combine_summaries(summaries)
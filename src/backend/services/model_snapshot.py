@@ -0,0 +1,42 @@
+"""
+Save a local copy of the embedding model with safetensors weights.
+
+transformers memory-maps safetensors files instead of unpickling a PyTorch
+checkpoint, so a cold worker loading from this copy starts faster and shares
+the weight pages with other workers on the node. The backend uses the copy
+when EMBEDDING_MODEL_DIR contains one:
+
+    python -m src.backend.services.model_snapshot [model] [directory]
+"""
+import argparse
+import glob
+import logging
+import os
+
+from .. import config
+
+logger = logging.getLogger(__name__)
+
+
+def save_snapshot(model_name: str, directory: str) -> None:
+    """Save `model_name` (name or path) to `directory` with safetensors weights."""
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name, device="cpu")
+    model.save(directory, safe_serialization=True)
+    if not glob.glob(os.path.join(directory, "**", "*.safetensors"), recursive=True):
+        raise RuntimeError(f"No safetensors weights were written to {directory}")
+    logger.info("Saved %s to %s", model_name, directory)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("model", nargs="?", default=config.EMBEDDING_MODEL_NAME)
+    parser.add_argument("directory", nargs="?", default=config.EMBEDDING_MODEL_DIR)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    save_snapshot(args.model, args.directory)
+
+
+if __name__ == "__main__":
+    main()
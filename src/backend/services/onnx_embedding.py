@@ -0,0 +1,166 @@
+"""
+ONNX Runtime backend for sentence-transformer embeddings.
+
+`OnnxSentenceEncoder` runs an exported transformer graph through onnxruntime and
+applies the pooling and normalization of the SentenceTransformer it came from,
+behind the same `encode` contract. Export a model (optionally with a dynamically
+int8-quantized copy) once, on a machine with torch installed:
+
+    python -m src.backend.services.onnx_embedding all-MiniLM-L6-v2 data/models/all-MiniLM-L6-v2-onnx --quantize
+
+Check parity and throughput with `python -m benchmarks.bench_embedding_backends`.
+"""
+import argparse
+import json
+import logging
+import os
+from typing import List, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SETTINGS_FILE = "onnx_config.json"
+MODEL_FILE = "model.onnx"
+QUANTIZED_MODEL_FILE = "model_quantized.onnx"
+INPUT_NAMES = ("input_ids", "attention_mask", "token_type_ids")
+
+
+class OnnxSentenceEncoder:
+    """Drop-in replacement for the parts of SentenceTransformer the backend uses."""
+
+    def __init__(self, directory: str, quantized: bool = False, threads: int = 0):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        with open(os.path.join(directory, SETTINGS_FILE), "r", encoding="utf-8") as f:
+            self.settings = json.load(f)
+        path = os.path.join(directory, QUANTIZED_MODEL_FILE if quantized else MODEL_FILE)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"ONNX model not found at {path}; export it first")
+
+        options = ort.SessionOptions()
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.tokenizer = AutoTokenizer.from_pretrained(directory)
+        self.max_seq_length = self.settings["max_seq_length"]
+        self.dim = self.settings["dim"]
+        logger.info("Loaded ONNX embedding model %s", path)
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def encode(
+        self,
+        sentences: Union[str, List[str]],
+        batch_size: int = 32,
+        show_progress_bar: bool = False,
+        convert_to_numpy: bool = True,
+        normalize_embeddings: bool = False,
+    ) -> np.ndarray:
+        """Embed `sentences` into a (n, dim) float32 array (a (dim,) vector for a single string)."""
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+
+        out = np.empty((len(sentences), self.dim), dtype=np.float32)
+        # Longest first, like SentenceTransformer, so each batch pads to a similar length
+        order = np.argsort([-len(s) for s in sentences], kind="stable")
+        for start in range(0, len(sentences), batch_size):
+            rows = order[start:start + batch_size]
+            out[rows] = self._encode_batch([sentences[i] for i in rows])
+
+        if normalize_embeddings or self.settings["normalize"]:
+            out /= np.clip(np.linalg.norm(out, axis=1, keepdims=True), 1e-12, None)
+        return out[0] if single else out
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        tokens = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self.max_seq_length,
+            return_tensors="np",
+        )
+        feed = {name: tokens[name].astype(np.int64) for name in self.input_names}
+        hidden = self.session.run(None, feed)[0]
+        if self.settings["pooling"] == "cls":
+            return hidden[:, 0]
+        mask = tokens["attention_mask"][..., None].astype(np.float32)
+        return (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+
+def export(model_name: str, directory: str, quantize: bool = False, opset: int = 14) -> None:
+    """Export a SentenceTransformer's transformer to ONNX, with its tokenizer and pooling settings.
+
+    Requires torch and sentence-transformers. With `quantize`, a dynamically
+    int8-quantized copy is written next to the float model.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name, device="cpu")
+    modules = {type(module).__name__: module for module in model}
+    pooling = modules.get("Pooling")
+    if pooling is None or not (pooling.pooling_mode_mean_tokens or pooling.pooling_mode_cls_token):
+        raise RuntimeError(f"{model_name} does not use mean or CLS pooling, which is all the ONNX backend supports")
+    transformer = modules["Transformer"]
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, MODEL_FILE)
+    sample = transformer.tokenizer(["An example sentence to trace the graph."], return_tensors="pt")
+    input_names = [name for name in INPUT_NAMES if name in sample]
+
+    class _Encoder(torch.nn.Module):
+        def __init__(self, auto_model):
+            super().__init__()
+            self.auto_model = auto_model
+
+        def forward(self, *inputs):
+            return self.auto_model(**dict(zip(input_names, inputs))).last_hidden_state
+
+    axes = {0: "batch", 1: "sequence"}
+    torch.onnx.export(
+        _Encoder(transformer.auto_model).eval(),
+        tuple(sample[name] for name in input_names),
+        path,
+        input_names=input_names,
+        output_names=["last_hidden_state"],
+        dynamic_axes={**{name: axes for name in input_names}, "last_hidden_state": axes},
+        opset_version=opset,
+    )
+    transformer.tokenizer.save_pretrained(directory)
+    settings = {
+        "source_model": model_name,
+        "pooling": "mean" if pooling.pooling_mode_mean_tokens else "cls",
+        "normalize": "Normalize" in modules,
+        "max_seq_length": model.max_seq_length,
+        "dim": model.get_sentence_embedding_dimension(),
+    }
+    with open(os.path.join(directory, SETTINGS_FILE), "w", encoding="utf-8") as f:
+        json.dump(settings, f, indent=2)
+    logger.info("Exported %s to %s", model_name, path)
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantized_path = os.path.join(directory, QUANTIZED_MODEL_FILE)
+        quantize_dynamic(path, quantized_path, weight_type=QuantType.QInt8)
+        logger.info("Wrote int8 model %s", quantized_path)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export a sentence-transformer model to ONNX")
+    parser.add_argument("model", help="SentenceTransformer model name or path")
+    parser.add_argument("directory", help="Output directory (EMBEDDING_ONNX_DIR)")
+    parser.add_argument("--quantize", action="store_true", help="Also write a dynamic int8 copy")
+    parser.add_argument("--opset", type=int, default=14)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    export(args.model, args.directory, quantize=args.quantize, opset=args.opset)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+PDF text extraction backends.
+
+Every backend works on a "payload": a path on disk or the raw document bytes, so
+worker processes can re-open the document themselves. Optional backends are only
+imported when first used.
+"""
+import io
+import logging
+import threading
+from typing import Dict, Iterator, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+Payload = Union[str, bytes]
+
+
+def _open(payload: Payload):
+    return open(payload, "rb") if isinstance(payload, str) else io.BytesIO(payload)
+
+
+class PdfBackend:
+    """A named text extractor. Subclasses implement `page_count` and `iter_pages`."""
+
+    name = ""
+    module = ""
+
+    def available(self) -> bool:
+        try:
+            __import__(self.module)
+            return True
+        except Exception:
+            return False
+
+    def page_count(self, payload: Payload) -> int:
+        raise NotImplementedError
+
+    def iter_pages(self, payload: Payload, start: int, end: int) -> Iterator[str]:
+        """Yield the text of pages [start, end), one string per page."""
+        raise NotImplementedError
+
+    def extract(self, payload: Payload, start: int, end: int) -> List[str]:
+        """Return the text of pages [start, end), one string per page."""
+        return list(self.iter_pages(payload, start, end))
+
+
+class PypdfBackend(PdfBackend):
+    name = "pypdf"
+
+    def _reader_class(self):
+        try:
+            # Prefer pypdf (actively maintained). Fall back to PyPDF2 if pypdf is not installed.
+            from pypdf import PdfReader  # type: ignore
+        except Exception:
+            from PyPDF2 import PdfReader  # type: ignore
+        return PdfReader
+
+    def available(self) -> bool:
+        try:
+            self._reader_class()
+            return True
+        except Exception:
+            return False
+
+    def page_count(self, payload: Payload) -> int:
+        with _open(payload) as f:
+            return len(self._reader_class()(f).pages)
+
+    def iter_pages(self, payload: Payload, start: int, end: int) -> Iterator[str]:
+        with _open(payload) as f:
+            reader = self._reader_class()(f)
+            for i in range(start, end):
+                # extract_text() is available in both pypdf and PyPDF2
+                yield reader.pages[i].extract_text() or ""
+
+
+# PDFium is not thread-safe: within one process, only one thread may call into it at a
+# time. Small PDFs are extracted on several CPU_POOL threads at once, so every call is
+# made under this lock (held per page, so documents still take turns page by page).
+# Pool workers are separate processes and run in parallel.
+_pdfium_lock = threading.Lock()
+
+
+class PdfiumBackend(PdfBackend):
+    name = "pypdfium2"
+    module = "pypdfium2"
+
+    def page_count(self, payload: Payload) -> int:
+        import pypdfium2 as pdfium
+
+        with _pdfium_lock:
+            pdf = pdfium.PdfDocument(payload)
+            try:
+                return len(pdf)
+            finally:
+                pdf.close()
+
+    def iter_pages(self, payload: Payload, start: int, end: int) -> Iterator[str]:
+        import pypdfium2 as pdfium
+
+        with _pdfium_lock:
+            pdf = pdfium.PdfDocument(payload)
+        try:
+            for i in range(start, end):
+                with _pdfium_lock:
+                    page = pdf[i]
+                    textpage = page.get_textpage()
+                    text = textpage.get_text_range()
+                    textpage.close()
+                    page.close()
+                yield text
+        finally:
+            with _pdfium_lock:
+                pdf.close()
+
+
+class PdfminerBackend(PdfBackend):
+    name = "pdfminer"
+    module = "pdfminer.high_level"
+
+    def page_count(self, payload: Payload) -> int:
+        from pdfminer.pdfpage import PDFPage
+
+        with _open(payload) as f:
+            return sum(1 for _ in PDFPage.get_pages(f))
+
+    def iter_pages(self, payload: Payload, start: int, end: int) -> Iterator[str]:
+        from pdfminer.high_level import extract_pages
+        from pdfminer.layout import LTTextContainer
+
+        with _open(payload) as f:
+            for page in extract_pages(f, page_numbers=range(start, end)):
+                yield "".join(element.get_text() for element in page if isinstance(element, LTTextContainer))
+
+
+PDF_BACKENDS: Dict[str, PdfBackend] = {
+    backend.name: backend
+    for backend in (PdfiumBackend(), PdfminerBackend(), PypdfBackend())
+}
+
+# "auto" picks the first installed backend in this order; pypdf is the fallback
+AUTO_ORDER = ("pypdfium2", "pypdf")
+
+
+def register_backend(backend: PdfBackend) -> None:
+    """Add or replace a backend in the registry."""
+    PDF_BACKENDS[backend.name] = backend
+
+
+def available_backends() -> List[str]:
+    return [name for name, backend in PDF_BACKENDS.items() if backend.available()]
+
+
+def get_backend(name: Optional[str] = None) -> PdfBackend:
+    """Resolve a backend by name; None or "auto" picks the fastest installed one.
+
+    Raises:
+        ValueError: if the backend is unknown or its library is not installed.
+    """
+    if not name or name == "auto":
+        for candidate in AUTO_ORDER:
+            backend = PDF_BACKENDS.get(candidate)
+            if backend is not None and backend.available():
+                return backend
+        raise ValueError("No PDF backend is installed")
+
+    backend = PDF_BACKENDS.get(name)
+    if backend is None:
+        raise ValueError(f"Unknown PDF backend {name!r}. Choose from: {', '.join(PDF_BACKENDS)}")
+    if not backend.available():
+        raise ValueError(f"PDF backend {name!r} is not installed")
+    return backend
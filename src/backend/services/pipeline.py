@@ -0,0 +1,126 @@
+import logging
+import queue
+import threading
+from typing import Callable, Iterable, Iterator, List, Optional
+
+from .. import config
+from .chunker import make_chunker
+from .document_loader import Source, iter_document_pages
+from .embedding_store import EmbeddingStore
+
+logger = logging.getLogger(__name__)
+
+# Sentinel telling the embedding worker that no more batches are coming
+_DONE = object()
+
+
+def _batched(items: Iterable, batch_size: int) -> Iterator[list]:
+    batch: list = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def ingest_document(
+    source: Source,
+    store: EmbeddingStore,
+    filename: Optional[str] = None,
+    pdf_backend: Optional[str] = None,
+    batch_size: Optional[int] = None,
+    progress: Optional[Callable[..., None]] = None,
+    finalize: bool = True,
+) -> int:
+    """
+    Stream a document into `store`: extract pages, chunk and embed with overlapped stages.
+
+    Extraction and chunking run on the calling thread and hand fixed-size batches of
+    chunks to an embedding thread through a bounded queue. When embedding falls
+    behind, the queue fills up and extraction waits, so intermediate memory is
+    bounded by the batch size rather than the document size.
+
+    Chunks are recorded as page-tagged spans over the document text, which are
+    attached to the store once ingestion finishes (see EmbeddingStore.attach_spans).
+    The store's index is then rebuilt for the document's size (EmbeddingStore.finalize),
+    unless `finalize` is False, which leaves that to the caller and keeps the exact
+    vectors readable until then.
+
+    If given, `progress` is called with keyword updates as work advances:
+    total_pages (PDFs only), pages_extracted and chunks_embedded. It may be called
+    from the embedding thread.
+
+    Returns:
+        The number of chunks added to the store.
+
+    Raises:
+        RuntimeError: if embedding fails (the error from EmbeddingStore.add_texts).
+    """
+    batch_size = batch_size or config.EMBED_BATCH_SIZE
+    batches: "queue.Queue" = queue.Queue(maxsize=max(1, config.INGEST_QUEUE_BATCHES))
+    errors: List[BaseException] = []
+
+    def report(**fields) -> None:
+        if progress is not None:
+            progress(**fields)
+
+    def embed_worker() -> None:
+        embedded = 0
+        while True:
+            batch = batches.get()
+            if batch is _DONE:
+                return
+            if errors:
+                # Keep draining so the producer never blocks on a dead consumer
+                continue
+            try:
+                store.add_texts(batch, store_texts=False)
+                embedded += len(batch)
+                report(chunks_embedded=embedded)
+            except BaseException as e:
+                errors.append(e)
+
+    worker = threading.Thread(target=embed_worker, name="embed-worker", daemon=True)
+    worker.start()
+
+    chunker = make_chunker(
+        tokenizer=getattr(store.model, "tokenizer", None),
+        max_seq_length=getattr(store.model, "max_seq_length", None),
+    )
+
+    def chunk_stream() -> Iterator[str]:
+        # Pages are fed in small groups so the tokenizer can work in batches
+        pages = iter_document_pages(
+            source,
+            filename=filename,
+            pdf_backend=pdf_backend,
+            on_page_count=lambda n: report(total_pages=n),
+        )
+        extracted = 0
+        for group in _batched(pages, config.CHUNK_PAGE_BATCH):
+            # TXT blocks all share page 1, so count distinct pages rather than items
+            extracted = max(extracted, group[-1][0])
+            report(pages_extracted=extracted)
+            yield from chunker.feed_pages(group)
+        yield from chunker.finish()
+
+    num_chunks = 0
+    try:
+        for batch in _batched(chunk_stream(), batch_size):
+            if errors:
+                break
+            batches.put(batch)
+            num_chunks += len(batch)
+    finally:
+        batches.put(_DONE)
+        worker.join()
+
+    if errors:
+        raise errors[0]
+    store.attach_spans(chunker.spans)
+    if finalize:
+        store.finalize()
+    logger.debug("Ingested %s: %d chunks in batches of %d", filename or "document", num_chunks, batch_size)
+    return num_chunks
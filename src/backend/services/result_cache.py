@@ -0,0 +1,178 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """Size-bounded LRU of analysis results on disk, with TTL eviction.
+
+    Each entry is one JSON file named after its key. The LRU order lives in memory
+    and is rebuilt from file modification times on startup, so the cache survives
+    restarts without a separate index file.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, ttl_seconds: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        # key -> (size in bytes, created_at)
+        self._entries: "OrderedDict[str, tuple[int, float]]" = OrderedDict()
+        self._total_bytes = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self._load()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _load(self) -> None:
+        found = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            found.append((stat.st_mtime, name[:-len(".json")], stat.st_size))
+        for mtime, key, size in sorted(found):
+            # Creation time is unknown until the entry is read; mtime is a safe lower bound
+            self._entries[key] = (size, mtime)
+            self._total_bytes += size
+        self._evict()
+        logger.debug("Result cache loaded %d entries (%d bytes)", len(self._entries), self._total_bytes)
+
+    def _drop(self, key: str) -> None:
+        size, _ = self._entries.pop(key)
+        self._total_bytes -= size
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self) -> None:
+        now = time.time()
+        for key in [k for k, (_, created) in self._entries.items() if now - created > self.ttl_seconds]:
+            self._drop(key)
+        while self._entries and self._total_bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+
+    def get(self, key: str) -> Optional[dict]:
+        """Return the cached result for `key`, or None if missing or expired."""
+        with self._lock:
+            if key not in self._entries:
+                return None
+            path = self._path(key)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    record = json.load(f)
+            except (OSError, ValueError):
+                logger.warning("Dropping unreadable result cache entry %s", key)
+                self._drop(key)
+                return None
+
+            created = record.get("created_at", 0.0)
+            if time.time() - created > self.ttl_seconds:
+                self._drop(key)
+                return None
+
+            size, _ = self._entries[key]
+            self._entries[key] = (size, created)
+            self._entries.move_to_end(key)
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            return record.get("value")
+
+    def delete(self, key: str) -> None:
+        """Remove the entry for `key`, if any."""
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+
+    def delete_prefix(self, prefix: str) -> None:
+        """Remove the entry for `prefix` and every entry whose key extends it with "."."""
+        with self._lock:
+            for key in [k for k in self._entries if k == prefix or k.startswith(f"{prefix}.")]:
+                self._drop(key)
+
+    def put(self, key: str, value: dict) -> None:
+        """Store `value` under `key`, evicting least recently used entries past the size cap."""
+        created = time.time()
+        payload = json.dumps({"created_at": created, "value": value})
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with self._lock:
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(payload)
+                os.replace(tmp_path, path)
+            except OSError:
+                logger.exception("Failed to write result cache entry %s", key)
+                return
+            if key in self._entries:
+                old_size, _ = self._entries.pop(key)
+                self._total_bytes -= old_size
+            size = len(payload.encode("utf-8"))
+            self._entries[key] = (size, created)
+            self._total_bytes += size
+            self._evict()
+
+
+class SingleFlight:
+    """Collapse concurrent calls for the same key into one computation.
+
+    The first caller for a key runs `fn`; callers arriving while it is running
+    await the same future and receive the same result (or exception).
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._waiters: Dict[str, int] = {}
+
+    def get(self, key: str) -> Optional[asyncio.Future]:
+        """The future of the computation running for `key`, if any. Await it through asyncio.shield."""
+        return self._inflight.get(key)
+
+    def waiters(self, key: str) -> int:
+        """How many callers of `run` are waiting for the computation for `key` besides the one running it."""
+        return self._waiters.get(key, 0)
+
+    async def run(self, key: str, fn: Callable[[], Awaitable]):
+        existing = self._inflight.get(key)
+        if existing is not None:
+            logger.debug("Attaching to in-flight computation for %s", key)
+            self._waiters[key] = self._waiters.get(key, 0) + 1
+            try:
+                return await asyncio.shield(existing)
+            finally:
+                self._waiters[key] -= 1
+                if not self._waiters[key]:
+                    del self._waiters[key]
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._inflight.pop(key, None)
@@ -0,0 +1,73 @@
+import logging
+import os
+import shutil
+import threading
+import time
+from typing import BinaryIO
+
+logger = logging.getLogger(__name__)
+
+
+class UploadStore:
+    """Optional on-disk retention of uploaded documents.
+
+    Files are named by content hash, so concurrent uploads never overwrite each
+    other and repeated uploads are stored once. After every write the directory is
+    pruned: files older than `retention_seconds` go first, then the oldest files
+    until the total size fits in `max_bytes`.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, retention_seconds: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.retention_seconds = retention_seconds
+        self._lock = threading.Lock()
+        if self.enabled:
+            os.makedirs(self.directory, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def save(self, stream: BinaryIO, digest: str, ext: str) -> None:
+        """Copy `stream` to `<digest><ext>` and restore its position afterwards."""
+        if not self.enabled:
+            return
+        path = os.path.join(self.directory, f"{digest}{ext}")
+        position = stream.tell()
+        try:
+            if os.path.exists(path):
+                os.utime(path)
+            else:
+                tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                stream.seek(0)
+                with open(tmp_path, "wb") as f:
+                    shutil.copyfileobj(stream, f)
+                os.replace(tmp_path, path)
+                logger.info("Retained upload %s", path)
+        except OSError:
+            logger.exception("Failed to retain upload %s", path)
+        finally:
+            stream.seek(position)
+        self.prune()
+
+    def prune(self) -> None:
+        with self._lock:
+            now = time.time()
+            files = []
+            for entry in os.scandir(self.directory):
+                if not entry.is_file() or entry.name.endswith(".tmp"):
+                    continue
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+            files.sort()
+
+            total = sum(size for _, size, _ in files)
+            for mtime, size, path in files:
+                if now - mtime <= self.retention_seconds and total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,144 @@
+"""
+FAISS index selection for normalized (cosine) embeddings.
+
+Vectors are L2-normalized and searched by inner product, so scores are cosine
+similarities (higher is closer). The index type follows the number of vectors:
+exact flat search for small sets, HNSW above FAISS_HNSW_MIN_VECTORS and IVF above
+FAISS_IVF_MIN_VECTORS, with scalar (SQ8) or product (PQ) quantization and optional
+PCA reduction. Compare configurations with `python -m benchmarks.bench_vector_index`.
+"""
+import logging
+import math
+
+import numpy as np
+
+from .. import config
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize rows in place (float32, C-contiguous) and return them."""
+    import faiss
+
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def _pq_subquantizers(dim: int) -> int:
+    # 8 dimensions per one-byte code, rounded down to a divisor of dim
+    m = max(1, dim // 8)
+    while dim % m:
+        m -= 1
+    return m
+
+
+def choose_index_spec(
+    num_vectors: int,
+    dim: int,
+    quantization: str = config.FAISS_QUANTIZATION,
+    pca_dim: int = config.FAISS_PCA_DIM,
+) -> str:
+    """Return the `faiss.index_factory` description to use for `num_vectors` vectors.
+
+    FAISS_INDEX overrides the choice with an explicit description.
+    """
+    if config.FAISS_INDEX != "auto":
+        return config.FAISS_INDEX
+    if num_vectors < config.FAISS_HNSW_MIN_VECTORS:
+        return "Flat"
+
+    prefix = ""
+    if 0 < pca_dim < dim:
+        prefix = f"PCA{pca_dim},"
+        dim = pca_dim
+
+    if num_vectors >= config.FAISS_IVF_MIN_VECTORS:
+        nlist = int(min(65536, max(16, 4 * math.sqrt(num_vectors))))
+        codes = {"sq8": "SQ8", "pq": f"PQ{_pq_subquantizers(dim)}", "none": "Flat"}[quantization]
+        return f"{prefix}IVF{nlist},{codes}"
+
+    # HNSW+PQ in FAISS only supports L2, so HNSW keeps full or SQ8 vectors
+    suffix = "" if quantization == "none" else "_SQ8"
+    return f"{prefix}HNSW{config.FAISS_HNSW_M}{suffix}"
+
+
+def build_index(spec: str, dim: int, vectors: np.ndarray = None):
+    """Create an inner-product index from `spec`, training and filling it with `vectors` if given."""
+    import faiss
+
+    index = faiss.index_factory(dim, spec, faiss.METRIC_INNER_PRODUCT)
+    try:
+        # IVF can't reconstruct stored vectors (needed for MMR) without an id -> list map
+        faiss.extract_index_ivf(index).make_direct_map()
+    except RuntimeError:
+        pass
+    if vectors is not None and len(vectors):
+        if not index.is_trained:
+            index.train(vectors)
+        index.add(vectors)
+    configure_search(index)
+    return index
+
+
+def configure_search(index) -> None:
+    """Apply the configured search-time accuracy knobs (IVF nprobe, HNSW efSearch)."""
+    import faiss
+
+    params = faiss.ParameterSpace()
+    for name, value in (("nprobe", config.FAISS_IVF_NPROBE), ("efSearch", config.FAISS_HNSW_EF_SEARCH)):
+        try:
+            params.set_index_parameter(index, name, value)
+        except RuntimeError:
+            # The index has no such parameter
+            pass
+
+
+def mmr(candidates: np.ndarray, scores: np.ndarray, top_k: int, lambda_: float) -> np.ndarray:
+    """Maximal marginal relevance: pick `top_k` of `candidates` that are relevant but not redundant.
+
+    `candidates` are normalized vectors and `scores` their similarity to the query. Each
+    step picks the candidate maximizing lambda_ * score - (1 - lambda_) * (highest
+    similarity to an already picked one). lambda_=1 keeps the plain ranking.
+    Returns positions into `candidates`, in pick order.
+    """
+    count = len(candidates)
+    top_k = min(top_k, count)
+    if lambda_ >= 1 or top_k == 0:
+        return np.argsort(-scores, kind="stable")[:top_k]
+    similarity = candidates @ candidates.T
+    # Highest similarity to a picked candidate (0 until something is picked)
+    redundancy = np.zeros(count, dtype=np.float32)
+    available = np.ones(count, dtype=bool)
+    picked = np.empty(top_k, dtype=np.int64)
+    for step in range(top_k):
+        gain = lambda_ * scores - (1 - lambda_) * redundancy
+        gain = np.where(available, gain, -np.inf)
+        best = int(np.argmax(gain))
+        picked[step] = best
+        available[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+    return picked
+
+
+def kmeans_representatives(vectors: np.ndarray, k: int, niter: int = 20, seed: int = 0):
+    """Cluster normalized `vectors` into `k` groups and return the member closest to each centroid.
+
+    Returns (positions into `vectors`, cluster sizes), largest cluster first.
+    Clusters that end up empty are skipped.
+    """
+    import faiss
+
+    k = min(k, len(vectors))
+    kmeans = faiss.Kmeans(vectors.shape[1], k, niter=niter, seed=seed, spherical=True, min_points_per_centroid=1)
+    kmeans.train(vectors)
+    _, labels = kmeans.index.search(vectors, 1)
+    labels = labels[:, 0]
+    closeness = np.einsum("ij,ij->i", vectors, kmeans.centroids[labels])
+    # Group by cluster, closest member first, and keep the first of each group
+    order = np.lexsort((-closeness, labels))
+    first = order[np.r_[True, labels[order][1:] != labels[order][:-1]]]
+    sizes = np.bincount(labels, minlength=k)[labels[first]]
+    by_size = np.argsort(-sizes, kind="stable")
+    return first[by_size], sizes[by_size]
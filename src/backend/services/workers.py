@@ -0,0 +1,90 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Callable, TypeVar
+
+from .. import config
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# LLM calls are async (services/llm_gateway.py), so the pool only runs CPU-bound work
+CPU_POOL = ThreadPoolExecutor(max_workers=config.CPU_WORKERS, thread_name_prefix="cpu-worker")
+
+
+async def run_cpu(fn: Callable[..., T], *args, **kwargs) -> T:
+    """Run blocking CPU work (extraction, chunking, embedding, search) off the event loop.
+
+    If the caller is cancelled, work that has not started is dropped; work already
+    running in a thread cannot be interrupted, so this waits for it before
+    re-raising, and whatever it reads (an upload, a store) stays valid until then.
+    """
+    future = CPU_POOL.submit(functools.partial(fn, *args, **kwargs))
+    try:
+        return await asyncio.wrap_future(future)
+    except asyncio.CancelledError:
+        if not future.cancel():
+            await asyncio.gather(asyncio.wrap_future(future), return_exceptions=True)
+        raise
+
+
+class Saturated(Exception):
+    """Raised when the admission queue is full."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Server is at capacity")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Bounded admission: `max_active` requests run, `max_queued` wait, the rest are rejected.
+
+    Rejecting early keeps latency predictable under load instead of letting an
+    unbounded backlog build up behind the worker pools.
+    """
+
+    def __init__(self, max_active: int, max_queued: int, retry_after: int):
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.retry_after = retry_after
+        self._semaphore = asyncio.Semaphore(max_active)
+        self._admitted = 0
+
+    @property
+    def active(self) -> int:
+        return min(self._admitted, self.max_active)
+
+    @property
+    def queued(self) -> int:
+        return max(0, self._admitted - self.max_active)
+
+    def has_capacity(self) -> bool:
+        return self._admitted < self.max_active + self.max_queued
+
+    @asynccontextmanager
+    async def admit(self):
+        if not self.has_capacity():
+            logger.warning("Rejecting request: %d active, %d queued", self.active, self.queued)
+            raise Saturated(self.retry_after)
+        self._admitted += 1
+        try:
+            async with self._semaphore:
+                yield
+        finally:
+            self._admitted -= 1
+
+
+analysis_admission = AdmissionController(
+    max_active=config.MAX_ACTIVE_ANALYSES,
+    max_queued=config.MAX_QUEUED_ANALYSES,
+    retry_after=config.ADMISSION_RETRY_AFTER_SECONDS,
+)
+# Generation holds no CPU slot while it waits on the LLM
+llm_admission = AdmissionController(
+    max_active=config.MAX_ACTIVE_LLM_ANALYSES,
+    max_queued=config.MAX_QUEUED_LLM_ANALYSES,
+    retry_after=config.ADMISSION_RETRY_AFTER_SECONDS,
+)
@@ -1,11 +1,63 @@
 import streamlit as st
 import requests
 import re
+import json
 from datetime import datetime
-import time
 
 API_URL = "http://127.0.0.1:8000/analyze"
 
+
+def show_progress(snapshot, progress_bar, status_text):
+    """Reflect one progress snapshot from the backend in the progress widgets."""
+    stage = snapshot["stage"]
+    progress = snapshot["progress"]
+    if stage == "ingesting":
+        total = progress["total_pages"]
+        fraction = progress["pages_extracted"] / total if total else 0
+        progress_bar.progress(0.05 + 0.55 * min(fraction, 1.0))
+        pages = f"page {progress['pages_extracted']}/{total}" if total else "reading text"
+        status_text.info(f"📄 Extracting & embedding: {pages} · {progress['chunks_embedded']} chunks embedded")
+    elif stage == "retrieving":
+        progress_bar.progress(0.65)
+        status_text.info(f"🔍 Finding key passages in {progress['chunks_embedded']} chunks...")
+    elif stage == "generating":
+        progress_bar.progress(0.75)
+        status_text.info("⏳ Processing with Gemini AI...")
+    elif stage == "queued":
+        status_text.info("🕒 Waiting for a free worker...")
+
+
+def read_analysis_stream(response, progress_bar, status_text, live_output):
+    """Read the server-sent events of POST /analyze/?stream=true as they arrive.
+
+    Progress updates drive the progress widgets and insight text is rendered into
+    `live_output` token by token. Returns (data, error_message).
+    """
+    data, pieces = {}, []
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+        event = json.loads(line[len("data:"):])
+        kind = event.pop("type")
+        if kind == "progress":
+            show_progress(event, progress_bar, status_text)
+        elif kind == "meta":
+            data.update(event)
+            progress_bar.progress(0.8)
+            status_text.info("✍️ Writing insights...")
+        elif kind == "delta":
+            pieces.append(event["text"])
+            live_output.markdown("".join(pieces))
+        elif kind == "error":
+            return None, event["detail"]
+        elif kind == "done":
+            progress_bar.progress(1.0)
+            data.update(event)
+            data["insights"] = "".join(pieces)
+            return data, None
+    return None, "Analysis did not finish"
+
+
 # Page configuration with modern theme
 st.set_page_config(
     page_title="Document Insight Generator",
@@ -504,25 +556,20 @@ with col_main:
         
         progress_bar = st.progress(0)
         status_text = st.empty()
+        live_output = st.empty()
         
         files = {
             "file": (uploaded_file.name, uploaded_file, uploaded_file.type)
         }
 
         try:
-            # Simulate progress
-            for i in range(30):
-                progress_bar.progress(i / 100)
-                time.sleep(0.01)
-            
-            status_text.info("⏳ Processing with Gemini AI...")
-            
-            response = requests.post(API_URL, files=files, timeout=300)
-            
-            # Complete progress
-            for i in range(30, 101):
-                progress_bar.progress(i / 100)
-                time.sleep(0.01)
+            status_text.info("📤 Uploading document...")
+
+            # Stream progress and then the insights themselves as they are generated
+            response = requests.post(API_URL, params={"stream": "true"}, files=files, stream=True, timeout=300)
+            data, error_msg = None, None
+            if response.status_code == 200:
+                data, error_msg = read_analysis_stream(response, progress_bar, status_text, live_output)
             
         except requests.exceptions.RequestException as e:
             progress_bar.empty()
@@ -540,16 +587,22 @@ with col_main:
         else:
             progress_bar.empty()
             status_text.empty()
+            live_output.empty()
             
             if response.status_code != 200:
                 error_msg = response.json().get("detail", response.text) if response.headers.get("content-type") == "application/json" else response.text
                 st.error(f"❌ **Backend Error:** {error_msg}")
+            elif error_msg:
+                st.error(f"❌ **Backend Error:** {error_msg}")
             else:
-                data = response.json()
-                
                 # Success animation
                 st.balloons()
                 st.success("✅ Analysis Complete! Insights Ready", icon="✨")
+                if data.get("failed_sections"):
+                    st.warning(
+                        f"⚠️ Some sections could not be generated: {', '.join(data['failed_sections'])}. "
+                        "Analyze the document again to retry them."
+                    )
                 
                 st.markdown("---")
                 